@@ -136,6 +136,27 @@ def swish(x):
 
 ACT2FN = {"gelu": gelu, "relu": torch.nn.functional.relu, "swish": swish}
 
+
+def gather_cls(hidden_states, cls_index=None):
+    """Hidden states of the [CLS] tokens: position 0 of every row, or the flattened
+    positions `cls_index` ([num_examples]) when several examples are packed in a row.
+    """
+    if cls_index is None:
+        return hidden_states[:, 0]
+    return hidden_states.reshape(-1, hidden_states.size(-1)).index_select(0, cls_index)
+
+
+def extend_attention_mask(attention_mask):
+    """Turn a [batch_size, seq_length] padding mask, or a [batch_size, seq_length, seq_length]
+    block diagonal mask of packed sequences, into an additive mask broadcastable over the heads.
+    """
+    if attention_mask.dim() == 3:
+        extended_attention_mask = attention_mask.unsqueeze(1)
+    else:
+        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
+    extended_attention_mask = extended_attention_mask.to(dtype=torch.float32) # fp16 compatibility
+    return (1.0 - extended_attention_mask) * -10000.0
+
 class BertConfig(object):
     """Configuration class to store the configuration of a `BertModel`.
     """
@@ -257,10 +278,11 @@ class BertEmbeddings(nn.Module):
         self.LayerNorm = BertLayerNorm(config.hidden_size, eps=1e-12)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
-    def forward(self, input_ids, token_type_ids=None):
-        seq_length = input_ids.size(1)
-        position_ids = torch.arange(seq_length, dtype=torch.long, device=input_ids.device)
-        position_ids = position_ids.unsqueeze(0).expand_as(input_ids)
+    def forward(self, input_ids, token_type_ids=None, position_ids=None):
+        if position_ids is None:
+            seq_length = input_ids.size(1)
+            position_ids = torch.arange(seq_length, dtype=torch.long, device=input_ids.device)
+            position_ids = position_ids.unsqueeze(0).expand_as(input_ids)
         if token_type_ids is None:
             token_type_ids = torch.zeros_like(input_ids)
 
@@ -301,7 +323,6 @@ class q_Linear(nn.Module):
         #print("------------------------- Before Quantization ----------------------------")
         #print("data and org must be equal")
         #print("weight.data.sum() = ",self.weight.data.mean())
-        print("hi"*20)
         if not hasattr(self.weight,'org'):
             self.weight.org=self.weight.data.clone()
         #print("weight.org.sum() = ", self.weight.org.mean())
@@ -592,7 +613,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers_2.append(y)
                     all_encoder_layers_3.append(z)
                 
-                return _, all_encoder_layers_2, all_encoder_layers_3
+                return None, all_encoder_layers_2, all_encoder_layers_3
             
             elif NL_mode == 2:
                 x = self.layer[0](hidden_states, attention_mask, mode =True)
@@ -637,7 +658,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers.append(x)
                     all_encoder_layers_3.append(z)
                 
-                return all_encoder_layers, _, all_encoder_layers_3
+                return all_encoder_layers, None, all_encoder_layers_3
     
             elif NL_mode == 3:
                 x = self.layer[0](hidden_states, attention_mask, mode =True)
@@ -682,7 +703,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers.append(x)
                     all_encoder_layers_2.append(y)
                 
-                return all_encoder_layers, all_encoder_layers_2, _
+                return all_encoder_layers, all_encoder_layers_2, None
 
         elif self.num_layer == 6:
             if NL_mode == 0:
@@ -883,7 +904,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers_2.append(y)
                     all_encoder_layers_3.append(z)
                 
-                return _, all_encoder_layers_2, all_encoder_layers_3
+                return None, all_encoder_layers_2, all_encoder_layers_3
             
             elif NL_mode == 2:
                 x = self.layer[0](hidden_states, attention_mask)
@@ -964,7 +985,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers.append(x)
                     all_encoder_layers_3.append(z)
                 
-                return all_encoder_layers, _, all_encoder_layers_3
+                return all_encoder_layers, None, all_encoder_layers_3
     
             elif NL_mode == 3:
                 x = self.layer[0](hidden_states, attention_mask)
@@ -1045,7 +1066,7 @@ class BertEncoder_NL(nn.Module):
                     all_encoder_layers.append(x)
                     all_encoder_layers_2.append(y)
                 
-                return all_encoder_layers, all_encoder_layers_2, _
+                return all_encoder_layers, all_encoder_layers_2, None
             
 class BertPooler(nn.Module):
     def __init__(self, config):
@@ -1053,10 +1074,10 @@ class BertPooler(nn.Module):
         self.dense = nn.Linear(config.hidden_size, config.hidden_size)
         self.activation = nn.Tanh()
 
-    def forward(self, hidden_states):
+    def forward(self, hidden_states, cls_index=None):
         # We "pool" the model by simply taking the hidden state corresponding
-        # to the first token.
-        first_token_tensor = hidden_states[:, 0]
+        # to the first token (of every packed example if cls_index is given).
+        first_token_tensor = gather_cls(hidden_states, cls_index)
         pooled_output = self.dense(first_token_tensor)
         pooled_output = self.activation(pooled_output)
         return pooled_output
@@ -1299,6 +1320,12 @@ class BertModel(BertPreTrainedModel):
             input sequence length in the current batch. It's the mask that we typically use for attention when
             a batch has varying length sentences.
         `output_all_encoded_layers`: boolean which controls the content of the `encoded_layers` output as described below. Default: `True`.
+        `position_ids`: an optional torch.LongTensor of shape [batch_size, sequence_length]. Used with packed
+            sequences, where positions restart at 0 for every example in a row. In that case `attention_mask`
+            is a block diagonal torch.LongTensor of shape [batch_size, sequence_length, sequence_length].
+        `cls_index`: an optional torch.LongTensor of shape [num_examples] with the flattened positions
+            (row * sequence_length + offset) of the [CLS] token of every packed example. The pooled output
+            then has one row per example, in the order of `cls_index`.
 
     Outputs: Tuple of (encoded_layers, pooled_output)
         `encoded_layers`: controled by `output_all_encoded_layers` argument:
@@ -1332,7 +1359,8 @@ class BertModel(BertPreTrainedModel):
         self.pooler = BertPooler(config)
         self.apply(self.init_bert_weights)
     
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True,
+                position_ids=None, cls_index=None):
         if attention_mask is None:
             attention_mask = torch.ones_like(input_ids)
         if token_type_ids is None:
@@ -1343,23 +1371,20 @@ class BertModel(BertPreTrainedModel):
         # So we can broadcast to [batch_size, num_heads, from_seq_length, to_seq_length]
         # this attention mask is more simple than the triangular masking of causal attention
         # used in OpenAI GPT, we just need to prepare the broadcast dimension here.
-        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
-
+        # Packed sequences already come with a [batch_size, from_seq_length, to_seq_length] mask.
         # Since attention_mask is 1.0 for positions we want to attend and 0.0 for
         # masked positions, this operation will create a tensor which is 0.0 for
         # positions we want to attend and -10000.0 for masked positions.
         # Since we are adding it to the raw scores before the softmax, this is
         # effectively the same as removing these entirely.
-        #extended_attention_mask = extended_attention_mask.to(dtype=next(self.parameters()).dtype) # fp16 compatibility
-        extended_attention_mask = extended_attention_mask.to(dtype=torch.float32) # fp16 compatibility
-        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        extended_attention_mask = extend_attention_mask(attention_mask)
 
-        embedding_output = self.embeddings(input_ids, token_type_ids)
+        embedding_output = self.embeddings(input_ids, token_type_ids, position_ids)
         encoded_layers = self.encoder(embedding_output,
                                       extended_attention_mask,
                                       output_all_encoded_layers=output_all_encoded_layers)
         sequence_output = encoded_layers[-1]
-        pooled_output = self.pooler(sequence_output)
+        pooled_output = self.pooler(sequence_output, cls_index)
         if not output_all_encoded_layers:
             encoded_layers = encoded_layers[-1]
         return encoded_layers, pooled_output
@@ -1372,7 +1397,8 @@ class BertModel_NL(BertPreTrainedModel):
         self.pooler = BertPooler(config)
         self.apply(self.init_bert_weights)
     
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True, NL_mode = 0):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True, NL_mode = 0,
+                position_ids=None, cls_index=None):
         if attention_mask is None:
             attention_mask = torch.ones_like(input_ids)
         if token_type_ids is None:
@@ -1383,17 +1409,15 @@ class BertModel_NL(BertPreTrainedModel):
         # So we can broadcast to [batch_size, num_heads, from_seq_length, to_seq_length]
         # this attention mask is more simple than the triangular masking of causal attention
         # used in OpenAI GPT, we just need to prepare the broadcast dimension here.
-        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
-
+        # Packed sequences already come with a [batch_size, from_seq_length, to_seq_length] mask.
         # Since attention_mask is 1.0 for positions we want to attend and 0.0 for
         # masked positions, this operation will create a tensor which is 0.0 for
         # positions we want to attend and -10000.0 for masked positions.
         # Since we are adding it to the raw scores before the softmax, this is
         # effectively the same as removing these entirely.
-        extended_attention_mask = extended_attention_mask.to(dtype=torch.float32) # fp16 compatibility
-        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        extended_attention_mask = extend_attention_mask(attention_mask)
 
-        embedding_output = self.embeddings(input_ids, token_type_ids)
+        embedding_output = self.embeddings(input_ids, token_type_ids, position_ids)
         encoded_layers, encoded_layers_2, encoded_layers_3 = self.encoder.forward(embedding_output,
                                       extended_attention_mask,
                                       output_all_encoded_layers=output_all_encoded_layers, NL_mode = NL_mode)
@@ -1401,9 +1425,9 @@ class BertModel_NL(BertPreTrainedModel):
             sequence_output = encoded_layers[-1]
             sequence_output_2 = encoded_layers_2[-1]
             sequence_output_3 = encoded_layers_3[-1]
-            pooled_output = self.pooler(sequence_output)
-            pooled_output_2 = self.pooler(sequence_output_2)
-            pooled_output_3 = self.pooler(sequence_output_3)
+            pooled_output = self.pooler(sequence_output, cls_index)
+            pooled_output_2 = self.pooler(sequence_output_2, cls_index)
+            pooled_output_3 = self.pooler(sequence_output_3, cls_index)
             if not output_all_encoded_layers:
                 encoded_layers = encoded_layers[-1]
                 encoded_layers_2 = encoded_layers_2[-1]
@@ -1415,39 +1439,39 @@ class BertModel_NL(BertPreTrainedModel):
             sequence_output_2 = encoded_layers_2[-1]
             sequence_output_3 = encoded_layers_3[-1]
             #pooled_output = self.pooler(sequence_output)
-            pooled_output_2 = self.pooler(sequence_output_2)
-            pooled_output_3 = self.pooler(sequence_output_3)
+            pooled_output_2 = self.pooler(sequence_output_2, cls_index)
+            pooled_output_3 = self.pooler(sequence_output_3, cls_index)
             if not output_all_encoded_layers:
                 #encoded_layers = encoded_layers[-1]
                 encoded_layers_2 = encoded_layers_2[-1]
                 encoded_layers_3 = encoded_layers_3[-1]
-            return _, encoded_layers_2, encoded_layers_3, _, pooled_output_2, pooled_output_3
+            return None, encoded_layers_2, encoded_layers_3, None, pooled_output_2, pooled_output_3
 
         elif NL_mode == 2:
             sequence_output = encoded_layers[-1]
             #sequence_output_2 = encoder_layers_2[-1]
             sequence_output_3 = encoded_layers_3[-1]
-            pooled_output = self.pooler(sequence_output)
+            pooled_output = self.pooler(sequence_output, cls_index)
             #pooled_output_2 = self.pooler(sequence_output_2)
-            pooled_output_3 = self.pooler(sequence_output_3)
+            pooled_output_3 = self.pooler(sequence_output_3, cls_index)
             if not output_all_encoded_layers:
                 encoded_layers = encoded_layers[-1]
                 #encoded_layers_2 = encoded_layers_2[-1]
                 encoded_layers_3 = encoded_layers_3[-1]
-            return encoded_layers, _, encoded_layers_3, pooled_output, _, pooled_output_3
+            return encoded_layers, None, encoded_layers_3, pooled_output, None, pooled_output_3
 
         elif NL_mode == 3:
             sequence_output = encoded_layers[-1]
             sequence_output_2 = encoded_layers_2[-1]
             #sequence_output_3 = encoded_layers_3[-1]
-            pooled_output = self.pooler(sequence_output)
-            pooled_output_2 = self.pooler(sequence_output_2)
+            pooled_output = self.pooler(sequence_output, cls_index)
+            pooled_output_2 = self.pooler(sequence_output_2, cls_index)
             #pooled_output_3 = self.pooler(sequence_output_3)
             if not output_all_encoded_layers:
                 encoded_layers = encoded_layers[-1]
                 encoded_layers_2 = encoded_layers_2[-1]
                 #encoded_layers_3 = encoded_layers_3[-1]
-            return encoded_layers, encoded_layers_2, _, pooled_output, pooled_output_2, _
+            return encoded_layers, encoded_layers_2, None, pooled_output, pooled_output_2, None
 
 class BertForPreTraining(BertPreTrainedModel):
     """BERT model with pre-training heads.
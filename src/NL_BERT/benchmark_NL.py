@@ -0,0 +1,254 @@
+"""
+File used to benchmark the original and NL student encoders on CPU with random weights.
+
+Example:
+    python benchmark_NL.py --output bench.json
+    python benchmark_NL.py --output bench_new.json --baseline bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import time
+
+import numpy as np
+import torch
+
+from BERT.pytorch_pretrained_bert.modeling import BertConfig
+from utils.modeling import BertForSequenceClassificationEncoder, BertForSequenceClassificationEncoder_NL
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# BertEncoder_NL only defines the 3 and 6 layer students
+NL_SUPPORTED_LAYERS = [3, 6]
+RESULT_KEYS = ['model', 'layers', 'NL_mode', 'seq_length', 'batch_size']
+
+
+def int_list(s):
+    return [int(x) for x in s.split(',') if x != '']
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", default='3,6,12', type=int_list,
+                        help="comma separated number of student layers")
+    parser.add_argument("--NL_modes", default='0,1,2,3', type=int_list,
+                        help="comma separated NL modes to benchmark for the NL encoder")
+    parser.add_argument("--seq_lengths", default='32,128', type=int_list,
+                        help="comma separated sequence lengths")
+    parser.add_argument("--batch_sizes", default='1,8,32', type=int_list,
+                        help="comma separated batch sizes")
+    parser.add_argument("--models", default='Original,NL', type=lambda s: s.split(','),
+                        help="comma separated model types, Original and/or NL")
+    parser.add_argument("--warmup", default=3, type=int,
+                        help="number of untimed iterations before measuring")
+    parser.add_argument("--iters", default=20, type=int,
+                        help="number of timed iterations")
+    parser.add_argument("--threads", default=None, type=int,
+                        help="number of intra-op threads, default is the torch default")
+    parser.add_argument("--bert_config", default=None, type=str,
+                        help="bert_config.json to use, default is bert-base-uncased dimensions")
+    parser.add_argument("--seed", default=42, type=int,
+                        help="random seed for the weights and inputs")
+    parser.add_argument("--output", default=None, type=str,
+                        help="json file the results are written to")
+    parser.add_argument("--baseline", default=None, type=str,
+                        help="json file of an earlier run to compare against")
+    parser.add_argument("--tolerance", default=0.05, type=float,
+                        help="relative throughput drop reported as a regression in comparison mode")
+    parser.add_argument("--fail_on_regression", action='store_true',
+                        help="exit with a non-zero status if a regression is found")
+    return parser
+
+
+def make_config(bert_config):
+    if bert_config is not None:
+        return BertConfig(bert_config)
+    return BertConfig(30522, hidden_size=768, num_attention_heads=12, intermediate_size=3072)
+
+
+def build_model(model_type, num_layers, bert_config):
+    # the encoders overwrite config.num_hidden_layers, so every model gets its own config
+    config = make_config(bert_config)
+    if model_type == 'NL':
+        return BertForSequenceClassificationEncoder_NL(config, num_hidden_layers=num_layers)
+    return BertForSequenceClassificationEncoder(config, num_hidden_layers=num_layers)
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's high water mark of the resident set size so that peaks are measured per configuration.
+    Only Linux supports this; elsewhere the peak is the process-wide maximum.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, OSError):
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024. * 1024.) if platform.system() == 'Darwin' else maxrss / 1024.
+
+
+def summarize(latencies, batch_size, seq_length):
+    latencies = np.array(latencies)
+    return {
+        'mean_ms': float(latencies.mean() * 1000),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p90_ms': float(np.percentile(latencies, 90) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'examples_per_s': float(batch_size / latencies.mean()),
+        'tokens_per_s': float(batch_size * seq_length / latencies.mean()),
+    }
+
+
+def run_one(model, model_type, NL_mode, input_ids, segment_ids, input_mask, args, backward):
+    def step():
+        if model_type == 'NL':
+            outputs = model(input_ids, segment_ids, input_mask, NL_mode=NL_mode)
+            pooled = [o for o in outputs[3:] if o is not None]
+        else:
+            pooled = [model(input_ids, segment_ids, input_mask)[1]]
+        if backward:
+            sum(p.sum() for p in pooled).backward()
+            model.zero_grad()
+
+    latencies = []
+    for i in range(args.warmup + args.iters):
+        start = time.perf_counter()
+        if backward:
+            step()
+        else:
+            with torch.no_grad():
+                step()
+        if i >= args.warmup:
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_benchmark(args):
+    results = []
+    for model_type in args.models:
+        for num_layers in args.layers:
+            if model_type == 'NL' and num_layers not in NL_SUPPORTED_LAYERS:
+                logger.info('skipping NL encoder with %d layers, only %s are supported' % (num_layers, NL_SUPPORTED_LAYERS))
+                continue
+            torch.manual_seed(args.seed)
+            model = build_model(model_type, num_layers, args.bert_config)
+            # dropout stays active so that forward+backward matches training
+            model.train()
+            modes = args.NL_modes if model_type == 'NL' else [None]
+            for NL_mode in modes:
+                for seq_length in args.seq_lengths:
+                    for batch_size in args.batch_sizes:
+                        input_ids = torch.randint(1, model.bert.embeddings.word_embeddings.num_embeddings,
+                                                  (batch_size, seq_length), dtype=torch.long)
+                        segment_ids = torch.zeros_like(input_ids)
+                        input_mask = torch.ones_like(input_ids)
+                        reset_peak_rss()
+                        forward = run_one(model, model_type, NL_mode, input_ids, segment_ids, input_mask, args, False)
+                        forward_backward = run_one(model, model_type, NL_mode, input_ids, segment_ids, input_mask, args, True)
+                        result = {
+                            'model': model_type,
+                            'layers': num_layers,
+                            'NL_mode': NL_mode,
+                            'seq_length': seq_length,
+                            'batch_size': batch_size,
+                            'forward': summarize(forward, batch_size, seq_length),
+                            'forward_backward': summarize(forward_backward, batch_size, seq_length),
+                            'peak_rss_mb': peak_rss_mb(),
+                        }
+                        logger.info('%-8s L=%-2d mode=%-4s seq=%-4d bs=%-3d fwd p50 %8.2f ms  fwd+bwd p50 %8.2f ms  rss %8.1f MB'
+                                    % (model_type, num_layers, NL_mode, seq_length, batch_size,
+                                       result['forward']['p50_ms'], result['forward_backward']['p50_ms'], result['peak_rss_mb']))
+                        results.append(result)
+            del model
+    return results
+
+
+def result_key(result):
+    return tuple(result[k] for k in RESULT_KEYS)
+
+
+def compare(results, baseline_results, tolerance):
+    """
+    Compare the throughput of every configuration present in both runs.
+    :return: list of the keys of the configurations whose throughput dropped by more than `tolerance`
+    """
+    baseline = {result_key(r): r for r in baseline_results}
+    regressions = []
+    logger.info('%-40s %-16s %10s %10s %8s' % ('configuration', 'phase', 'baseline', 'current', 'speedup'))
+    for result in results:
+        key = result_key(result)
+        if key not in baseline:
+            continue
+        for phase in ['forward', 'forward_backward']:
+            old = baseline[key][phase]['examples_per_s']
+            new = result[phase]['examples_per_s']
+            speedup = new / old if old > 0 else float('inf')
+            flag = ''
+            if speedup < 1 - tolerance:
+                flag = 'REGRESSION'
+                regressions.append(key + (phase,))
+            elif speedup > 1 + tolerance:
+                flag = 'improved'
+            logger.info('%-40s %-16s %10.2f %10.2f %7.2fx %s'
+                        % (' '.join('%s=%s' % kv for kv in zip(RESULT_KEYS, key)), phase, old, new, speedup, flag))
+    return regressions
+
+
+def main():
+    args = benchmark_parser().parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    results = run_benchmark(args)
+    report = {
+        'meta': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'num_threads': torch.get_num_threads(),
+            'warmup': args.warmup,
+            'iters': args.iters,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('results written to %s' % args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            logger.info('%d regressions found' % len(regressions))
+            if args.fail_on_regression:
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+File used to export one trained student (encoder plus classifier) to TorchScript or ONNX with dynamic batch and
+sequence axes, check its outputs against the eager model and compare their CPU latency.
+
+Example:
+    python export_student.py --bert_config data/models/pretrained/bert-base-uncased/bert_config.json \
+        --model_type NL --student_hidden_layers 6 --NL_mode 0 --path Negotiator --num_labels 2 \
+        --encoder_checkpoint NL_run_1/BERT.encoder_loss_all.pkl --cls_checkpoint NL_run_1/BERT.cls_loss_all.pkl \
+        --format onnx --output student.onnx
+"""
+
+import argparse
+import logging
+
+import torch
+
+from BERT.pytorch_pretrained_bert.modeling import BertConfig
+from utils.modeling import BertForSequenceClassificationEncoder, BertForSequenceClassificationEncoder_NL, FCClassifierForSequenceClassification
+from utils.utils import load_model
+from utils.export import STUDENT_PATHS, build_export_student, export_torchscript, export_onnx, load_onnx_runner, eager_forward, check_parity, compare_latency
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def export_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bert_config", required=True, type=str,
+                        help="bert_config.json of the student")
+    parser.add_argument("--model_type", default='Original', type=str,
+                        help="Model type: one of Original or NL")
+    parser.add_argument("--student_hidden_layers", required=True, type=int,
+                        help="number of transformer layers of the student")
+    parser.add_argument("--NL_mode", default=0, type=int,
+                        help="NL mode the student was trained with, only used for NL")
+    parser.add_argument("--path", default='Negotiator', type=str,
+                        help="student path to export for NL, one of %s" % ', '.join(STUDENT_PATHS))
+    parser.add_argument("--num_labels", default=2, type=int,
+                        help="number of labels of the classifier")
+    parser.add_argument("--encoder_checkpoint", default=None, type=str,
+                        help="check point for student encoder, random weights if not given")
+    parser.add_argument("--cls_checkpoint", default=None, type=str,
+                        help="check point for student classifier, random weights if not given")
+    parser.add_argument("--format", default='torchscript', type=str,
+                        help="export format, torchscript or onnx")
+    parser.add_argument("--output", required=True, type=str,
+                        help="file the exported student is written to")
+    parser.add_argument("--opset_version", default=11, type=int,
+                        help="ONNX opset version")
+    parser.add_argument("--benchmark_batch_size", default=8, type=int,
+                        help="batch size for the latency comparison, 0 skips it")
+    parser.add_argument("--benchmark_seq_length", default=128, type=int,
+                        help="sequence length for the latency comparison")
+    return parser
+
+
+def main():
+    args = export_parser().parse_args()
+    # load_model expects the training arguments
+    args.n_gpu, args.device, args.fp16 = 0, torch.device('cpu'), False
+
+    config = BertConfig(args.bert_config)
+    if args.model_type == 'NL':
+        encoder = BertForSequenceClassificationEncoder_NL(config, num_hidden_layers=args.student_hidden_layers)
+    else:
+        encoder = BertForSequenceClassificationEncoder(config, num_hidden_layers=args.student_hidden_layers)
+    classifier = FCClassifierForSequenceClassification(config, args.num_labels, config.hidden_size, 0)
+    encoder = load_model(encoder, args.encoder_checkpoint, args, 'student', verbose=True)
+    classifier = load_model(classifier, args.cls_checkpoint, args, 'classifier', verbose=True)
+    encoder.eval()
+    classifier.eval()
+
+    student = build_export_student(encoder, classifier, args.model_type, args.NL_mode, args.path)
+    if args.format == 'torchscript':
+        exported = export_torchscript(student, args.output)
+    elif args.format == 'onnx':
+        export_onnx(student, args.output, opset_version=args.opset_version)
+        exported = load_onnx_runner(args.output)
+    else:
+        raise ValueError('format should be torchscript or onnx')
+
+    eager = eager_forward(encoder, classifier, args.model_type, args.NL_mode, args.path)
+    if exported is not None:
+        check_parity(eager, exported, [(1, 7, 0), (3, 37, 5), (5, 128, 60)], config.vocab_size)
+        logger.info('exported student matches the eager model')
+
+    if args.benchmark_batch_size > 0:
+        runners = {'eager': eager, 'straight': student}
+        if exported is not None:
+            runners[args.format] = exported
+        compare_latency(runners, args.benchmark_batch_size, args.benchmark_seq_length, config.vocab_size)
+
+
+if __name__ == '__main__':
+    main()
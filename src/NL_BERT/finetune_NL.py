@@ -16,12 +16,15 @@ from BERT.pytorch_pretrained_bert.modeling import BertConfig
 from BERT.pytorch_pretrained_bert.optimization import BertAdam, warmup_linear
 from BERT.pytorch_pretrained_bert.tokenization import BertTokenizer
 from BERT.pytorch_pretrained_bert.quantization_modules import calculate_next_quantization_parts
-from utils.argument_parser import default_parser, get_predefine_argv, complete_argument
+from utils.argument_parser import default_parser, get_predefine_argv, complete_argument, check_pack_sequences
 from utils.nli_data_processing import processors, output_modes
 from utils.data_processing import get_task_dataloader, init_model_NL
 from utils.modeling import BertForSequenceClassificationEncoder, FCClassifierForSequenceClassification, FullFCClassifierForSequenceClassification
 from utils.utils import load_model, count_parameters, eval_model_dataloader_nli_NL, eval_model_dataloader, compute_metrics, load_model_NL
 from utils.KD_loss import distillation_loss, patience_loss
+from utils.profiler import StepProfiler, FrozenParamChecker
+from utils.path_sampling import PathSampler, parse_path_probs
+from utils.export import STUDENT_PATHS
 from envs import HOME_DATA_FOLDER
 from BERT.pytorch_pretrained_bert.quantization_modules import quantization
 
@@ -52,6 +55,14 @@ output_dir_fixed = args.output_dir
 load_model_dir_fixed = args.load_model_dir
 layer_initialization_fixed = args.layer_initialization
 teacher_prediction_fixed = args.teacher_prediction
+profile_every_fixed = args.profile_every
+frozen_check_every_fixed = args.frozen_check_every
+pack_sequences_fixed = args.pack_sequences
+sample_paths_fixed = args.sample_paths
+path_sampling_fixed = args.path_sampling
+path_sampling_probs_fixed = args.path_sampling_probs
+path_sampling_final_probs_fixed = args.path_sampling_final_probs
+path_sampling_anneal_steps_fixed = args.path_sampling_anneal_steps
 
 # Note that args.NL_mode = 2 is equivalent to Dual Learning
 NL_mode_fixed = args.NL_mode
@@ -100,6 +111,15 @@ if NL_mode_fixed is not None:
     args.NL_mode = NL_mode_fixed
 if teacher_prediction_fixed is not None:
     args.teacher_prediction = teacher_prediction_fixed
+args.profile_every = profile_every_fixed
+args.frozen_check_every = frozen_check_every_fixed
+args.pack_sequences = pack_sequences_fixed
+args.sample_paths = sample_paths_fixed
+args.path_sampling = path_sampling_fixed
+args.path_sampling_probs = path_sampling_probs_fixed
+args.path_sampling_final_probs = path_sampling_final_probs_fixed
+args.path_sampling_anneal_steps = path_sampling_anneal_steps_fixed
+check_pack_sequences(args)
     
 args.model_type = model_type_fixed
 args.raw_data_dir = os.path.join(HOME_DATA_FOLDER, 'data_raw', args.task_name)
@@ -168,19 +188,22 @@ if args.do_train:
         if args.kd_model == 'kd':
             train_examples, train_dataloader, _ = get_task_dataloader(task_name, read_set, tokenizer, args, SequentialSampler,
                                                                       batch_size=args.train_batch_size,
-                                                                      knowledge=teacher_predictions['pred_logit'])
+                                                                      knowledge=teacher_predictions['pred_logit'],
+                                                                      packed=args.pack_sequences)
         else:
             train_examples, train_dataloader, _ = get_task_dataloader(task_name, read_set, tokenizer, args, SequentialSampler,
                                                                       batch_size=args.train_batch_size,
                                                                       knowledge=teacher_predictions['pred_logit'],
-                                                                      extra_knowledge=teacher_predictions['feature_maps'])
+                                                                      extra_knowledge=teacher_predictions['feature_maps'],
+                                                                      packed=args.pack_sequences)
 
     else:
         if args.alpha > 0:
             raise ValueError('please specify teacher\'s prediction file for KD training')
         logger.info('runing simple fine-tuning because teacher\'s prediction is not provided')
         train_examples, train_dataloader, _ = get_task_dataloader(task_name, read_set, tokenizer, args, SequentialSampler,
-                                                                  batch_size=args.train_batch_size)
+                                                                  batch_size=args.train_batch_size,
+                                                                  packed=args.pack_sequences)
     num_train_optimization_steps = int(len(train_examples) / args.train_batch_size / args.gradient_accumulation_steps) * args.num_train_epochs
     logger.info("***** Running training *****")
     logger.info("  Num examples = %d", len(train_examples))
@@ -286,29 +309,26 @@ if args.do_train:
         args.freeze_layer = [1,3,5,7,9,11,13,14,15,16,17,18]    
     if args.freeze_layer is not None:    
         list_of_frozen_params = []
-        list_of_frozen_params_L1 = []
         
         for name, param in student_encoder.named_parameters():
             if 'embeddings' in name:
                 param.requires_grad = False
-                list_of_frozen_params.append(name)
-                list_of_frozen_params_L1.append(torch.mean(torch.abs(param)))
+                list_of_frozen_params.append((name, param))
                 
         for count in range(len(args.freeze_layer)):
             for name, param in student_encoder.named_parameters():
                 if 'bert.encoder.layer.'+str(int(args.freeze_layer[count])-1)+'.' in name:
                     param.requires_grad = False
-                    list_of_frozen_params.append(name)
-                    list_of_frozen_params_L1.append(torch.mean(torch.abs(param)))
+                    list_of_frozen_params.append((name, param))
         
         for name, param in student_encoder.named_parameters():
             if 'pooler' in name:
                 param.requires_grad = False
-                list_of_frozen_params.append(name)
-                list_of_frozen_params_L1.append(torch.mean(torch.abs(param)))
+                list_of_frozen_params.append((name, param))
         print("Following are the list of params that are frozen")
         for a in range(len(list_of_frozen_params)):
-            print(list_of_frozen_params[a])
+            print(list_of_frozen_params[a][0])
+        frozen_checker = FrozenParamChecker(list_of_frozen_params)
             
     else:
         print("No layers are frozen")
@@ -365,6 +385,17 @@ if args.do_train:
     log_eval = open(os.path.join(args.output_dir, 'eval_log.txt'), 'w', buffering=1)
     print('epoch,global_steps,step,acc,loss,kd_loss,ce_loss,AT_loss', file=log_train)
     print('epoch,acc,loss', file=log_eval)
+    profiler = StepProfiler(args.profile_every, args.output_dir)
+    profile_step = 0
+    path_sampler = None
+    if args.sample_paths > 0:
+        if args.NL_mode != 0 or args.kd_model.lower() not in ['kd', 'kd.cls']:
+            raise ValueError('--sample_paths needs NL_mode 0 and kd_model kd or kd.cls')
+        path_sampler = PathSampler(3, args.sample_paths, args.path_sampling,
+                                   probs=parse_path_probs(args.path_sampling_probs),
+                                   final_probs=parse_path_probs(args.path_sampling_final_probs),
+                                   anneal_steps=args.path_sampling_anneal_steps)
+        student_classifiers = [student_classifier, student_classifier_2, student_classifier_3]
     
              
     eval_best_acc_list = [0,0,0]
@@ -377,12 +408,21 @@ if args.do_train:
     for epoch in trange(int(args.num_train_epochs), desc="Epoch"):
         tr_loss, tr_ce_loss, tr_kd_loss, tr_acc = 0, 0, 0, 0
         nb_tr_examples, nb_tr_steps = 0, 0
+        profiler.start_step(profile_step)
+        profiler.start('data')
         for step, batch in enumerate(tqdm(train_dataloader, desc="Iteration")):
+            profiler.stop('data')
             student_encoder.train()
             student_classifier.train()
             student_classifier_2.train()
             student_classifier_3.train()
-            batch = tuple(t.to(device) for t in batch)
+            with profiler.timer('h2d'):
+                batch = tuple(t.to(device) for t in batch)
+            position_ids, cls_index = None, None
+            if args.pack_sequences:
+                # packed rows: input_mask is block diagonal and the pooled outputs follow cls_index
+                position_ids, cls_index = batch[-2:]
+                batch = batch[:-2]
             if args.alpha == 0:
                 input_ids, input_mask, segment_ids, label_ids = batch
                 teacher_pred, teacher_patience = None, None
@@ -397,22 +437,42 @@ if args.do_train:
                 if args.fp16:
                     teacher_pred = teacher_pred.half()
 
-            full_output, full_output_2, full_output_3, pooled_output, pooled_output_2, pooled_output_3 = student_encoder(input_ids, segment_ids, input_mask, NL_mode = args.NL_mode)
+            with profiler.timer('forward_encoder'):
+                if path_sampler is not None:
+                    sampled_paths, path_weights = path_sampler.sample(global_step)
+                    full_output, full_output_2, full_output_3, pooled_output, pooled_output_2, pooled_output_3 = student_encoder.forward_paths(input_ids, segment_ids, input_mask, sampled_paths, position_ids=position_ids, cls_index=cls_index)
+                else:
+                    full_output, full_output_2, full_output_3, pooled_output, pooled_output_2, pooled_output_3 = student_encoder(input_ids, segment_ids, input_mask, NL_mode = args.NL_mode, position_ids=position_ids, cls_index=cls_index)
                 
-            if args.kd_model.lower() in['kd', 'kd.cls']:
+            if path_sampler is not None:
+                pooled_outputs = [pooled_output, pooled_output_2, pooled_output_3]
+                logits_pred_students = [None] * 3
+                for path in sampled_paths:
+                    with profiler.timer('forward_' + STUDENT_PATHS[path]):
+                        logits_pred_students[path] = student_classifiers[path](pooled_outputs[path])
+            elif args.kd_model.lower() in['kd', 'kd.cls']:
                 if args.NL_mode == 0:
-                    logits_pred_student = student_classifier(pooled_output)
-                    logits_pred_student_2 = student_classifier_2(pooled_output_2)
-                    logits_pred_student_3 = student_classifier_3(pooled_output_3)
+                    with profiler.timer('forward_DT_1'):
+                        logits_pred_student = student_classifier(pooled_output)
+                    with profiler.timer('forward_DT_2'):
+                        logits_pred_student_2 = student_classifier_2(pooled_output_2)
+                    with profiler.timer('forward_Negotiator'):
+                        logits_pred_student_3 = student_classifier_3(pooled_output_3)
                 elif args.NL_mode == 1:
-                    logits_pred_student_2 = student_classifier_2(pooled_output)
-                    logits_pred_student_3 = student_classifier_3(pooled_output_3)
+                    with profiler.timer('forward_DT_2'):
+                        logits_pred_student_2 = student_classifier_2(pooled_output_2)
+                    with profiler.timer('forward_Negotiator'):
+                        logits_pred_student_3 = student_classifier_3(pooled_output_3)
                 elif args.NL_mode == 2:
-                    logits_pred_student = student_classifier(pooled_output)
-                    logits_pred_student_3 = student_classifier_3(pooled_output_3)
+                    with profiler.timer('forward_DT_1'):
+                        logits_pred_student = student_classifier(pooled_output)
+                    with profiler.timer('forward_Negotiator'):
+                        logits_pred_student_3 = student_classifier_3(pooled_output_3)
                 elif args.NL_mode == 3:
-                    logits_pred_student = student_classifier(pooled_output)
-                    logits_pred_student_2 = student_classifier_2(pooled_output_2)
+                    with profiler.timer('forward_DT_1'):
+                        logits_pred_student = student_classifier(pooled_output)
+                    with profiler.timer('forward_DT_2'):
+                        logits_pred_student_2 = student_classifier_2(pooled_output_2)
                 
             
                 if args.kd_model.lower() == 'kd.cls':
@@ -437,7 +497,21 @@ if args.do_train:
             else:
                 raise ValueError(f'{args.kd_model} not implemented yet')
             
-            if args.NL_mode == 0:
+            profiler.start('loss')
+            if path_sampler is not None:
+                # the weights make the sampled loss an unbiased estimate of the mean over the 3 paths,
+                # the loss without sampling is their sum
+                full_outputs = [full_output, full_output_2, full_output_3]
+                loss = 0
+                for path, weight in zip(sampled_paths, path_weights):
+                    path_loss, _, _ = distillation_loss(logits_pred_students[path], label_ids, teacher_pred, T=args.T, alpha=args.alpha)
+                    if args.beta > 0:
+                        student_patience = torch.stack(full_outputs[path][:-1]).transpose(0,1)
+                        path_loss = path_loss + args.beta * patience_loss(teacher_patience, student_patience, args.normalize_patience)
+                    if args.path_sampling == 'learned':
+                        path_sampler.observe(path, path_loss.detach())
+                    loss = loss + 3 * weight * path_loss
+            elif args.NL_mode == 0:
                 loss_dl, kd_loss, ce_loss = distillation_loss(logits_pred_student, label_ids, teacher_pred, T=args.T, alpha=args.alpha)
                 loss_dl_2, kd_loss_2, ce_loss_2 = distillation_loss(logits_pred_student_2, label_ids, teacher_pred, T=args.T, alpha=args.alpha)
                 loss_dl_3, kd_loss_3, ce_loss_3 = distillation_loss(logits_pred_student_3, label_ids, teacher_pred, T=args.T, alpha=args.alpha)
@@ -451,7 +525,9 @@ if args.do_train:
                 loss_dl, kd_loss, ce_loss = distillation_loss(logits_pred_student, label_ids, teacher_pred, T=args.T, alpha=args.alpha)
                 loss_dl_2, kd_loss_2, ce_loss_2 = distillation_loss(logits_pred_student_2, label_ids, teacher_pred, T=args.T, alpha=args.alpha)
             
-            if args.beta > 0:
+            if path_sampler is not None:
+                pass  # the patience losses of the sampled paths are already in loss
+            elif args.beta > 0:
                 if args.NL_mode == 0:
                     pt_loss = args.beta * patience_loss(teacher_patience, student_patience, args.normalize_patience)
                     pt_loss_2 = args.beta * patience_loss(teacher_patience, student_patience_2, args.normalize_patience)
@@ -483,16 +559,19 @@ if args.do_train:
 
             if n_gpu > 1:
                 loss = loss.mean()  # mean() to average on multi-gpu.
+            profiler.stop('loss')
 
-            if args.fp16:
-                optimizer.backward(loss)
-            else:
-                loss.backward()
+            with profiler.timer('backward'):
+                if args.fp16:
+                    optimizer.backward(loss)
+                else:
+                    loss.backward()
 
             if args.gradient_accumulation_steps > 1:
                 loss = loss / args.gradient_accumulation_steps
 
             if (step + 1) % args.gradient_accumulation_steps == 0:
+                profiler.start('optimizer')
                 if args.fp16:
                     lr_this_step = args.learning_rate * warmup_linear(global_step / num_train_optimization_steps,
                                                                       args.warmup_proportion)
@@ -508,37 +587,28 @@ if args.do_train:
                 optimizer.step()
                 optimizer.zero_grad()
                 global_step += 1
+                profiler.stop('optimizer')
 
-            if global_step % 50 == 0:
-                if args.freeze_layer is not None:
-                    error = 0
-                    L1_list = []
-                    name_list = []
-                    print()
-                    print('*'*77)
-                    print("Checking if the parameters are indeed frozen")
-                    for name, param in student_encoder.named_parameters():
-                        if name in list_of_frozen_params:
-                            L1_list.append(torch.mean(torch.abs(param)))
-                            name_list.append(name)
-#                             print(name+": "+str(torch.mean(torch.abs(param))))
-                    for i in range(len(list_of_frozen_params_L1)):
-                        if L1_list[i] != list_of_frozen_params_L1[i]:
+                if args.frozen_check_every > 0 and global_step % args.frozen_check_every == 0:
+                    if args.freeze_layer is not None:
+                        not_frozen = frozen_checker.changed()
+                        if len(not_frozen) != 0:
+                            print('*'*77)
                             print("Following parameters are not frozen")
-                            print(name_list[i])
-                            error +=1
-                    if error !=0:
-                        print("error has occured")
-                    else:
-                        print("Parameters are well frozen")
-                    print('*'*77)    
+                            for name in not_frozen:
+                                print(name)
+                            print("error has occured")
+                            print('*'*77)
 #################################################################################################################################################### 
         #Save a trained model and the associated configuration
             if (global_step % log_per_step == 0) & (epoch > 0):
+                profiler.start('eval', force=True)
                 if 'race' in task_name:
                     result = eval_model_dataloader_nli(student_encoder, student_classifier, eval_dataloader, device, False)
                 else:
                     test_res = eval_model_dataloader_nli_NL(args.task_name.lower(), eval_label_ids, student_encoder, student_classifier, student_classifier_2, student_classifier_3, eval_dataloader, args.kd_model, num_labels, device, args.weights, args.fc_layer_idx, output_mode, NL_mode = args.NL_mode)
+                profiler.stop('eval')
+                profiler.start('checkpoint', force=True)
                            
                 # Printing validation results and saving checkpoints when the conditions below are met.
                 if task_name == 'mrpc':
@@ -1263,6 +1333,16 @@ if args.do_train:
                                     torch.save(student_encoder.state_dict(), os.path.join(args.output_dir, 'BERT'+f'.encoder_loss_Negotiator.pkl'))
                                     torch.save(student_classifier.state_dict(), os.path.join(args.output_dir, 'BERT'+f'.cls_loss_Negotiator.pkl'))
                                 logger.info("Saving the model...")                                               
+                profiler.stop('checkpoint')
+
+            profile_step += 1
+            profiler.start_step(profile_step)
+            profiler.start('data')
+
+    profiler.log_summary()
+    profiler.export()
+    if path_sampler is not None:
+        logger.info('path visits: ' + ', '.join('%s %d' % (name, visits) for name, visits in zip(STUDENT_PATHS, path_sampler.visits)))
                                                
 logger.info("")
 logger.info('='*77)
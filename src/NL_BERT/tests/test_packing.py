@@ -0,0 +1,57 @@
+import unittest
+
+import torch
+from torch import nn
+
+from BERT.pytorch_pretrained_bert.modeling import BertConfig, BertModel
+from utils.nli_data_processing import PackedBatchCollator
+
+
+class TestPackedBatchCollator(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.max_seq_length = 16
+        self.lengths = [5, 9, 3, 7, 4, 12]
+        self.batch = []
+        for i, length in enumerate(self.lengths):
+            input_ids = torch.zeros(self.max_seq_length, dtype=torch.long)
+            input_ids[:length] = torch.randint(1, 99, (length,))
+            input_mask = torch.zeros(self.max_seq_length, dtype=torch.long)
+            input_mask[:length] = 1
+            segment_ids = torch.zeros(self.max_seq_length, dtype=torch.long)
+            segment_ids[length // 2:length] = 1
+            self.batch.append((input_ids, input_mask, segment_ids, torch.tensor(i)))
+
+    def test_attention_mask(self):
+        input_ids, attention_mask, _, labels, position_ids, cls_index = PackedBatchCollator(self.max_seq_length)(self.batch)
+        seq_length = input_ids.size(1)
+        self.assertEqual(labels.tolist(), list(range(len(self.batch))))
+        # every token attends to exactly the tokens of its own example
+        self.assertEqual(int(attention_mask.sum()), sum(length ** 2 for length in self.lengths))
+        for example, length, index in zip(self.batch, self.lengths, cls_index.tolist()):
+            row, offset = divmod(index, seq_length)
+            end = offset + length
+            self.assertTrue(torch.equal(input_ids[row, offset:end], example[0][:length]))
+            self.assertTrue(torch.equal(position_ids[row, offset:end], torch.arange(length)))
+            self.assertEqual(int(attention_mask[row, offset:end, offset:end].sum()), length ** 2)
+
+    def test_logits_match_unpacked(self):
+        config = BertConfig(99, hidden_size=32, num_hidden_layers=2, num_attention_heads=4, intermediate_size=37,
+                            max_position_embeddings=self.max_seq_length)
+        model = BertModel(config).eval()
+        classifier = nn.Linear(32, 3)
+
+        input_ids, input_mask, segment_ids, _ = [torch.stack(t) for t in zip(*self.batch)]
+        packed_ids, attention_mask, packed_segment_ids, _, position_ids, cls_index = \
+            PackedBatchCollator(self.max_seq_length)(self.batch)
+        self.assertLess(packed_ids.size(0), len(self.batch))
+        with torch.no_grad():
+            _, pooled = model(input_ids, segment_ids, input_mask, output_all_encoded_layers=False)
+            _, packed_pooled = model(packed_ids, packed_segment_ids, attention_mask, output_all_encoded_layers=False,
+                                     position_ids=position_ids, cls_index=cls_index)
+            logits, packed_logits = classifier(pooled), classifier(packed_pooled)
+        self.assertTrue(torch.allclose(packed_logits, logits, atol=1e-5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import torch
+
+from utils.race_data_processing import MRCExample, RaggedChoiceCollator, RaggedChoiceDataset, \
+    convert_examples_to_features, convert_examples_to_ragged_features, select_field
+
+
+class WhitespaceTokenizer(object):
+    def __init__(self):
+        self.vocab = {"[CLS]": 101, "[SEP]": 102}
+
+    def tokenize(self, text):
+        return text.split()
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.setdefault(token, len(self.vocab) + 200) for token in tokens]
+
+
+class TestRaggedChoiceCollator(unittest.TestCase):
+    def test_matches_padded_features(self):
+        max_seq_length = 24
+        examples = []
+        for i, (passage_length, question_length) in enumerate([(5, 2), (30, 3), (12, 12), (2, 25)]):
+            passage = ' '.join('p%d' % (t % 17) for t in range(passage_length))
+            question = ' '.join('q%d' % t for t in range(question_length))
+            answers = [' '.join('a%d' % t for t in range(n)) for n in [1, 4, 9, 2 + i]]
+            examples.append(MRCExample('%d' % i, passage, question, answers, label=i % 4))
+        tokenizer = WhitespaceTokenizer()
+
+        features = convert_examples_to_features(examples, tokenizer, max_seq_length, True)
+        expected = [torch.tensor(select_field(features, field), dtype=torch.long)
+                    for field in ['input_ids', 'input_mask', 'segment_ids']]
+        ragged = convert_examples_to_ragged_features(examples, tokenizer)
+        dataset = RaggedChoiceDataset(ragged)
+        batch = RaggedChoiceCollator(ragged, max_seq_length)([dataset[i] for i in range(len(dataset))])
+
+        batch_length = batch[0].size(-1)
+        self.assertLessEqual(batch_length, max_seq_length)
+        for output, padded in zip(batch[:3], expected):
+            self.assertTrue(torch.equal(output, padded[:, :, :batch_length]))
+            # the old features only differ by padding
+            self.assertEqual(int(padded[:, :, batch_length:].abs().sum()), 0)
+        self.assertEqual(batch[3].tolist(), [e.label for e in examples])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -206,9 +206,59 @@ def default_parser():
                         default=False,
                         type=boolean_string,
                         help="do evaluation during training or not")
+
+    parser.add_argument("--race_ragged",
+                        default=False,
+                        type=boolean_string,
+                        help="store RACE passages once and options ragged, padding each batch to its longest choice")
+    parser.add_argument("--pack_sequences",
+                        default=False,
+                        type=boolean_string,
+                        help="pack several short training examples into each max_seq_length row (GLUE only)")
+
+    # Profiling related parameters
+    parser.add_argument("--profile_every",
+                        default=0,
+                        type=int,
+                        help="time one training step out of every x steps and export profile.csv and "
+                             "profile_trace.json to the output directory, default is 0 (disabled)")
+    parser.add_argument("--frozen_check_every",
+                        default=50,
+                        type=int,
+                        help="check that the frozen parameters are unchanged every x global steps, 0 disables the check")
+
+    # Path sampling related parameters
+    parser.add_argument("--sample_paths",
+                        default=0,
+                        type=int,
+                        help="train only this many of the 3 student paths per step (NL_mode 0 only), default is 0 (all paths)")
+    parser.add_argument("--path_sampling",
+                        default='uniform',
+                        choices=['uniform', 'scheduled', 'learned'],
+                        help="how the paths of a step are drawn: uniformly, with annealed probabilities or by running loss")
+    parser.add_argument("--path_sampling_probs",
+                        default=None,
+                        type=str,
+                        help="comma separated initial probabilities of DT_1, DT_2 and Negotiator for scheduled sampling")
+    parser.add_argument("--path_sampling_final_probs",
+                        default=None,
+                        type=str,
+                        help="comma separated final probabilities for scheduled sampling, default is uniform")
+    parser.add_argument("--path_sampling_anneal_steps",
+                        default=0,
+                        type=int,
+                        help="number of global steps over which scheduled sampling anneals its probabilities")
     return parser
 
 
+def check_pack_sequences(args):
+    """
+    Reject --pack_sequences for tasks without a packed data pipeline, i.e. RACE.
+    """
+    if args.pack_sequences and 'race' in args.task_name.lower():
+        raise ValueError('--pack_sequences is only available for GLUE tasks, not %s' % args.task_name)
+
+
 def complete_argument(args, out_dir, load_dir = None):
     MODEL_FOLDER = os.path.join(HOME_DATA_FOLDER, 'models')
     if args.student_hidden_layers in [None, 'None']:
@@ -17,11 +17,13 @@ def init_model_NL(task_name, output_all_layers, num_hidden_layers, config):
     else:
         return init_glue_model_NL(task_name, output_all_layers, num_hidden_layers, config)  
 
-def get_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None):
+def get_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None, packed=False):
     if 'race' in task_name.lower():
+        if packed:
+            raise ValueError('sequence packing is only available for GLUE tasks')
         return get_race_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size, knowledge, extra_knowledge)
     else:
-        return get_glue_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size, knowledge, extra_knowledge)
+        return get_glue_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size, knowledge, extra_knowledge, packed=packed)
 
 def get_task_dataloader_pretrain(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None, p5_label = None):
     if 'race' in task_name.lower():
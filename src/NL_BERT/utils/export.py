@@ -0,0 +1,195 @@
+"""
+File used to export a single student (encoder plus classifier) to TorchScript or ONNX for serving.
+"""
+import logging
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+
+logger = logging.getLogger(__name__)
+
+STUDENT_PATHS = ['DT_1', 'DT_2', 'Negotiator']
+
+
+def NL_path_schedule(num_layer, NL_mode, path):
+    """
+    Order in which BertEncoder_NL applies its layers for one student path.
+    Mirrors the unrolled forward of BertEncoder_NL, and `check_parity` verifies the two agree.
+    :param num_layer: number of student layers, 3 or 6
+    :param NL_mode: NL mode the encoder was trained with
+    :param path: one of 'DT_1', 'DT_2' and 'Negotiator'
+    :return: list of (layer index, whether query and key are switched)
+    """
+    if path not in STUDENT_PATHS:
+        raise ValueError('path should be one of %s' % STUDENT_PATHS)
+    if (NL_mode == 1 and path == 'DT_1') or (NL_mode == 2 and path == 'DT_2') or (NL_mode == 3 and path == 'Negotiator'):
+        raise ValueError('path %s is not computed in NL_mode %d' % (path, NL_mode))
+
+    if num_layer == 3:
+        if path == 'DT_1':
+            return [(i, NL_mode in [2, 3]) for i in range(6)]
+        elif path == 'DT_2':
+            return [(i, False) for i in [1, 1, 3, 3, 5, 5]]
+        else:
+            return [(i, False) for i in [1, 6, 3, 7, 5, 8]]
+    elif num_layer == 6:
+        if path == 'DT_1':
+            return [(i, False) for i in range(12)]
+        elif path == 'DT_2':
+            last = 12 if NL_mode == 0 else 11
+            return [(i, False) for i in [1, 1, 3, 3, 5, 5, 7, 7, 9, 9, 11, last]]
+        else:
+            return [(i, False) for i in [1, 12, 3, 13, 5, 14, 7, 15, 9, 16, 11, 17]]
+    raise ValueError('BertEncoder_NL only supports 3 or 6 student layers, got %d' % num_layer)
+
+
+class BertStudentForExport(nn.Module):
+    """
+    Straight-line student for tracing: embeddings, a fixed list of (possibly shared) BertLayers, pooler and classifier.
+    Takes input_ids, token_type_ids and attention_mask of shape [batch_size, seq_length] and returns the logits.
+    """
+    def __init__(self, bert, classifier, schedule):
+        super(BertStudentForExport, self).__init__()
+        if not hasattr(bert, 'pooler'):
+            raise ValueError('the encoder must have a pooler to be exported with a classifier')
+        self.embeddings = bert.embeddings
+        self.layers = nn.ModuleList([bert.encoder.layer[i] for i, _ in schedule])
+        self.switch_qk = [switch for _, switch in schedule]
+        self.pooler = bert.pooler
+        self.classifier = classifier
+
+    def forward(self, input_ids, token_type_ids, attention_mask):
+        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2).to(dtype=torch.float32)
+        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        hidden_states = self.embeddings(input_ids, token_type_ids)
+        for layer, switch in zip(self.layers, self.switch_qk):
+            hidden_states = layer(hidden_states, extended_attention_mask, switch)
+        return self.classifier(self.pooler(hidden_states))
+
+
+def build_export_student(encoder, classifier, model_type='Original', NL_mode=0, path='Negotiator'):
+    """
+    :param encoder: BertForSequenceClassificationEncoder or BertForSequenceClassificationEncoder_NL
+    :param classifier: FCClassifierForSequenceClassification of the chosen path
+    :param model_type: 'Original' or 'NL'
+    :return: BertStudentForExport in eval mode
+    """
+    if model_type == 'NL':
+        schedule = NL_path_schedule(encoder.bert.encoder.num_layer, NL_mode, path)
+    else:
+        schedule = [(i, False) for i in range(len(encoder.bert.encoder.layer))]
+    student = BertStudentForExport(encoder.bert, classifier, schedule)
+    student.eval()
+    return student
+
+
+def example_inputs(batch_size, seq_length, vocab_size=30522, pad=0):
+    """
+    Random inputs with the last `pad` positions of every row masked out.
+    """
+    input_ids = torch.randint(1, vocab_size, (batch_size, seq_length), dtype=torch.long)
+    token_type_ids = torch.zeros_like(input_ids)
+    attention_mask = torch.ones_like(input_ids)
+    if pad > 0:
+        attention_mask[:, seq_length - pad:] = 0
+        input_ids[:, seq_length - pad:] = 0
+    return input_ids, token_type_ids, attention_mask
+
+
+def export_torchscript(student, output, batch_size=2, seq_length=16):
+    with torch.no_grad():
+        traced = torch.jit.trace(student, example_inputs(batch_size, seq_length), check_trace=False)
+    traced.save(output)
+    logger.info('TorchScript student saved to %s' % output)
+    return traced
+
+
+def export_onnx(student, output, batch_size=2, seq_length=16, opset_version=11):
+    names = ['input_ids', 'token_type_ids', 'attention_mask']
+    dynamic_axes = {name: {0: 'batch_size', 1: 'seq_length'} for name in names}
+    dynamic_axes['logits'] = {0: 'batch_size'}
+    with torch.no_grad():
+        torch.onnx.export(student, example_inputs(batch_size, seq_length), output,
+                          input_names=names, output_names=['logits'], dynamic_axes=dynamic_axes,
+                          opset_version=opset_version, do_constant_folding=True)
+    logger.info('ONNX student saved to %s' % output)
+
+
+def load_onnx_runner(output):
+    """
+    :return: function running the ONNX student on torch inputs with onnxruntime, or None if it is not installed
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        logger.info('onnxruntime is not installed, skipping the ONNX parity check')
+        return None
+    session = onnxruntime.InferenceSession(output, providers=['CPUExecutionProvider'])
+    names = [i.name for i in session.get_inputs()]
+
+    def run(input_ids, token_type_ids, attention_mask):
+        feed = dict(zip(names, [t.numpy() for t in [input_ids, token_type_ids, attention_mask]]))
+        return torch.from_numpy(session.run(None, feed)[0])
+    return run
+
+
+def eager_forward(encoder, classifier, model_type, NL_mode, path):
+    """
+    The research forward: the full (multi-path) encoder followed by the classifier of the chosen path.
+    """
+    pooled_index = 3 + STUDENT_PATHS.index(path)
+
+    def run(input_ids, token_type_ids, attention_mask):
+        if model_type == 'NL':
+            pooled = encoder(input_ids, token_type_ids, attention_mask, NL_mode=NL_mode)[pooled_index]
+        else:
+            pooled = encoder(input_ids, token_type_ids, attention_mask)[1]
+        return classifier(pooled)
+    return run
+
+
+def check_parity(reference, exported, shapes, vocab_size=30522, atol=1e-4):
+    """
+    Compare the exported student with the eager model on shapes other than the traced one, which also
+    checks that the batch and sequence axes are dynamic.
+    :param shapes: list of (batch_size, seq_length, number of padded positions)
+    :return: the largest absolute difference found
+    """
+    max_diff = 0.
+    with torch.no_grad():
+        for batch_size, seq_length, pad in shapes:
+            inputs = example_inputs(batch_size, seq_length, vocab_size, pad)
+            expected = reference(*inputs)
+            actual = exported(*inputs)
+            if expected.shape != actual.shape:
+                raise AssertionError('shape mismatch for input %s: %s vs %s'
+                                     % ((batch_size, seq_length), tuple(expected.shape), tuple(actual.shape)))
+            diff = (expected - actual).abs().max().item()
+            logger.info('parity batch_size=%d seq_length=%d pad=%d: max abs diff %.3e' % (batch_size, seq_length, pad, diff))
+            max_diff = max(max_diff, diff)
+    if max_diff > atol:
+        raise AssertionError('exported student differs from the eager model by %.3e > %.1e' % (max_diff, atol))
+    return max_diff
+
+
+def compare_latency(runners, batch_size, seq_length, vocab_size=30522, warmup=3, iters=20):
+    """
+    :param runners: dict mapping a name to a function taking (input_ids, token_type_ids, attention_mask)
+    :return: dict mapping every name to its median latency in milliseconds
+    """
+    inputs = example_inputs(batch_size, seq_length, vocab_size)
+    latencies = {}
+    with torch.no_grad():
+        for name, run in runners.items():
+            times = []
+            for i in range(warmup + iters):
+                start = time.perf_counter()
+                run(*inputs)
+                if i >= warmup:
+                    times.append(time.perf_counter() - start)
+            latencies[name] = float(np.median(times) * 1000)
+            logger.info('%-12s batch_size=%d seq_length=%d: p50 %.2f ms' % (name, batch_size, seq_length, latencies[name]))
+    return latencies
@@ -7,7 +7,8 @@ import torch
 from torch import nn
 from torch.nn import CrossEntropyLoss
 
-from BERT.pytorch_pretrained_bert.modeling import BertPreTrainedModel, BertModel, BertEmbeddings, BertEncoder, BertModel_NL
+from BERT.pytorch_pretrained_bert.modeling import BertPreTrainedModel, BertModel, BertEmbeddings, BertEncoder, BertModel_NL, gather_cls, extend_attention_mask
+from utils.export import NL_path_schedule, STUDENT_PATHS
 
 logger = logging.getLogger(__name__)
 
@@ -19,18 +20,23 @@ class BertModelNoPooler(BertPreTrainedModel):
         self.encoder = BertEncoder(config)
         self.apply(self.init_bert_weights)
 
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, output_all_encoded_layers=True,
+                position_ids=None, cls_index=None):
+        # cls_index is accepted for interface compatibility with BertModel, there is no pooler to apply it to
         if attention_mask is None:
             attention_mask = torch.ones_like(input_ids)
         if token_type_ids is None:
             token_type_ids = torch.zeros_like(input_ids)
 
-        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
+        if attention_mask.dim() == 3:
+            extended_attention_mask = attention_mask.unsqueeze(1)
+        else:
+            extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
 
         extended_attention_mask = extended_attention_mask.to(dtype=next(self.parameters()).dtype) # fp16 compatibility
         extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
 
-        embedding_output = self.embeddings(input_ids, token_type_ids)
+        embedding_output = self.embeddings(input_ids, token_type_ids, position_ids)
         encoded_layers = self.encoder(embedding_output,
                                       extended_attention_mask,
                                       output_all_encoded_layers=output_all_encoded_layers)
@@ -121,12 +127,14 @@ class BertForSequenceClassificationEncoder(BertPreTrainedModel):
         self.output_all_encoded_layers = output_all_encoded_layers
         self.apply(self.init_bert_weights)
         
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None, position_ids=None, cls_index=None):
         if self.output_all_encoded_layers:
-            full_output, pooled_output = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=True)
-            return [full_output[i][:, 0] for i in range(len(full_output))], pooled_output
+            full_output, pooled_output = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=True,
+                                                   position_ids=position_ids, cls_index=cls_index)
+            return [gather_cls(full_output[i], cls_index) for i in range(len(full_output))], pooled_output
         else:
-            _, pooled_output = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+            _, pooled_output = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False,
+                                         position_ids=position_ids, cls_index=cls_index)
             return None, pooled_output
 
 class BertForSequenceClassificationEncoder_NL(BertPreTrainedModel):
@@ -144,29 +152,65 @@ class BertForSequenceClassificationEncoder_NL(BertPreTrainedModel):
         self.output_all_encoded_layers = output_all_encoded_layers
         self.apply(self.init_bert_weights)
         
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None, NL_mode = 0):
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None, NL_mode = 0, position_ids=None, cls_index=None):
         if self.output_all_encoded_layers:
-            full_output, full_output_2, full_output_3, pooled_output, pooled_output_2, pooled_output_3 = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=True)
+            full_output, full_output_2, full_output_3, pooled_output, pooled_output_2, pooled_output_3 = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=True, NL_mode=NL_mode,
+                                                                                                                   position_ids=position_ids, cls_index=cls_index)
             
             if NL_mode == 0:
-                return [full_output[i][:, 0] for i in range(len(full_output))], [full_output_2[i][:, 0] for i in range(len(full_output_2))], [full_output_3[i][:, 0] for i in range(len(full_output_3))], pooled_output, pooled_output_2, pooled_output_3
+                return [gather_cls(full_output[i], cls_index) for i in range(len(full_output))], [gather_cls(full_output_2[i], cls_index) for i in range(len(full_output_2))], [gather_cls(full_output_3[i], cls_index) for i in range(len(full_output_3))], pooled_output, pooled_output_2, pooled_output_3
             elif NL_mode == 1:
-                return _, [full_output_2[i][:, 0] for i in range(len(full_output_2))], [full_output_3[i][:, 0] for i in range(len(full_output_3))], _, pooled_output_2, pooled_output_3
+                return None, [gather_cls(full_output_2[i], cls_index) for i in range(len(full_output_2))], [gather_cls(full_output_3[i], cls_index) for i in range(len(full_output_3))], None, pooled_output_2, pooled_output_3
             elif NL_mode == 2:
-                return [full_output[i][:, 0] for i in range(len(full_output))], _, [full_output_3[i][:, 0] for i in range(len(full_output_3))], pooled_output, _, pooled_output_3
+                return [gather_cls(full_output[i], cls_index) for i in range(len(full_output))], None, [gather_cls(full_output_3[i], cls_index) for i in range(len(full_output_3))], pooled_output, None, pooled_output_3
             elif NL_mode == 3:
-                return [full_output[i][:, 0] for i in range(len(full_output))], [full_output_2[i][:, 0] for i in range(len(full_output_2))], _, pooled_output, pooled_output_2, _
+                return [gather_cls(full_output[i], cls_index) for i in range(len(full_output))], [gather_cls(full_output_2[i], cls_index) for i in range(len(full_output_2))], None, pooled_output, pooled_output_2, None
             
         else:
-            _, _, _, pooled_output, pooled_output_2, pooled_output_3 = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+            _, _, _, pooled_output, pooled_output_2, pooled_output_3 = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False, NL_mode=NL_mode,
+                                                                                 position_ids=position_ids, cls_index=cls_index)
             if NL_mode ==0:
                 return None, None, None, pooled_output, pooled_output_2, pooled_output_3
             elif NL_mode ==1:
-                return None, None, None, _, pooled_output_2, pooled_output_3
+                return None, None, None, None, pooled_output_2, pooled_output_3
             elif NL_mode ==2:
-                return None, None, None, pooled_output, _, pooled_output_3
+                return None, None, None, pooled_output, None, pooled_output_3
             elif NL_mode ==3:
-                return None, None, None, pooled_output, pooled_output_2, _            
+                return None, None, None, pooled_output, pooled_output_2, None            
+
+    def forward_paths(self, input_ids, token_type_ids, attention_mask, paths, position_ids=None, cls_index=None):
+        """
+        NL_mode 0 forward running only the student paths in `paths` (indices into DT_1, DT_2 and Negotiator).
+        Layers shared by the schedules of several sampled paths, e.g. the first layer of DT_2 and Negotiator,
+        run once, while the full forward of BertEncoder_NL runs them once per path.
+        Returns the same six outputs as `forward`, with None for the paths that are not run.
+        """
+        if not isinstance(self.bert, BertModel_NL):
+            raise ValueError('path sampling needs the NL encoder with its pooler, fix_pooler is not supported')
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        extended_attention_mask = extend_attention_mask(attention_mask)
+        embedding_output = self.bert.embeddings(input_ids, token_type_ids, position_ids)
+
+        full_outputs, pooled_outputs = [None] * 3, [None] * 3
+        # hidden states by schedule prefix
+        computed = {}
+        for path in paths:
+            hidden_states = embedding_output
+            encoded_layers = []
+            prefix = ()
+            for layer, switch in NL_path_schedule(self.bert.encoder.num_layer, 0, STUDENT_PATHS[path]):
+                prefix = prefix + ((layer, switch),)
+                if prefix not in computed:
+                    computed[prefix] = self.bert.encoder.layer[layer](hidden_states, extended_attention_mask, switch)
+                hidden_states = computed[prefix]
+                encoded_layers.append(hidden_states)
+            pooled_outputs[path] = self.bert.pooler(hidden_states, cls_index)
+            if self.output_all_encoded_layers:
+                full_outputs[path] = [gather_cls(h, cls_index) for h in encoded_layers]
+        return full_outputs + pooled_outputs
 
 class FCClassifierForSequenceClassification(BertPreTrainedModel):
     def __init__(self, config, num_labels, hidden_size, n_layers=0):
@@ -654,7 +654,59 @@ output_modes = {
     "wnli": "classification",
 }
 
-def get_glue_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None):
+class PackedBatchCollator(object):
+    """
+    Collate function packing several short examples into each row of at most `max_seq_length` tokens.
+
+    Examples are placed first-fit in batch order, each keeping its own [CLS] and [SEP], and rows are trimmed to the
+    longest packed row. Returns (input_ids, attention_mask, segment_ids, *per-example tensors, position_ids, cls_index):
+    attention_mask is the [rows, seq_length, seq_length] block diagonal mask, position_ids restart at 0 for every
+    example, and cls_index holds the flattened [CLS] position of every example in the original batch order, so the
+    labels and teacher predictions keep lining up with the pooled outputs.
+    """
+    def __init__(self, max_seq_length):
+        self.max_seq_length = max_seq_length
+
+    def pack(self, lengths):
+        """
+        :return: (row, offset) of every example and the number of tokens used in every row
+        """
+        placements = []
+        used = []
+        for length in lengths:
+            for row in range(len(used)):
+                if used[row] + length <= self.max_seq_length:
+                    break
+            else:
+                row = len(used)
+                used.append(0)
+            placements.append((row, used[row]))
+            used[row] += length
+        return placements, used
+
+    def __call__(self, batch):
+        lengths = [int(example[1].sum()) for example in batch]
+        placements, used = self.pack(lengths)
+        n_rows, seq_length = len(used), max(used)
+
+        input_ids = torch.zeros(n_rows, seq_length, dtype=torch.long)
+        segment_ids = torch.zeros(n_rows, seq_length, dtype=torch.long)
+        position_ids = torch.zeros(n_rows, seq_length, dtype=torch.long)
+        attention_mask = torch.zeros(n_rows, seq_length, seq_length, dtype=torch.long)
+        cls_index = torch.zeros(len(batch), dtype=torch.long)
+        for i, (example, length, (row, offset)) in enumerate(zip(batch, lengths, placements)):
+            end = offset + length
+            input_ids[row, offset:end] = example[0][:length]
+            segment_ids[row, offset:end] = example[2][:length]
+            position_ids[row, offset:end] = torch.arange(length)
+            attention_mask[row, offset:end, offset:end] = 1
+            cls_index[i] = row * seq_length + offset
+
+        per_example = [torch.stack([example[k] for example in batch]) for k in range(3, len(batch[0]))]
+        return (input_ids, attention_mask, segment_ids) + tuple(per_example) + (position_ids, cls_index)
+
+
+def get_glue_task_dataloader(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None, packed=False):
     processor = processors[task_name]()
     output_mode = output_modes[task_name]
 
@@ -695,7 +747,8 @@ def get_glue_task_dataloader(task_name, set_name, tokenizer, args, sampler, batc
             dataset = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids, all_knowledge, extra_knowledge_tensor)
     else:
         dataset = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
-    dataloader = DataLoader(dataset, sampler=sampler(dataset), batch_size=batch_size)
+    collate_fn = PackedBatchCollator(args.max_seq_length) if packed else None
+    dataloader = DataLoader(dataset, sampler=sampler(dataset), batch_size=batch_size, collate_fn=collate_fn)
     return examples, dataloader, all_label_ids
 
 def get_glue_task_dataloader_pretrain5(task_name, set_name, tokenizer, args, sampler, batch_size=None, knowledge=None, extra_knowledge=None, p5_label=None):
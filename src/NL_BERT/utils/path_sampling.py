@@ -0,0 +1,127 @@
+"""
+File used to sample which NL student paths (DT_1, DT_2 and Negotiator) are trained at each step.
+Copy of fairseq/path_sampling.py of NL_Transformer_Enc_Dec, as the two trees are installed separately.
+"""
+import torch
+
+
+PATH_SAMPLING_MODES = ['uniform', 'scheduled', 'learned']
+
+
+def parse_path_probs(probs, num_paths=3):
+    """
+    :param probs: comma separated probabilities, e.g. '0.5,0.25,0.25', or None
+    :return: list of normalized probabilities, or None
+    """
+    if probs is None:
+        return None
+    values = [float(p) for p in probs.split(',')]
+    if len(values) != num_paths or min(values) < 0 or sum(values) <= 0:
+        raise ValueError('expected %d non-negative path probabilities, got %s' % (num_paths, probs))
+    return [p / sum(values) for p in values]
+
+
+class PathSampler(object):
+    """
+    Draws the student paths trained at one step, together with the weight of the loss of each of them.
+
+    With these weights the weighted loss of the sampled paths averages, over the draws, to the mean loss of all
+    the paths, so sampling leaves the expected gradient unchanged while a step only runs `num_samples` paths.
+    'uniform' draws distinct paths, 'scheduled' and 'learned' draw with replacement (a path drawn twice runs
+    once with twice the weight): 'scheduled' anneals the probabilities linearly from `probs` to `final_probs`,
+    'learned' follows a moving average of the loss of each path, with `min_prob` of the mass spread uniformly.
+    Losses given as tensors are moved to the host `sync_every` at a time, so the averages lag by up to that
+    many steps.
+    :param num_paths: number of student paths
+    :param num_samples: number of draws per step
+    :param mode: one of PATH_SAMPLING_MODES
+    :param probs: initial probabilities of the 'scheduled' mode
+    :param final_probs: final probabilities of the 'scheduled' mode, default is uniform
+    :param anneal_steps: number of steps of the 'scheduled' annealing
+    :param ema_decay: decay of the moving average of the losses in the 'learned' mode
+    :param min_prob: share of the probability mass spread uniformly in the 'learned' mode
+    :param sync_every: number of tensor losses the 'learned' mode gathers before moving them to the host at once
+    """
+    def __init__(self, num_paths, num_samples, mode='uniform', probs=None, final_probs=None, anneal_steps=0,
+                 ema_decay=0.99, min_prob=0.1, sync_every=32):
+        if not 0 < num_samples <= num_paths:
+            raise ValueError('cannot sample %d of %d paths' % (num_samples, num_paths))
+        if mode not in PATH_SAMPLING_MODES:
+            raise ValueError('path sampling mode should be one of %s' % PATH_SAMPLING_MODES)
+        if mode == 'scheduled' and probs is None:
+            raise ValueError('scheduled path sampling needs initial probabilities')
+        uniform = [1.0 / num_paths] * num_paths
+        self.num_paths = num_paths
+        self.num_samples = num_samples
+        self.mode = mode
+        self.initial_probs = probs if probs is not None else uniform
+        self.final_probs = final_probs if final_probs is not None else uniform
+        self.anneal_steps = anneal_steps
+        self.ema_decay = ema_decay
+        self.min_prob = min_prob
+        self.sync_every = sync_every
+        self.loss_ema = [None] * num_paths
+        self._pending = []
+        self.visits = [0] * num_paths
+
+    def probs(self, step=0):
+        if self.mode == 'uniform':
+            return [1.0 / self.num_paths] * self.num_paths
+        if self.mode == 'scheduled':
+            t = min(step / self.anneal_steps, 1.0) if self.anneal_steps > 0 else 1.0
+            return [(1 - t) * p + t * q for p, q in zip(self.initial_probs, self.final_probs)]
+        seen = [ema for ema in self.loss_ema if ema is not None]
+        # a path without a loss yet is treated like the worst path seen so far
+        unseen = max(seen) if len(seen) > 0 else 1.0
+        emas = [unseen if ema is None else ema for ema in self.loss_ema]
+        if sum(emas) <= 0:
+            return [1.0 / self.num_paths] * self.num_paths
+        return [(1 - self.min_prob) * ema / sum(emas) + self.min_prob / self.num_paths for ema in emas]
+
+    def sample(self, step=0):
+        """
+        :return: sorted list of distinct paths, list of their loss weights
+        """
+        if self.mode == 'uniform':
+            paths = sorted(torch.randperm(self.num_paths)[:self.num_samples].tolist())
+            weights = [1.0 / self.num_samples] * len(paths)
+        else:
+            probs = self.probs(step)
+            draws = torch.multinomial(torch.tensor(probs), self.num_samples, replacement=True).tolist()
+            paths = sorted(set(draws))
+            weights = [draws.count(p) / (self.num_samples * self.num_paths * probs[p]) for p in paths]
+        for p in paths:
+            self.visits[p] += 1
+        return paths, weights
+
+    def observe(self, path, loss):
+        """
+        Record the loss of `path` for the 'learned' mode.
+        `loss` is a float or a scalar tensor, tensors stay on their device until `sync_every` of them are moved
+        to the host at once, which avoids a synchronization per step.
+        """
+        if torch.is_tensor(loss):
+            self._pending.append((path, loss.detach().float()))
+            if len(self._pending) >= self.sync_every:
+                self.flush()
+            return
+        self.flush()
+        self._update_ema(path, loss)
+
+    def flush(self):
+        """
+        Fold the losses gathered by `observe` into the moving averages.
+        """
+        if len(self._pending) == 0:
+            return
+        paths = [path for path, _ in self._pending]
+        losses = torch.stack([loss for _, loss in self._pending]).tolist()
+        self._pending = []
+        for path, loss in zip(paths, losses):
+            self._update_ema(path, loss)
+
+    def _update_ema(self, path, loss):
+        if self.loss_ema[path] is None:
+            self.loss_ema[path] = loss
+        else:
+            self.loss_ema[path] = self.ema_decay * self.loss_ema[path] + (1 - self.ema_decay) * loss
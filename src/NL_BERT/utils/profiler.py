@@ -0,0 +1,160 @@
+"""
+File used to profile the hot path of the training loop and to cheaply check that frozen parameters stay frozen.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+class StepProfiler(object):
+    """
+    Per-step wall-clock timers for the training loop.
+
+    Only every `sample_every`-th step is timed, so normal steps pay a single integer comparison per timer.
+    On sampled steps CUDA is synchronized around each timer so that asynchronous kernels are charged to the
+    phase that launched them.
+    :param sample_every: time one step out of every `sample_every` steps, 0 disables profiling
+    :param output_dir: directory where `profile.csv` and `profile_trace.json` are written by `export`
+    """
+    def __init__(self, sample_every=0, output_dir=None):
+        self.sample_every = sample_every
+        self.output_dir = output_dir
+        self.enabled = sample_every > 0
+        self.active = False
+        self.step = -1
+        self.events = []
+        self._open = {}
+        self._origin = time.perf_counter()
+        self._sync = torch.cuda.is_available()
+
+    def start_step(self, step):
+        self.step = step
+        self.active = self.enabled and step % self.sample_every == 0
+
+    def _now(self):
+        if self._sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start(self, name, force=False):
+        """
+        :param force: time this phase even on steps that are not sampled, used for rare phases such as eval
+        """
+        if self.active or (force and self.enabled):
+            self._open[name] = self._now()
+
+    def stop(self, name):
+        if name not in self._open:
+            return
+        begin = self._open.pop(name)
+        self.events.append((self.step, name, begin - self._origin, self._now() - begin))
+
+    @contextmanager
+    def timer(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def summary(self):
+        """
+        :return: dict mapping every timer name to (number of samples, mean seconds, total seconds)
+        """
+        totals = defaultdict(float)
+        counts = defaultdict(int)
+        for _, name, _, duration in self.events:
+            totals[name] += duration
+            counts[name] += 1
+        return {name: (counts[name], totals[name] / counts[name], totals[name]) for name in totals}
+
+    def log_summary(self):
+        if not self.events:
+            return
+        logger.info('%-24s %8s %12s %12s' % ('phase', 'samples', 'mean (ms)', 'total (s)'))
+        for name, (count, mean, total) in sorted(self.summary().items(), key=lambda kv: -kv[1][2]):
+            logger.info('%-24s %8d %12.3f %12.3f' % (name, count, mean * 1000, total))
+
+    def export_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['step', 'phase', 'start_s', 'duration_s'])
+            for step, name, begin, duration in self.events:
+                writer.writerow([step, name, '%.6f' % begin, '%.6f' % duration])
+
+    def export_chrome_trace(self, path):
+        """
+        Write the events in the Chrome trace event format, viewable in chrome://tracing or Perfetto.
+        """
+        trace = [{'name': name, 'cat': 'train', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                  'ts': begin * 1e6, 'dur': duration * 1e6, 'args': {'step': step}}
+                 for step, name, begin, duration in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def export(self):
+        if not self.enabled or self.output_dir is None:
+            return
+        self.export_csv(os.path.join(self.output_dir, 'profile.csv'))
+        self.export_chrome_trace(os.path.join(self.output_dir, 'profile_trace.json'))
+        logger.info('profile written to %s' % self.output_dir)
+
+
+class FrozenParamChecker(object):
+    """
+    Cheap test that frozen parameters have not been updated.
+
+    Instead of reducing every frozen tensor, each parameter is fingerprinted by its autograd version counter,
+    its storage pointer and a handful of fixed sample elements. All samples are gathered into a single tensor
+    so a check costs one small device-to-host copy, and nothing is computed between checks.
+    :param named_params: iterable of (name, parameter) pairs that are expected to stay constant
+    :param n_samples: number of elements sampled from every parameter
+    """
+    def __init__(self, named_params, n_samples=8):
+        self.names = []
+        self.params = []
+        self.indices = []
+        for name, param in named_params:
+            numel = param.numel()
+            step = max(numel // n_samples, 1)
+            self.names.append(name)
+            self.params.append(param)
+            self.indices.append(torch.arange(0, numel, step, device=param.device)[:n_samples])
+        self.versions = [p._version for p in self.params]
+        self.pointers = [p.data_ptr() for p in self.params]
+        self.samples = self._sample()
+
+    def _sample(self):
+        if not self.params:
+            return None
+        with torch.no_grad():
+            # gather on the device, so that a check is a single copy and sync
+            return torch.cat([p.detach().view(-1).index_select(0, idx).float()
+                              for p, idx in zip(self.params, self.indices)]).cpu()
+
+    def changed(self):
+        """
+        :return: list of the names of the parameters whose fingerprint differs from the one taken at construction
+        """
+        names = set()
+        for i, p in enumerate(self.params):
+            if p.requires_grad or p._version != self.versions[i] or p.data_ptr() != self.pointers[i]:
+                names.add(self.names[i])
+        samples = self._sample()
+        if samples is not None:
+            offset = 0
+            diff = (samples != self.samples).tolist()
+            for i, idx in enumerate(self.indices):
+                if any(diff[offset:offset + len(idx)]):
+                    names.add(self.names[i])
+                offset += len(idx)
+        return [n for n in self.names if n in names]
@@ -23,7 +23,7 @@ import torch
 import pickle
 import numpy as np
 
-from torch.utils.data import TensorDataset, DataLoader, RandomSampler
+from torch.utils.data import Dataset, TensorDataset, DataLoader, RandomSampler
 from utils.modeling import BertForMultipleChoiceEncoder, FCClassifierMultipleChoice
 from envs import HOME_DATA_FOLDER
 
@@ -158,6 +158,139 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length, is_trainin
     return features
 
 
+class RaggedChoiceFeatures(object):
+    """
+    Compact multiple-choice features: every passage and question is stored once and every option is stored
+    ragged, all as flat int32 arrays with offsets. Choice rows are only assembled per batch by
+    `RaggedChoiceCollator`, so nothing is padded to max_seq_length on disk or in memory.
+    """
+    def __init__(self, example_ids, passages, questions, answers, labels, cls_id, sep_id, num_choices=4):
+        self.example_ids = example_ids
+        self.num_choices = num_choices
+        self.cls_id = cls_id
+        self.sep_id = sep_id
+        self.passage_ids, self.passage_offsets = _flatten(passages)
+        self.question_ids, self.question_offsets = _flatten(questions)
+        self.answer_ids, self.answer_offsets = _flatten(answers)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def passage(self, i):
+        return self.passage_ids[self.passage_offsets[i]:self.passage_offsets[i + 1]]
+
+    def endings(self, i):
+        """
+        :return: list of the question followed by each option, as in `convert_examples_to_features`
+        """
+        question = self.question_ids[self.question_offsets[i]:self.question_offsets[i + 1]]
+        endings = []
+        for j in range(i * self.num_choices, (i + 1) * self.num_choices):
+            endings.append(np.concatenate([question, self.answer_ids[self.answer_offsets[j]:self.answer_offsets[j + 1]]]))
+        return endings
+
+
+def _flatten(sequences):
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(seq) for seq in sequences])
+    flat = np.fromiter((t for seq in sequences for t in seq), dtype=np.int32, count=int(offsets[-1]))
+    return flat, offsets
+
+
+def convert_examples_to_ragged_features(examples, tokenizer, num_choices=4):
+    """
+    Same tokenization as `convert_examples_to_features`, but each passage and question is tokenized once
+    and truncation and padding are left to `RaggedChoiceCollator`.
+    """
+    passages, questions, answers = [], [], []
+    for example in examples:
+        passages.append(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(example.passage)))
+        questions.append(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(example.question)))
+        for ending in example.answers[:num_choices]:
+            answers.append(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(ending)))
+    cls_id, sep_id = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+    return RaggedChoiceFeatures([e.mrc_id for e in examples], passages, questions, answers,
+                                [e.label for e in examples], cls_id, sep_id, num_choices)
+
+
+class RaggedChoiceDataset(Dataset):
+    """
+    :param features: RaggedChoiceFeatures
+    :param tensors: extra per-example tensors (teacher knowledge) returned after the label
+    """
+    def __init__(self, features, *tensors):
+        assert all(len(features) == t.size(0) for t in tensors)
+        self.features = features
+        self.tensors = tensors
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, index):
+        return (index,) + tuple(t[index] for t in self.tensors)
+
+
+class RaggedChoiceCollator(object):
+    """
+    Assembles [CLS] passage [SEP] question option [SEP] for every choice of the batch, truncated exactly like
+    `_truncate_seq_pair`, and pads only to the longest row of the batch.
+    Returns (input_ids, input_mask, segment_ids, label, *extra tensors) with ids of shape
+    [batch_size, num_choices, batch_length], the same layout as the padded TensorDataset.
+    """
+    def __init__(self, features, max_seq_length):
+        self.features = features
+        self.max_seq_length = max_seq_length
+
+    def __call__(self, batch):
+        features = self.features
+        indices = [item[0] for item in batch]
+        rows = []
+        for i in indices:
+            passage = features.passage(i)
+            rows.append([(passage, ending) + _truncated_lengths(len(passage), len(ending), self.max_seq_length - 3)
+                         for ending in features.endings(i)])
+        batch_length = max(len_a + len_b + 3 for choices in rows for _, _, len_a, len_b in choices)
+
+        shape = (len(indices), features.num_choices, batch_length)
+        input_ids = np.zeros(shape, dtype=np.int64)
+        input_mask = np.zeros(shape, dtype=np.int64)
+        segment_ids = np.zeros(shape, dtype=np.int64)
+        for b, choices in enumerate(rows):
+            for c, (passage, ending, len_a, len_b) in enumerate(choices):
+                ids = input_ids[b, c]
+                ids[0] = features.cls_id
+                ids[1:len_a + 1] = passage[:len_a]
+                ids[len_a + 1] = features.sep_id
+                ids[len_a + 2:len_a + len_b + 2] = ending[:len_b]
+                ids[len_a + len_b + 2] = features.sep_id
+                input_mask[b, c, :len_a + len_b + 3] = 1
+                segment_ids[b, c, len_a + 2:len_a + len_b + 3] = 1
+
+        outputs = [torch.from_numpy(input_ids), torch.from_numpy(input_mask), torch.from_numpy(segment_ids),
+                   torch.from_numpy(features.labels[indices])]
+        for k in range(1, len(batch[0])):
+            outputs.append(torch.stack([item[k] for item in batch]))
+        return tuple(outputs)
+
+
+def _truncated_lengths(len_a, len_b, max_length):
+    """Lengths `_truncate_seq_pair` would leave, computed without popping tokens one at a time."""
+    excess = len_a + len_b - max_length
+    if excess <= 0:
+        return len_a, len_b
+    # the longer sequence is shortened first, until both have the same length
+    if len_a > len_b:
+        cut = min(len_a - len_b, excess)
+        len_a -= cut
+    else:
+        cut = min(len_b - len_a, excess)
+        len_b -= cut
+    excess -= cut
+    # then tokens_b and tokens_a are popped in turn, starting with tokens_b
+    return len_a - excess // 2, len_b - (excess + 1) // 2
+
+
 def _truncate_seq_pair(tokens_a, tokens_b, max_length):
     """Truncates a sequence pair in place to the maximum length."""
 
@@ -182,6 +315,9 @@ def get_race_task_dataloader(task_name, set_name, tokenizer, args, sampler, batc
     if batch_size is None:
         batch_size = args.train_batch_size if set_name.lower() == 'train' else args.eval_batch_size
 
+    if getattr(args, 'race_ragged', False):
+        return get_race_ragged_dataloader(task_name, set_name, examples, tokenizer, args, sampler, batch_size, knowledge, extra_knowledge)
+
     features = pickle.load(open(os.path.join(feat_data_dir, set_name.lower() + '.' + task_name + '.pkl'), 'rb'))
 
     all_input_ids = torch.tensor(select_field(features, 'input_ids'), dtype=torch.long)
@@ -203,6 +339,30 @@ def get_race_task_dataloader(task_name, set_name, tokenizer, args, sampler, batc
     return examples, dataloader, all_label
 
 
+def get_race_ragged_dataloader(task_name, set_name, examples, tokenizer, args, sampler, batch_size, knowledge=None, extra_knowledge=None):
+    feat_data_dir = os.path.join(HOME_DATA_FOLDER, 'data_feat', task_name)
+    feat_file = os.path.join(feat_data_dir, set_name.lower() + '.' + task_name + '.ragged.pkl')
+    if os.path.exists(feat_file):
+        features = pickle.load(open(feat_file, 'rb'))
+    else:
+        logger.info('building ragged features for %s %s' % (task_name, set_name))
+        features = convert_examples_to_ragged_features(examples, tokenizer)
+        os.makedirs(feat_data_dir, exist_ok=True)
+        pickle.dump(features, open(feat_file, 'wb'))
+
+    all_label = torch.from_numpy(features.labels)
+    tensors = []
+    if knowledge is not None:
+        tensors.append(torch.tensor(knowledge, dtype=torch.float))
+        if extra_knowledge is not None:
+            layer_index = [int(i) for i in args.fc_layer_idx.split(',')]
+            tensors.append(torch.stack([torch.FloatTensor(extra_knowledge[int(i)]) for i in layer_index]).transpose(0, 1))
+    dataset = RaggedChoiceDataset(features, *tensors)
+    dataloader = DataLoader(dataset, sampler=sampler(dataset), batch_size=batch_size,
+                            collate_fn=RaggedChoiceCollator(features, args.max_seq_length))
+    return examples, dataloader, all_label
+
+
 def accuracy(out, labels):
     outputs = np.argmax(out, axis=1)
     return np.sum(outputs == labels)
@@ -2274,8 +2274,8 @@ def eval_model_dataloader_nli_NL(task_name, eval_label_ids, encoder_bert, classi
                     logits_2 = classifier_2(pooled_output_2)
                     logits_3 = classifier_3(pooled_output_3)
                 elif NL_mode == 1:
-                    logits_2 = classifier_2(pooled_output)
-                    logits_3 = classifier_3(pooled_output_2)
+                    logits_2 = classifier_2(pooled_output_2)
+                    logits_3 = classifier_3(pooled_output_3)
                 elif NL_mode == 2:
                     logits = classifier(pooled_output)
                     logits_3 = classifier_3(pooled_output_3)
@@ -6,6 +6,7 @@
 import os
 from collections import Counter
 
+import numpy as np
 import torch
 from fairseq.file_io import PathManager
 from fairseq.tokenizer import tokenize_line
@@ -83,6 +84,73 @@ class Binarizer:
             "replaced": replaced,
         }
 
+    @staticmethod
+    def read_lines(filename, offset=0, end=-1):
+        """The lines of *filename* from byte *offset* to byte *end*, split
+        the same way as by :func:`binarize`."""
+        with open(PathManager.get_local_path(filename), "r", encoding="utf-8") as f:
+            f.seek(offset)
+            line = safe_readline(f)
+            while line:
+                # see binarize() for the upper bound
+                if end > 0 and f.tell() > end and f.tell() < end + 2 ** 32:
+                    break
+                yield line
+                line = f.readline()
+
+    @staticmethod
+    def line_sizes(
+        filename, tokenize=tokenize_line, append_eos=True, offset=0, end=-1
+    ) -> np.ndarray:
+        """Number of tokens :func:`binarize_into` writes for each line."""
+        extra = 1 if append_eos else 0
+        lines = Binarizer.read_lines(filename, offset, end)
+        return np.fromiter((len(tokenize(line)) + extra for line in lines), np.int64)
+
+    @staticmethod
+    def binarize_into(
+        filename,
+        dict,
+        out,
+        tokenize=tokenize_line,
+        append_eos=True,
+        offset=0,
+        end=-1,
+        buffer_size=2 ** 20,
+    ) -> Dict[str, int]:
+        """Like :func:`binarize`, but write the token ids of all the lines
+        one after another into the 1-D array *out*, which must have exactly
+        the room for them (see :func:`line_sizes`). Words are looked up in
+        the hash table of *dict* directly, and ids are copied to *out* by
+        blocks of *buffer_size* tokens."""
+        nseq, ntok = 0, 0
+        replaced = Counter()
+        indices = dict.indices
+        unk_index, unk_word, eos_index = dict.unk_index, dict.unk_word, dict.eos_index
+        buffer = []
+        for line in Binarizer.read_lines(filename, offset, end):
+            for word in tokenize(line):
+                idx = indices.get(word, unk_index)
+                if idx == unk_index and word != unk_word:
+                    replaced[word] += 1
+                buffer.append(idx)
+            if append_eos:
+                buffer.append(eos_index)
+            nseq += 1
+            if len(buffer) >= buffer_size:
+                out[ntok : ntok + len(buffer)] = buffer
+                ntok += len(buffer)
+                buffer = []
+        out[ntok : ntok + len(buffer)] = buffer
+        ntok += len(buffer)
+        assert ntok == len(out), "expected {} tokens, found {}".format(len(out), ntok)
+        return {
+            "nseq": nseq,
+            "nunk": sum(replaced.values()),
+            "ntok": ntok,
+            "replaced": replaced,
+        }
+
     @staticmethod
     def binarize_alignments(
         filename, alignment_parser, consumer, offset=0, end=-1
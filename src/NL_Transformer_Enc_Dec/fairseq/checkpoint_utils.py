@@ -9,6 +9,7 @@ import contextlib
 import logging
 import os
 import re
+import shutil
 import traceback
 from collections import OrderedDict
 from typing import Any, Dict, Optional, Union
@@ -215,27 +216,30 @@ def save_checkpoint(cfg: CheckpointConfig, trainer, epoch_itr, val_loss):
         os.path.join(cfg.save_model_dir, fn) for fn, cond in checkpoint_conds.items() if cond
     ]
     if len(checkpoints) > 0:
-        trainer.save_checkpoint(checkpoints[0], extra_state)
-        for cp in checkpoints[1:]:
-            if cfg.write_checkpoints_asynchronously:
-                # TODO[ioPath]: Need to implement a delayed asynchronous
-                # file copying/moving feature.
-                logger.warning(
-                    f"ioPath is not copying {checkpoints[0]} to {cp} "
-                    "since async write mode is on."
-                )
-            else:
-                assert PathManager.copy(
-                    checkpoints[0], cp, overwrite=True
-                ), f"Failed to copy {checkpoints[0]} to {cp}"
+        # the other checkpoints are links to the first one
+        trainer.save_checkpoint(checkpoints[0], extra_state, aliases=checkpoints[1:])
 
         write_timer.stop()
         logger.info(
-            "Saved checkpoint {} (epoch {} @ {} updates, score {}) (writing took {} seconds)".format(
-                checkpoints[0], epoch, updates, val_loss, write_timer.sum
+            "{} checkpoint {} (epoch {} @ {} updates, score {}) ({} took {} seconds)".format(
+                "Queued" if cfg.write_checkpoints_asynchronously else "Saved",
+                checkpoints[0],
+                epoch,
+                updates,
+                val_loss,
+                "snapshot" if cfg.write_checkpoints_asynchronously else "writing",
+                write_timer.sum,
             )
         )
 
+    # with asynchronous writes, wait for the checkpoint above so that it is
+    # counted among the checkpoints to keep
+    trainer.after_checkpoint_writes(
+        lambda: _remove_old_checkpoints(cfg, suffix, end_of_epoch)
+    )
+
+
+def _remove_old_checkpoints(cfg: CheckpointConfig, suffix, end_of_epoch):
     if not end_of_epoch and cfg.keep_interval_updates > 0:
         # remove old checkpoints; checkpoints are sorted in descending order
         if cfg.keep_interval_updates_pattern == -1:
@@ -566,9 +570,24 @@ def load_checkpoint_naive(cfg: CheckpointConfig, trainer, layer_init, **passthro
 
     return extra_state, epoch_itr
 
-def load_checkpoint_to_cpu(path, arg_overrides=None, load_on_all_ranks=False):
+def torch_load_lazily(path):
+    """Loads the checkpoint file *path* to CPU with its tensors memory-mapped,
+    so that they are only read from disk when used. Falls back to a full
+    load for torch versions without ``mmap`` (before 2.1) and for
+    checkpoints in the legacy, non-zip format."""
+    try:
+        return torch.load(path, map_location=torch.device("cpu"), mmap=True)
+    except (TypeError, RuntimeError):
+        return torch.load(path, map_location=torch.device("cpu"))
+
+
+def load_checkpoint_to_cpu(path, arg_overrides=None, load_on_all_ranks=False, lazy=False):
     """Loads a checkpoint to CPU (with upgrading for backward compatibility).
 
+    With *lazy*, the tensors are memory-mapped by :func:`torch_load_lazily`
+    and the optimizer state is dropped, so loading only the model reads only
+    the model weights from disk.
+
     If doing single-GPU training or if the checkpoint is only being loaded by at
     most one process on each node (current default behavior is for only rank 0
     to read the checkpoint from disk), load_on_all_ranks should be False to
@@ -599,8 +618,11 @@ def load_checkpoint_to_cpu(path, arg_overrides=None, load_on_all_ranks=False):
             torch.distributed.barrier()
         local_path = PathManager.get_local_path(path)
 
-    with open(local_path, "rb") as f:
-        state = torch.load(f, map_location=torch.device("cpu"))
+    if lazy:
+        state = torch_load_lazily(local_path)
+    else:
+        with open(local_path, "rb") as f:
+            state = torch.load(f, map_location=torch.device("cpu"))
 
     if "args" in state and state["args"] is not None and arg_overrides is not None:
         args = state["args"]
@@ -625,6 +647,9 @@ def load_checkpoint_to_cpu(path, arg_overrides=None, load_on_all_ranks=False):
             overwrite_args_by_name(state["cfg"], arg_overrides)
 
     state = _upgrade_state_dict(state)
+    if lazy:
+        # after the upgrade, which moves the state of old checkpoints here
+        state.pop("last_optimizer_state", None)
     return state
 
 
@@ -690,7 +715,7 @@ def load_model_ensemble_and_task(
             if not PathManager.exists(filename):
                 raise IOError("Model file not found: {}".format(filename))
             if state is None:
-                state = load_checkpoint_to_cpu(filename, arg_overrides)
+                state = load_checkpoint_to_cpu(filename, arg_overrides, lazy=True)
             if "args" in state and state["args"] is not None:
                 cfg = convert_namespace_to_omegaconf(state["args"])
             elif "cfg" in state and state["cfg"] is not None:
@@ -749,6 +774,9 @@ def torch_persistent_save(obj, filename, async_write: bool = False):
             # do atomic save
             with PathManager.open(filename + ".tmp", "wb") as f:
                 _torch_persistent_save(obj, f)
+                if hasattr(f, "fileno"):
+                    f.flush()
+                    os.fsync(f.fileno())
             PathManager.rename(filename + ".tmp", filename)
         else:
             # fallback to non-atomic save
@@ -756,6 +784,37 @@ def torch_persistent_save(obj, filename, async_write: bool = False):
                 _torch_persistent_save(obj, f)
 
 
+# ioctl request of Linux for a copy-on-write clone of a file
+_FICLONE = 0x40049409
+
+
+def link_checkpoint(src, dst):
+    """Make *dst* an alias of the checkpoint *src* without copying it.
+
+    Local checkpoints are hard linked, or cloned with a reflink where hard
+    links are not supported, and copied as a last resort. *dst* is replaced
+    atomically. Checkpoints are never written in place, so later saves do
+    not change the files linked to earlier ones.
+    """
+    if not (PathManager.supports_rename(src) and PathManager.supports_rename(dst)):
+        assert PathManager.copy(src, dst, overwrite=True), f"Failed to copy {src} to {dst}"
+        return
+    tmp = dst + ".tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            import fcntl
+
+            with open(src, "rb") as s, open(tmp, "wb") as d:
+                fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+        except (ImportError, OSError):
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
 def _torch_persistent_save(obj, f):
     if isinstance(f, str):
         with PathManager.open(f, "wb") as h:
@@ -899,6 +958,42 @@ def _upgrade_state_dict(state):
     return state
 
 
+_LAYER_KEY = re.compile(r"(encoder|decoder)\.layers\.(\d+)\.")
+
+
+def layer_init_key_map(keys, layer_init):
+    """Maps the keys of a model initialised with --layer-initialization to
+    the checkpoint *keys* they are read from.
+
+    Layer i of the encoder and of the decoder is initialised from layer
+    ``layer_init[i]`` (1-based) of the checkpoint. The layers of the
+    checkpoint from ``len(layer_init)`` on are dropped, and the other keys
+    are kept as they are.
+    """
+    keys = list(keys)
+    if not layer_init:
+        return OrderedDict((key, key) for key in keys)
+    targets = collections.defaultdict(list)
+    for i, layer in enumerate(layer_init):
+        targets[int(layer) - 1].append(i)
+    key_map = OrderedDict()
+    for key in keys:
+        m = _LAYER_KEY.search(key)
+        if m is None:
+            key_map.setdefault(key, key)
+            continue
+        layer = int(m.group(2))
+        if layer < len(layer_init):
+            key_map.setdefault(key, key)
+        for i in targets.get(layer, []):
+            new_key = "{}{}.layers.{}.{}".format(
+                key[: m.start()], m.group(1), i, key[m.end():]
+            )
+            # layers read from the checkpoint take precedence
+            key_map[new_key] = key
+    return key_map
+
+
 def prune_state_dict(state_dict, model_cfg: Optional[DictConfig]):
     """Prune the given state_dict if desired for LayerDrop
     (https://arxiv.org/abs/1909.11556).
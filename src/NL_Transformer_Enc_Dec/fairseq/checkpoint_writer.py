@@ -0,0 +1,149 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Background writing of checkpoints, so that saving only stalls training for
+as long as it takes to copy the state to CPU. Used by
+:class:`fairseq.trainer.Trainer` with --write-checkpoints-asynchronously.
+"""
+
+import logging
+import queue
+import threading
+
+import torch
+from fairseq import checkpoint_utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_to_cpu(state, pin_memory=None):
+    """Copy of the tensors of *state* on CPU, which training cannot modify.
+
+    CUDA tensors are copied into pinned memory without blocking, and the
+    copies are synchronized once at the end. CPU tensors are cloned, since
+    training updates them in place. As with :func:`fairseq.utils.move_to_cpu`,
+    half precision tensors are converted to float32. Tensors sharing the same
+    memory are copied once and stay shared in the snapshot.
+    """
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    copies = {}
+    from_cuda = False
+
+    def _snapshot(tensor):
+        nonlocal from_cuda
+        key = (
+            tensor.device,
+            tensor.data_ptr(),
+            tensor.dtype,
+            tuple(tensor.size()),
+            tuple(tensor.stride()),
+        )
+        if key in copies:
+            return copies[key]
+        source = tensor.detach()
+        converted = source.dtype in {torch.bfloat16, torch.float16}
+        if converted:
+            source = source.to(dtype=torch.float32)
+        if source.device.type == "cuda":
+            copy = torch.empty(
+                source.size(), dtype=source.dtype, pin_memory=pin_memory
+            )
+            copy.copy_(source, non_blocking=pin_memory)
+            from_cuda = True
+        elif converted or source.device.type != "cpu":
+            # a new tensor already
+            copy = source.cpu()
+        else:
+            copy = source.clone()
+        copies[key] = copy
+        return copy
+
+    def _apply(x):
+        if torch.is_tensor(x):
+            return _snapshot(x)
+        elif isinstance(x, dict):
+            return type(x)((key, _apply(value)) for key, value in x.items())
+        elif isinstance(x, list):
+            return [_apply(value) for value in x]
+        elif isinstance(x, tuple):
+            return tuple(_apply(value) for value in x)
+        return x
+
+    snapshot = _apply(state)
+    if from_cuda:
+        torch.cuda.synchronize()
+    return snapshot
+
+
+class AsyncCheckpointWriter(object):
+    """Writes checkpoints on a background thread.
+
+    :meth:`submit` queues a snapshot of the training state (see
+    :func:`snapshot_to_cpu`) and returns immediately unless *max_pending*
+    writes are already queued, which bounds the memory held by snapshots.
+    Each checkpoint is written to a temporary file, synced to disk and
+    renamed, and its aliases are linked to it, see
+    :func:`fairseq.checkpoint_utils.link_checkpoint`.
+
+    A failed write is logged and raised again by the next call to
+    :meth:`submit`, :meth:`wait` or :meth:`close`.
+
+    Args:
+        max_pending (int, optional): maximum number of queued writes
+            (default: 2)
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max(max_pending, 1))
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, name="checkpoint-writer", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, state, filenames, callback=None):
+        """Write *state* to ``filenames[0]``, make the other *filenames*
+        aliases of it and then call *callback*. Without a *state*, only
+        *callback* is called, after the writes queued before it."""
+        self._raise_error()
+        self.queue.put((state, list(filenames), callback))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                state, filenames, callback = item
+                if state is not None:
+                    checkpoint_utils.torch_persistent_save(state, filenames[0])
+                    for alias in filenames[1:]:
+                        checkpoint_utils.link_checkpoint(filenames[0], alias)
+                    logger.info(f"Finished writing checkpoint {filenames[0]}")
+                if callback is not None:
+                    callback()
+            except Exception as e:
+                logger.exception("asynchronous checkpoint write failed")
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def wait(self):
+        """Block until the queued writes are done."""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
@@ -0,0 +1,512 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Beam search over a stream of batches in which the sentences that outlive
+their batch are decoded together with those of other batches, instead of
+holding a nearly empty batch until its longest sentence is done. Used by
+``fairseq-generate --continuous-batching``.
+"""
+
+import math
+from typing import Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+from fairseq.sequence_generator import SequenceGeneratorWithAlignment
+
+
+def _pad_dim(tensor: Tensor, dim: int, size: int, value):
+    """Pad *tensor* with *value* along *dim* up to *size*."""
+    if tensor.size(dim) >= size:
+        return tensor
+    shape = list(tensor.size())
+    shape[dim] = size - tensor.size(dim)
+    return torch.cat([tensor, tensor.new_full(shape, value)], dim=dim)
+
+
+def _encoder_out_dims(key: str, pad: int):
+    """(batch dim, time dim, padding value) of an encoder output entry."""
+    if key.startswith("encoder_out") or key.startswith("encoder_states"):
+        return 1, 0, 0  # T x B x C
+    if key == "encoder_padding_mask":
+        return 0, 1, True  # B x T
+    if key == "encoder_embedding":
+        return 0, 1, 0  # B x T x C
+    if key == "src_tokens":
+        return 0, 1, pad  # B x T
+    return 0, None, None
+
+
+def merge_encoder_outs(encoder_outs: List[Dict[str, List[Tensor]]], pad: int):
+    """Concatenate the encoder outputs of several batches along the batch
+    dimension, padding the source positions to the longest batch."""
+    merged: Dict[str, List[Tensor]] = {}
+    for key, values in encoder_outs[0].items():
+        batch_dim, time_dim, value = _encoder_out_dims(key, pad)
+        merged[key] = []
+        for i in range(len(values)):
+            tensors = [out[key][i] for out in encoder_outs]
+            if time_dim is not None:
+                length = max(t.size(time_dim) for t in tensors)
+                tensors = [_pad_dim(t, time_dim, length, value) for t in tensors]
+            merged[key].append(torch.cat(tensors, dim=batch_dim))
+    return merged
+
+
+def _merge_attention_buffers(buffers: List[Dict[str, Optional[Tensor]]]):
+    # saved keys and values are bsz x heads x len x head_dim. Self-attention
+    # buffers of states at the same step have the same length; the static
+    # encoder-decoder buffers are padded to the longest source, and the
+    # padding is masked
+    length = max(b["prev_key"].size(2) for b in buffers)
+    masks = [b.get("prev_key_padding_mask") for b in buffers]
+    need_mask = any(m is not None for m in masks) or any(
+        b["prev_key"].size(2) < length for b in buffers
+    )
+    merged: Dict[str, Optional[Tensor]] = {
+        "prev_key": torch.cat([_pad_dim(b["prev_key"], 2, length, 0) for b in buffers]),
+        "prev_value": torch.cat(
+            [_pad_dim(b["prev_value"], 2, length, 0) for b in buffers]
+        ),
+        "prev_key_padding_mask": None,
+    }
+    if need_mask:
+        dtype = next((m.dtype for m in masks if m is not None), torch.bool)
+        padded = []
+        for b, mask in zip(buffers, masks):
+            if mask is None:
+                mask = torch.zeros(
+                    b["prev_key"].size(0),
+                    b["prev_key"].size(2),
+                    dtype=dtype,
+                    device=b["prev_key"].device,
+                )
+            padded.append(_pad_dim(mask.to(dtype), 1, length, 1))
+        merged["prev_key_padding_mask"] = torch.cat(padded)
+    return merged
+
+
+def merge_incremental_states(states: List[Dict]):
+    """Concatenate the incremental decoder states of several batches that
+    are at the same decoding step."""
+    merged = {}
+    for key, value in states[0].items():
+        values = [state[key] for state in states]
+        if isinstance(value, dict):
+            if "prev_key" in value:
+                merged[key] = _merge_attention_buffers(values)
+            else:
+                # e.g. the per-path states of NL decoders
+                merged[key] = merge_incremental_states(values)
+        elif value is None:
+            merged[key] = None
+        else:
+            merged[key] = torch.cat(values, dim=0)
+    return merged
+
+
+class _Cohort(object):
+    """Beam search state of sentences decoded together, all at the same step.
+
+    Slots are the sentences the cohort was started or merged with; the rows
+    of the tensors are the unfinished slots, in order (there are
+    ``beam_size`` rows per sentence in *tokens*, *scores* and the decoder
+    state)."""
+
+    def __init__(self):
+        self.step = 0
+        self.ids: List[int] = []
+        self.finalized: List[List[Dict[str, Tensor]]] = []
+        self.finished: List[bool] = []
+        self.row_ids: Optional[Tensor] = None
+        self.src_lengths: Optional[Tensor] = None
+        self.max_lens: Optional[Tensor] = None
+        self.src_len = 0
+        self.tokens: Optional[Tensor] = None
+        self.scores: Optional[Tensor] = None
+        self.attn: Optional[Tensor] = None
+        self.cands_to_ignore: Optional[Tensor] = None
+        self.encoder_outs = None
+        self.incremental_states = None
+        self.reorder_state: Optional[Tensor] = None
+        self.batch_idxs: Optional[Tensor] = None
+
+    @property
+    def bsz(self):
+        return self.cands_to_ignore.size(0)
+
+    @property
+    def done(self):
+        return self.tokens is None
+
+    def cost(self):
+        return self.bsz * self.src_len
+
+
+class ContinuousSequenceGenerator(object):
+    """Beam search of :class:`~fairseq.sequence_generator.SequenceGenerator`
+    over a stream of batches, with the stragglers of different batches
+    decoded together.
+
+    Finished sentences leave the batch as in *generator*. Every
+    *merge_interval* steps, a batch whose remaining sentences fill less than
+    *refill_ratio* of the largest batch seen so far (measured in padded
+    source tokens) is set aside. Batches set aside at the same step are
+    merged, their encoder outputs and decoder states padded to the longest
+    source, and decoding resumes once they fill a batch or the input is
+    exhausted. The hypotheses are those *generator* finds for each batch.
+
+    Prefix tokens, constraints and alignment are not supported.
+
+    Args:
+        generator (~fairseq.sequence_generator.SequenceGenerator): the beam
+            search to run
+        merge_interval (int, optional): steps between two chances to set a
+            batch aside (default: 8)
+        refill_ratio (float, optional): batches are set aside below this
+            fraction of the largest batch (default: 0.5)
+    """
+
+    def __init__(self, generator, merge_interval=8, refill_ratio=0.5):
+        if (
+            isinstance(generator, SequenceGeneratorWithAlignment)
+            or generator.search.supports_constraints
+            or generator.search.stop_on_max_len
+        ):
+            raise ValueError(
+                "continuous batching does not support alignment, constraints "
+                "or prefix-constrained search"
+            )
+        assert merge_interval > 0, "merge_interval must be positive"
+        self.generator = generator
+        self.merge_interval = merge_interval
+        self.refill_ratio = refill_ratio
+
+    def generate(self, samples):
+        """Yield ``(sample id, hypotheses)`` for every sentence of *samples*,
+        an iterable of batches, in the order the sentences finish."""
+        pools: Dict[int, List[_Cohort]] = {}
+        budget = 0
+        for sample in samples:
+            if "net_input" not in sample:
+                continue
+            cohort = self._start(sample)
+            budget = max(budget, cohort.cost())
+            yield from self._run(cohort, pools, budget)
+        # resume the batches set aside, earliest step first
+        while pools:
+            step = min(pools)
+            pool = pools.pop(step)
+            group = self._take(pool, budget)
+            if pool:
+                pools[step] = pool
+            yield from self._run(self._merge(group), pools, budget)
+
+    def _run(self, cohort: _Cohort, pools: Dict[int, List[_Cohort]], budget: int):
+        while True:
+            for result in self._step(cohort):
+                yield result
+            if cohort.done:
+                return
+            if (
+                cohort.step % self.merge_interval != 0
+                or cohort.cost() >= self.refill_ratio * budget
+            ):
+                continue
+            self._set_aside(cohort)
+            pool = pools.setdefault(cohort.step, [])
+            pool.append(cohort)
+            if self._merged_cost(pool) < budget:
+                return
+            cohort = self._merge(self._take(pool, budget))
+            if not pool:
+                del pools[cohort.step]
+
+    @staticmethod
+    def _merged_cost(cohorts: List[_Cohort]):
+        return sum(c.bsz for c in cohorts) * max(c.src_len for c in cohorts)
+
+    @staticmethod
+    def _take(pool: List[_Cohort], budget: int):
+        """Remove from *pool* the leading cohorts that fit in *budget* once
+        merged (at least one)."""
+        group: List[_Cohort] = []
+        while pool and (not group or ContinuousSequenceGenerator._merged_cost(
+            group + pool[:1]
+        ) <= budget):
+            group.append(pool.pop(0))
+        return group
+
+    @torch.no_grad()
+    def _start(self, sample) -> _Cohort:
+        g = self.generator
+        beam_size = g.beam_size
+        net_input = sample["net_input"]
+        src_tokens = net_input["src_tokens"]
+        # length of the source text being the character length except EndOfSentence and pad
+        src_lengths = (src_tokens.ne(g.eos) & src_tokens.ne(g.pad)).long().sum(dim=1)
+        bsz, src_len = src_tokens.size()[:2]
+
+        if g.match_source_len:
+            max_len = src_lengths.max().item()
+        else:
+            max_len = min(int(g.max_len_a * src_len + g.max_len_b), g.max_len - 1)
+        assert (
+            g.min_len <= max_len
+        ), "min_len cannot be larger than max_len, please adjust these!"
+
+        encoder_outs = g.model.forward_encoder(net_input)
+        new_order = torch.arange(bsz).view(-1, 1).repeat(1, beam_size).view(-1)
+        new_order = new_order.to(src_tokens.device).long()
+        encoder_outs = g.model.reorder_encoder_out(encoder_outs, new_order)
+
+        c = _Cohort()
+        c.ids = sample["id"].tolist()
+        c.finalized = [[] for _ in range(bsz)]
+        c.finished = [False for _ in range(bsz)]
+        c.row_ids = sample["id"].to(src_tokens.device).long()
+        c.src_lengths = src_lengths
+        c.max_lens = torch.full(
+            (bsz,), max_len, dtype=torch.long, device=src_tokens.device
+        )
+        c.src_len = src_len
+        # +1 for eos; pad is never chosen for scoring
+        c.scores = torch.zeros(bsz * beam_size, max_len + 1).to(src_tokens).float()
+        # +2 for eos and pad
+        c.tokens = (
+            torch.zeros(bsz * beam_size, max_len + 2).to(src_tokens).long().fill_(g.pad)
+        )
+        c.tokens[:, 0] = g.eos
+        c.cands_to_ignore = torch.zeros(bsz, beam_size).to(src_tokens).eq(-1)
+        c.encoder_outs = encoder_outs
+        c.incremental_states = [{} for _ in range(g.model.models_size)]
+        return c
+
+    def _reorder(self, c: _Cohort):
+        """Apply the reordering chosen at the previous step to the decoder
+        state and the encoder outputs."""
+        if c.reorder_state is None:
+            return
+        g = self.generator
+        reorder_state = c.reorder_state
+        if c.batch_idxs is not None:
+            # update beam indices to take into account removed sentences
+            corr = c.batch_idxs - torch.arange(c.batch_idxs.numel()).type_as(
+                c.batch_idxs
+            )
+            reorder_state.view(-1, g.beam_size).add_(corr.unsqueeze(-1) * g.beam_size)
+        g.model.reorder_incremental_state(c.incremental_states, reorder_state)
+        c.encoder_outs = g.model.reorder_encoder_out(c.encoder_outs, reorder_state)
+        c.reorder_state = None
+        c.batch_idxs = None
+
+    def _set_aside(self, c: _Cohort):
+        self._reorder(c)
+        # drop the finished slots, so that slots and rows coincide
+        keep = [i for i, finished in enumerate(c.finished) if not finished]
+        c.ids = [c.ids[i] for i in keep]
+        c.finalized = [c.finalized[i] for i in keep]
+        c.finished = [False for _ in keep]
+
+    @torch.no_grad()
+    def _merge(self, cohorts: List[_Cohort]) -> _Cohort:
+        if len(cohorts) == 1:
+            return cohorts[0]
+        g = self.generator
+        merged = _Cohort()
+        merged.step = cohorts[0].step
+        assert all(c.step == merged.step for c in cohorts)
+        for c in cohorts:
+            merged.ids.extend(c.ids)
+            merged.finalized.extend(c.finalized)
+        merged.finished = [False for _ in merged.ids]
+        merged.src_len = max(c.src_len for c in cohorts)
+        for name in ["row_ids", "src_lengths", "max_lens", "cands_to_ignore"]:
+            setattr(merged, name, torch.cat([getattr(c, name) for c in cohorts]))
+
+        width = max(c.tokens.size(1) for c in cohorts)
+        merged.tokens = torch.cat([_pad_dim(c.tokens, 1, width, g.pad) for c in cohorts])
+        merged.scores = torch.cat([_pad_dim(c.scores, 1, width - 1, 0) for c in cohorts])
+        if cohorts[0].attn is not None:
+            attn_len = max(c.attn.size(1) for c in cohorts)
+            merged.attn = torch.cat(
+                [_pad_dim(_pad_dim(c.attn, 1, attn_len, 0), 2, width, 0) for c in cohorts]
+            )
+
+        merged.encoder_outs = [
+            merge_encoder_outs([c.encoder_outs[i] for c in cohorts], g.pad)
+            for i in range(len(cohorts[0].encoder_outs))
+        ]
+        merged.incremental_states = [
+            merge_incremental_states([c.incremental_states[i] for c in cohorts])
+            for i in range(len(cohorts[0].incremental_states))
+        ]
+        return merged
+
+    @torch.no_grad()
+    def _step(self, c: _Cohort):
+        """Decode one step of *c*, returning the sentences it finished."""
+        g = self.generator
+        beam_size = g.beam_size
+        step = c.step
+        bsz = c.bsz
+        self._reorder(c)
+
+        lprobs, avg_attn_scores = g.model.forward_decoder(
+            c.tokens[:, : step + 1], c.encoder_outs, c.incremental_states, g.temperature
+        )
+        if g.lm_model is not None:
+            lm_out = g.lm_model(c.tokens[:, : step + 1])
+            probs = g.lm_model.get_normalized_probs(lm_out, log_probs=True, sample=None)
+            lprobs += probs[:, -1, :] * g.lm_weight
+
+        lprobs[lprobs != lprobs] = torch.tensor(-math.inf).to(lprobs)
+        lprobs[:, g.pad] = -math.inf  # never select pad
+        lprobs[:, g.unk] -= g.unk_penalty  # apply unk penalty
+
+        # handle max length constraint, which differs between merged batches
+        at_max_len = c.max_lens.le(step)
+        if at_max_len.any():
+            rows = at_max_len.repeat_interleave(beam_size)
+            lprobs[rows, : g.eos] = -math.inf
+            lprobs[rows, g.eos + 1 :] = -math.inf
+        if step < g.min_len:
+            lprobs[:, g.eos] = -math.inf
+
+        if avg_attn_scores is not None:
+            if c.attn is None:
+                c.attn = torch.empty(
+                    bsz * beam_size, avg_attn_scores.size(1), c.tokens.size(1)
+                ).to(c.scores)
+            c.attn[:, :, step + 1].copy_(avg_attn_scores)
+
+        c.scores = c.scores.type_as(lprobs)
+        if g.should_set_src_lengths:
+            g.search.set_src_lengths(c.src_lengths)
+        if g.repeat_ngram_blocker is not None:
+            lprobs = g.repeat_ngram_blocker(c.tokens, lprobs, bsz, beam_size, step)
+
+        cand_scores, cand_indices, cand_beams = g.search.step(
+            step,
+            lprobs.view(bsz, -1, g.vocab_size),
+            c.scores.view(bsz, beam_size, -1)[:, :, :step],
+            c.tokens[:, : step + 1],
+            c.row_ids,
+        )
+        cand_size = 2 * beam_size
+        bbsz_offsets = (torch.arange(0, bsz) * beam_size).unsqueeze(1).to(c.tokens)
+        cand_offsets = torch.arange(0, cand_size).to(c.tokens)
+        cand_bbsz_idx = cand_beams.add(bbsz_offsets)
+
+        # finalize hypotheses that end in eos, among the top beam_size candidates
+        eos_mask = cand_indices.eq(g.eos) & cand_scores.ne(-math.inf)
+        eos_mask[:, :beam_size][c.cands_to_ignore] = torch.tensor(0).to(eos_mask)
+        eos_bbsz_idx = torch.masked_select(
+            cand_bbsz_idx[:, :beam_size], mask=eos_mask[:, :beam_size]
+        )
+
+        unfinished = [i for i, finished in enumerate(c.finished) if not finished]
+        finalized_rows: List[int] = []
+        if eos_bbsz_idx.numel() > 0:
+            eos_scores = torch.masked_select(
+                cand_scores[:, :beam_size], mask=eos_mask[:, :beam_size]
+            )
+            # the maximum length is checked below, per sentence
+            finalized_rows = g.finalize_hypos(
+                step,
+                eos_bbsz_idx,
+                eos_scores,
+                c.tokens,
+                c.scores,
+                c.finalized,
+                c.finished,
+                beam_size,
+                c.attn,
+                c.src_lengths,
+                -1,
+            )
+        for row in at_max_len.nonzero().view(-1).tolist():
+            if not c.finished[unfinished[row]]:
+                c.finished[unfinished[row]] = True
+                finalized_rows.append(row)
+
+        results = []
+        for row in finalized_rows:
+            slot = unfinished[row]
+            hypos = c.finalized[slot]
+            order = torch.tensor([float(h["score"].item()) for h in hypos]).sort(
+                descending=True
+            )[1]
+            results.append((c.ids[slot], [hypos[i] for i in order]))
+            c.finalized[slot] = []
+
+        if len(finalized_rows) == bsz:
+            c.tokens = c.scores = c.attn = None
+            c.encoder_outs = c.incremental_states = None
+            return results
+
+        # remove the finished sentences from the batch
+        if len(finalized_rows) > 0:
+            new_bsz = bsz - len(finalized_rows)
+            batch_mask = torch.ones(bsz, dtype=torch.bool, device=cand_indices.device)
+            batch_mask[finalized_rows] = False
+            batch_idxs = torch.arange(bsz, device=cand_indices.device).masked_select(
+                batch_mask
+            )
+
+            eos_mask = eos_mask[batch_idxs]
+            cand_beams = cand_beams[batch_idxs]
+            cand_bbsz_idx = cand_beams.add(bbsz_offsets[:new_bsz])
+            cand_scores = cand_scores[batch_idxs]
+            cand_indices = cand_indices[batch_idxs]
+
+            c.row_ids = c.row_ids[batch_idxs]
+            c.src_lengths = c.src_lengths[batch_idxs]
+            c.max_lens = c.max_lens[batch_idxs]
+            c.cands_to_ignore = c.cands_to_ignore[batch_idxs]
+            c.scores = c.scores.view(bsz, -1)[batch_idxs].view(new_bsz * beam_size, -1)
+            c.tokens = c.tokens.view(bsz, -1)[batch_idxs].view(new_bsz * beam_size, -1)
+            if c.attn is not None:
+                c.attn = c.attn.view(bsz, -1)[batch_idxs].view(
+                    new_bsz * beam_size, c.attn.size(1), -1
+                )
+            bsz = new_bsz
+            c.batch_idxs = batch_idxs
+
+        # the top beam_size candidates that do not end in eos continue
+        eos_mask[:, :beam_size] = ~((~c.cands_to_ignore) & (~eos_mask[:, :beam_size]))
+        active_mask = torch.add(
+            eos_mask.type_as(cand_offsets) * cand_size,
+            cand_offsets[: eos_mask.size(1)],
+        )
+        new_cands_to_ignore, active_hypos = torch.topk(
+            active_mask, k=beam_size, dim=1, largest=False
+        )
+        c.cands_to_ignore = new_cands_to_ignore.ge(cand_size)[:, :beam_size]
+        assert (~c.cands_to_ignore).any(dim=1).all()
+
+        active_bbsz_idx = torch.gather(cand_bbsz_idx, dim=1, index=active_hypos).view(-1)
+        c.tokens[:, : step + 1] = torch.index_select(
+            c.tokens[:, : step + 1], dim=0, index=active_bbsz_idx
+        )
+        c.tokens.view(bsz, beam_size, -1)[:, :, step + 1] = torch.gather(
+            cand_indices, dim=1, index=active_hypos
+        )
+        if step > 0:
+            c.scores[:, :step] = torch.index_select(
+                c.scores[:, :step], dim=0, index=active_bbsz_idx
+            )
+        c.scores.view(bsz, beam_size, -1)[:, :, step] = torch.gather(
+            cand_scores, dim=1, index=active_hypos
+        )
+        if c.attn is not None:
+            c.attn[:, :, : step + 2] = torch.index_select(
+                c.attn[:, :, : step + 2], dim=0, index=active_bbsz_idx
+            )
+
+        c.reorder_state = active_bbsz_idx
+        c.step += 1
+        return results
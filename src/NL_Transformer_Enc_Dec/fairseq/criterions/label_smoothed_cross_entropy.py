@@ -5,14 +5,20 @@
 
 import math
 from dataclasses import dataclass, field
+from typing import Optional
 
 import torch
+import torch.utils.checkpoint
 from fairseq import metrics, utils
 from fairseq.criterions import FairseqCriterion, register_criterion
-from fairseq.dataclass import FairseqDataclass
+from fairseq.dataclass import ChoiceEnum, FairseqDataclass
+from fairseq.path_sampling import PathSampler, parse_probs
 from omegaconf import II
 
 
+PATH_SAMPLING_CHOICES = ChoiceEnum(["uniform", "scheduled", "learned"])
+
+
 @dataclass
 class LabelSmoothedCrossEntropyCriterionConfig(FairseqDataclass):
     label_smoothing: float = field(
@@ -30,6 +36,47 @@ class LabelSmoothedCrossEntropyCriterionConfig(FairseqDataclass):
     sentence_avg: bool = II("optimization.sentence_avg")
 
 
+@dataclass
+class LabelSmoothedCrossEntropyCriterionConfig_NL(LabelSmoothedCrossEntropyCriterionConfig):
+    projection_chunk_size: int = field(
+        default=0,
+        metadata={
+            "help": "if > 0, take the decoder features of the three NL paths and "
+            "project them to the vocabulary in chunks of this many target tokens, "
+            "recomputing each chunk in backward so the full logits are never stored"
+        },
+    )
+    sample_paths: int = field(
+        default=0,
+        metadata={
+            "help": "if > 0, run and train only this many of the three NL paths "
+            "per step, with the loss reweighted so that its gradient stays an "
+            "unbiased estimate of the full one"
+        },
+    )
+    path_sampling: PATH_SAMPLING_CHOICES = field(
+        default="uniform",
+        metadata={
+            "help": "how --sample-paths draws the paths: uniformly, with "
+            "probabilities annealed from --path-sampling-probs to "
+            "--path-sampling-final-probs, or proportionally to a running "
+            "average of each path's loss"
+        },
+    )
+    path_sampling_probs: Optional[str] = field(
+        default=None,
+        metadata={"help": "comma separated initial path probabilities of scheduled sampling"},
+    )
+    path_sampling_final_probs: Optional[str] = field(
+        default=None,
+        metadata={"help": "comma separated final path probabilities of scheduled sampling (default: uniform)"},
+    )
+    path_sampling_anneal_updates: int = field(
+        default=0,
+        metadata={"help": "number of updates over which scheduled sampling anneals the probabilities"},
+    )
+
+
 def label_smoothed_nll_loss(lprobs, target, epsilon, ignore_index=None, reduce=True):
     if target.dim() == lprobs.dim() - 1:
         target = target.unsqueeze(-1)
@@ -173,6 +220,10 @@ class LabelSmoothedCrossEntropyCriterion(FairseqCriterion):
     "label_smoothed_cross_entropy_DL", dataclass=LabelSmoothedCrossEntropyCriterionConfig
 )
 class LabelSmoothedCrossEntropyCriterion_DL(FairseqCriterion):
+    # number of decoder paths, which selects the generation of the BLEU
+    # validation
+    num_paths = 2
+
     def __init__(
         self,
         task,
@@ -191,7 +242,8 @@ class LabelSmoothedCrossEntropyCriterion_DL(FairseqCriterion):
         """Compute the loss for the given sample.
 
         Returns a tuple with three elements:
-        1) the loss
+        1) the loss of every path, in a dict that holds the total loss
+           under "loss"
         2) the sample size, which is used as the denominator for the gradient
         3) logging outputs to display while training
         """
@@ -218,8 +270,8 @@ class LabelSmoothedCrossEntropyCriterion_DL(FairseqCriterion):
             n_correct, total = self.compute_accuracy(model, net_output, sample)
             logging_output["n_correct"] = utils.item(n_correct.data)
             logging_output["total"] = utils.item(total.data)
-        #return loss, loss_1, loss_2, loss_3, sample_size, logging_output
-        return loss, loss_1, loss_2, sample_size, logging_output
+        losses = {"loss": loss, "loss_1": loss_1, "loss_2": loss_2}
+        return losses, sample_size, logging_output
 
     def get_lprobs_and_target_DL(self, model, net_output, sample):
         #lprobs_1, lprobs_2, lprobs_3 = model.get_normalized_probs_DL(net_output, log_probs=True)
@@ -273,7 +325,7 @@ class LabelSmoothedCrossEntropyCriterion_DL(FairseqCriterion):
         return n_correct, total
 
     @classmethod
-    def reduce_metrics_DL(cls, logging_outputs) -> None:
+    def reduce_metrics(cls, logging_outputs) -> None:
         """Aggregate logging outputs from data parallel training."""
         loss_sum = sum(log.get("loss", 0) for log in logging_outputs)
         loss_1_sum = sum(log.get("loss_1", 0) for log in logging_outputs)
@@ -343,9 +395,13 @@ class LabelSmoothedCrossEntropyCriterion_DL(FairseqCriterion):
         return True
 
 @register_criterion(
-    "label_smoothed_cross_entropy_NL", dataclass=LabelSmoothedCrossEntropyCriterionConfig
+    "label_smoothed_cross_entropy_NL", dataclass=LabelSmoothedCrossEntropyCriterionConfig_NL
 )
 class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
+    # number of decoder paths, which selects the generation of the BLEU
+    # validation
+    num_paths = 3
+
     def __init__(
         self,
         task,
@@ -353,23 +409,57 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
         label_smoothing,
         ignore_prefix_size=0,
         report_accuracy=False,
+        projection_chunk_size=0,
+        sample_paths=0,
+        path_sampling="uniform",
+        path_sampling_probs=None,
+        path_sampling_final_probs=None,
+        path_sampling_anneal_updates=0,
     ):
         super().__init__(task)
         self.sentence_avg = sentence_avg
         self.eps = label_smoothing
         self.ignore_prefix_size = ignore_prefix_size
         self.report_accuracy = report_accuracy
+        self.projection_chunk_size = projection_chunk_size
+        self.path_sampler = None
+        if 0 < sample_paths < 3:
+            self.path_sampler = PathSampler(
+                3,
+                sample_paths,
+                mode=path_sampling,
+                probs=parse_probs(path_sampling_probs, 3),
+                final_probs=parse_probs(path_sampling_final_probs, 3),
+                anneal_updates=path_sampling_anneal_updates,
+            )
+        self.num_updates = 0
+
+    def set_num_updates(self, num_updates):
+        self.num_updates = num_updates
 
     def forward(self, model, sample, reduce=True):
         """Compute the loss for the given sample.
 
         Returns a tuple with three elements:
-        1) the loss
+        1) the loss of every path, in a dict that holds the total loss
+           under "loss"
         2) the sample size, which is used as the denominator for the gradient
         3) logging outputs to display while training
+
+        With --sample-paths, training steps only run the sampled paths; the
+        losses of the other paths are returned as zeros.
         """
-        net_output = model(**sample["net_input"])
-        loss, loss_1, loss_2, loss_3, nll_loss, nll_loss_1, nll_loss_2, nll_loss_3 = self.compute_loss_NL(model, net_output, sample, reduce=reduce)
+        paths, weights = None, None
+        net_input = sample["net_input"]
+        if self.path_sampler is not None and model.training and reduce:
+            paths, weights = self.path_sampler.sample(self.num_updates)
+            net_input = dict(net_input, paths=paths)
+        if self.projection_chunk_size > 0 and reduce:
+            net_output = model(**net_input, features_only=True)
+            loss, loss_1, loss_2, loss_3, nll_loss, nll_loss_1, nll_loss_2, nll_loss_3 = self.compute_loss_NL_chunked(model, net_output, sample, paths, weights)
+        else:
+            net_output = model(**net_input)
+            loss, loss_1, loss_2, loss_3, nll_loss, nll_loss_1, nll_loss_2, nll_loss_3 = self.compute_loss_NL(model, net_output, sample, reduce=reduce, paths=paths, weights=weights)
         sample_size = (
             sample["target"].size(0) if self.sentence_avg else sample["ntokens"]
         )
@@ -386,11 +476,24 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
             "nsentences": sample["target"].size(0),
             "sample_size": sample_size,
         }
+        if paths is not None:
+            # per-path losses are averaged over the steps that ran the path
+            path_losses = [loss_1, loss_2, loss_3]
+            for path in range(3):
+                visited = path in paths
+                logging_output["visits_{}".format(path + 1)] = int(visited)
+                logging_output["sample_size_{}".format(path + 1)] = sample_size if visited else 0
+                logging_output["ntokens_{}".format(path + 1)] = sample["ntokens"] if visited else 0
+                if visited and self.path_sampler.mode == "learned":
+                    self.path_sampler.observe(
+                        path, path_losses[path].data / max(sample["ntokens"], 1)
+                    )
         if self.report_accuracy:
             n_correct, total = self.compute_accuracy(model, net_output, sample)
             logging_output["n_correct"] = utils.item(n_correct.data)
             logging_output["total"] = utils.item(total.data)
-        return loss, loss_1, loss_2, loss_3, sample_size, logging_output
+        losses = {"loss": loss, "loss_1": loss_1, "loss_2": loss_2, "loss_3": loss_3}
+        return losses, sample_size, logging_output
         
     def get_lprobs_and_target_NL(self, model, net_output, sample):
         lprobs_1, lprobs_2, lprobs_3 = model.get_normalized_probs_NL(net_output, log_probs=True)
@@ -407,8 +510,10 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
                 lprobs_3 = lprobs_3[self.ignore_prefix_size :, :, :].contiguous()
                 target = target[self.ignore_prefix_size :, :].contiguous()
         return lprobs_1.view(-1, lprobs_1.size(-1)), lprobs_2.view(-1, lprobs_2.size(-1)), lprobs_3.view(-1, lprobs_3.size(-1)), target.view(-1)
-        
-    def compute_loss_NL(self, model, net_output, sample, reduce=True):
+
+    def compute_loss_NL(self, model, net_output, sample, reduce=True, paths=None, weights=None):
+        if paths is not None:
+            return self.compute_sampled_loss_NL(model, net_output, sample, paths, weights)
         lprobs_1, lprobs_2, lprobs_3, target = self.get_lprobs_and_target_NL(model, net_output, sample)
         loss_1, nll_loss_1 = label_smoothed_nll_loss(
             lprobs_1,
@@ -434,6 +539,100 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
         loss = (1/3)*(loss_1 + loss_2 + loss_3)
         nll_loss = (1/3)*(nll_loss_1 + nll_loss_2 + nll_loss_3)
         return loss, loss_1, loss_2, loss_3, nll_loss, nll_loss_1, nll_loss_2, nll_loss_3
+
+    def compute_sampled_loss_NL(self, model, net_output, sample, paths, weights):
+        """
+        Reduced losses of the sampled *paths*, the only ones in *net_output*.
+        The total loss is the sum of their losses scaled by *weights*; the
+        losses of the other paths are zeros.
+        """
+        target = model.get_targets(sample, net_output)
+        if self.ignore_prefix_size > 0:
+            target = target[:, self.ignore_prefix_size :]
+        target = target.reshape(-1)
+        all_lprobs = model.get_normalized_probs_NL(net_output, log_probs=True)
+        losses = [target.new_zeros((), dtype=torch.float)] * 3
+        nll_losses = [target.new_zeros((), dtype=torch.float)] * 3
+        loss, nll_loss = 0.0, 0.0
+        for path, weight in zip(paths, weights):
+            lprobs = all_lprobs[path]
+            if self.ignore_prefix_size > 0:
+                lprobs = lprobs[:, self.ignore_prefix_size :, :]
+            losses[path], nll_losses[path] = label_smoothed_nll_loss(
+                lprobs.reshape(-1, lprobs.size(-1)),
+                target,
+                self.eps,
+                ignore_index=self.padding_idx,
+                reduce=True,
+            )
+            loss = loss + weight * losses[path]
+            nll_loss = nll_loss + weight * nll_losses[path]
+        return (loss, *losses, nll_loss, *nll_losses)
+
+    def compute_loss_NL_chunked(self, model, net_output, sample, paths=None, weights=None):
+        """
+        Same (reduced) losses as *compute_loss_NL*, computed from the decoder
+        features of the three paths. Padding positions are dropped before the
+        output projection, and the remaining tokens are projected, for all
+        paths at once, *projection_chunk_size* tokens at a time. With
+        *paths*, only those paths are projected and their losses are summed
+        with *weights*, as in *compute_sampled_loss_NL*.
+        """
+        decoder = model.decoder
+        if getattr(decoder, "adaptive_softmax", None) is not None:
+            raise ValueError("--projection-chunk-size does not support adaptive softmax")
+        all_paths = [0, 1, 2] if paths is None else paths
+        features = [net_output[path] for path in all_paths]
+        target = model.get_targets(sample, net_output)
+        if self.ignore_prefix_size > 0:
+            features = [f[:, self.ignore_prefix_size :, :] for f in features]
+            target = target[:, self.ignore_prefix_size :]
+        target = target.reshape(-1)
+        keep = target.ne(self.padding_idx)
+        target = target[keep]
+        # 3 x N x C
+        features = torch.stack([f.reshape(-1, f.size(-1))[keep] for f in features])
+
+        def chunk_loss(chunk_features, chunk_target):
+            lprobs = utils.log_softmax(decoder.output_layer(chunk_features), dim=-1)
+            loss, nll_loss = label_smoothed_nll_loss(
+                lprobs,
+                chunk_target.unsqueeze(0).expand(lprobs.size(0), -1),
+                self.eps,
+                reduce=False,
+            )
+            return loss.view(lprobs.size(0), -1).sum(-1), nll_loss.view(lprobs.size(0), -1).sum(-1)
+
+        losses = features.new_zeros(len(all_paths), dtype=torch.float)
+        nll_losses = features.new_zeros(len(all_paths), dtype=torch.float)
+        for start in range(0, target.numel(), self.projection_chunk_size):
+            end = start + self.projection_chunk_size
+            if torch.is_grad_enabled():
+                loss, nll_loss = torch.utils.checkpoint.checkpoint(
+                    chunk_loss, features[:, start:end], target[start:end]
+                )
+            else:
+                loss, nll_loss = chunk_loss(features[:, start:end], target[start:end])
+            losses = losses + loss.float()
+            nll_losses = nll_losses + nll_loss.float()
+
+        if paths is not None:
+            scale = losses.new_tensor(weights)
+            path_losses = [losses.new_zeros(())] * 3
+            path_nll_losses = [losses.new_zeros(())] * 3
+            for i, path in enumerate(paths):
+                path_losses[path] = losses[i]
+                path_nll_losses[path] = nll_losses[i]
+            return (
+                (losses * scale).sum(), *path_losses,
+                (nll_losses * scale).sum(), *path_nll_losses,
+            )
+
+        loss_1, loss_2, loss_3 = losses.unbind(0)
+        nll_loss_1, nll_loss_2, nll_loss_3 = nll_losses.unbind(0)
+        loss = (1/3)*(loss_1 + loss_2 + loss_3)
+        nll_loss = (1/3)*(nll_loss_1 + nll_loss_2 + nll_loss_3)
+        return loss, loss_1, loss_2, loss_3, nll_loss, nll_loss_1, nll_loss_2, nll_loss_3
         
     def compute_accuracy(self, model, net_output, sample):
         lprobs, target = self.get_lprobs_and_target(model, net_output, sample)
@@ -445,7 +644,7 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
         return n_correct, total
 
     @classmethod
-    def reduce_metrics_NL(cls, logging_outputs) -> None:
+    def reduce_metrics(cls, logging_outputs) -> None:
         """Aggregate logging outputs from data parallel training."""
         loss_sum = sum(log.get("loss", 0) for log in logging_outputs)
         loss_1_sum = sum(log.get("loss_1", 0) for log in logging_outputs)
@@ -463,28 +662,42 @@ class LabelSmoothedCrossEntropyCriterion_NL(FairseqCriterion):
         metrics.log_scalar(
             "loss", loss_sum / sample_size / math.log(2), sample_size, round=3
         )
-        metrics.log_scalar(
-            "loss_1", loss_1_sum / sample_size / math.log(2), sample_size, round=3
-        )
-        metrics.log_scalar(
-            "loss_2", loss_2_sum / sample_size / math.log(2), sample_size, round=3
-        )
-        metrics.log_scalar(
-            "loss_3", loss_3_sum / sample_size / math.log(2), sample_size, round=3
-        )        
+
+        # with --sample-paths, a path's losses are averaged over the steps
+        # that ran it only
+        path_sample_sizes = [sample_size] * 3
+        path_ntokens = [ntokens] * 3
+        sampled = any("visits_1" in log for log in logging_outputs)
+        if sampled:
+            path_sample_sizes = [
+                sum(log.get("sample_size_{}".format(i), 0) for log in logging_outputs)
+                for i in range(1, 4)
+            ]
+            path_ntokens = [
+                sum(log.get("ntokens_{}".format(i), 0) for log in logging_outputs)
+                for i in range(1, 4)
+            ]
+
+        for i, path_loss_sum in enumerate([loss_1_sum, loss_2_sum, loss_3_sum]):
+            if not sampled or path_sample_sizes[i] > 0:
+                metrics.log_scalar(
+                    "loss_{}".format(i + 1), path_loss_sum / path_sample_sizes[i] / math.log(2), path_sample_sizes[i], round=3
+                )
         metrics.log_scalar(
             "nll_loss", nll_loss_sum / ntokens / math.log(2), ntokens, round=3
         )
-        metrics.log_scalar(
-            "nll_loss_1", nll_loss_1_sum / ntokens / math.log(2), ntokens, round=3
-        )
-        metrics.log_scalar(
-            "nll_loss_2", nll_loss_2_sum / ntokens / math.log(2), ntokens, round=3
-        )
-        metrics.log_scalar(
-            "nll_loss_3", nll_loss_3_sum / ntokens / math.log(2), ntokens, round=3
-        )
-        
+        for i, path_nll_loss_sum in enumerate([nll_loss_1_sum, nll_loss_2_sum, nll_loss_3_sum]):
+            if not sampled or path_ntokens[i] > 0:
+                metrics.log_scalar(
+                    "nll_loss_{}".format(i + 1), path_nll_loss_sum / path_ntokens[i] / math.log(2), path_ntokens[i], round=3
+                )
+        if sampled:
+            for i in range(1, 4):
+                metrics.log_scalar_sum(
+                    "visits_{}".format(i),
+                    sum(log.get("visits_{}".format(i), 0) for log in logging_outputs),
+                )
+
         metrics.log_derived(
             "ppl", lambda meters: utils.get_perplexity(meters["nll_loss"].avg)
         )
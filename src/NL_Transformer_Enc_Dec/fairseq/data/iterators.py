@@ -263,6 +263,9 @@ class EpochBatchIterator(EpochBatchIterating):
             from workers. Should always be non-negative (default: ``0``).
         disable_shuffling (bool, optional): force disable shuffling
             (default: ``False``).
+        prefetch_device (torch.device, optional): CUDA device to copy each
+            batch to while the previous one is used, see
+            :class:`DevicePrefetchIterator` (default: None).
     """
 
     def __init__(
@@ -278,6 +281,7 @@ class EpochBatchIterator(EpochBatchIterating):
         buffer_size=0,
         timeout=0,
         disable_shuffling=False,
+        prefetch_device=None,
     ):
         assert isinstance(dataset, torch.utils.data.Dataset)
         self.dataset = dataset
@@ -295,6 +299,7 @@ class EpochBatchIterator(EpochBatchIterating):
         self.buffer_size = min(buffer_size, 20)
         self.timeout = timeout
         self.disable_shuffling = disable_shuffling
+        self.prefetch_device = prefetch_device
 
         self.epoch = max(epoch, 1)  # we use 1-based indexing for epochs
         self.shuffle = not disable_shuffling
@@ -477,6 +482,12 @@ class EpochBatchIterator(EpochBatchIterating):
         if self.buffer_size > 0:
             itr = BufferedIterator(self.buffer_size, itr)
 
+        # Copy the batches to the device ahead of their use, inside the
+        # CountingIterator so that a prefetched batch is not counted as
+        # consumed in the iterator state
+        if self.prefetch_device is not None:
+            itr = DevicePrefetchIterator(itr, self.prefetch_device)
+
         # Wrap with CountingIterator
         itr = CountingIterator(itr, start=offset)
         return itr
@@ -637,3 +648,88 @@ class BufferedIterator(object):
         if item is _sentinel:
             raise StopIteration()
         return item
+
+
+def _apply_to_tensors(fn, x):
+    if torch.is_tensor(x):
+        return fn(x)
+    elif isinstance(x, dict):
+        return {key: _apply_to_tensors(fn, value) for key, value in x.items()}
+    elif isinstance(x, list):
+        return [_apply_to_tensors(fn, value) for value in x]
+    elif isinstance(x, tuple):
+        return tuple(_apply_to_tensors(fn, value) for value in x)
+    return x
+
+
+class DevicePrefetchIterator(object):
+    """Iterates over the batches of *iterable* with their tensors already on
+    the CUDA *device*.
+
+    The batches come from pinned memory (the data loaders above pin them),
+    so when a batch is returned, the copy of the next one is issued without
+    blocking on a side stream, and it overlaps the computation on the
+    current batch. Prefetching keeps one more batch in device memory.
+    """
+
+    def __init__(self, iterable, device):
+        self._iterable = iterable
+        self._itr = None
+        self.device = device
+        self.stream = None
+        self.total = len(iterable)
+        self.count = 0
+        self._fetched = 0
+        self._next = None
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return self.total
+
+    def take(self, n):
+        self.total = min(self.total, self.count + n)
+        # Propagate this change to the underlying iterator
+        if hasattr(self._iterable, "take"):
+            self._iterable.take(max(self.total - self._fetched, 0))
+        return self
+
+    def _prefetch(self):
+        self._next = _sentinel
+        if self._fetched >= self.total:
+            return
+        try:
+            batch = next(self._itr)
+        except StopIteration:
+            return
+        self._fetched += 1
+        with torch.cuda.stream(self.stream):
+            self._next = _apply_to_tensors(
+                lambda t: t.to(device=self.device, non_blocking=True), batch
+            )
+
+    def __next__(self):
+        if self._itr is None:
+            self._itr = iter(self._iterable)
+            self.stream = torch.cuda.Stream(device=self.device)
+            self._prefetch()
+        batch = self._next
+        if batch is _sentinel:
+            raise StopIteration()
+
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+
+        def record(t):
+            # the memory of the copy must not be reused before the current
+            # stream is done with it
+            if t.is_cuda:
+                t.record_stream(current_stream)
+            return t
+
+        _apply_to_tensors(record, batch)
+        self.count += 1
+        self._prefetch()
+        return batch
+
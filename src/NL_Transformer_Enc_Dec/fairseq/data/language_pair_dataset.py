@@ -8,12 +8,78 @@ import logging
 import numpy as np
 import torch
 from fairseq.data import FairseqDataset, data_utils
+from fairseq.data.indexed_dataset import MMapIndexedDataset
 
 
 logger = logging.getLogger(__name__)
 
 
-def collate(
+def _pad_size(lengths, pad_to_length=None, pad_to_multiple=1):
+    size = int(lengths.max()) if lengths.numel() > 0 else 0
+    size = size if pad_to_length is None else max(size, pad_to_length)
+    if pad_to_multiple != 1 and size % pad_to_multiple != 0:
+        size = int(((size - 0.1) // pad_to_multiple + 1) * pad_to_multiple)
+    return size
+
+
+def _segment_ids(lengths):
+    """Index of the sequence of each token of sequences of *lengths*
+    concatenated."""
+    return torch.repeat_interleave(torch.arange(len(lengths)), lengths)
+
+
+def fill_padded(
+    tokens,
+    lengths,
+    order,
+    pad_idx,
+    size,
+    left_pad=False,
+    move_eos_to_beginning=False,
+    eos_idx=None,
+):
+    """Pad sequences into a 2d tensor with one scatter.
+
+    Row ``i`` of the ``(len(order), size)`` result holds the sequence
+    ``order[i]`` of the sequences of *lengths* concatenated in *tokens*,
+    the same as :func:`fairseq.data.data_utils.collate_tokens` gives for
+    the sequences in that order.
+    """
+    segments = _segment_ids(lengths)
+    starts = lengths.cumsum(0) - lengths
+    positions = torch.arange(tokens.numel()) - starts[segments]
+    if move_eos_to_beginning:
+        # shift right by one, with the last token moved to the beginning
+        last = positions == (lengths - 1)[segments]
+        positions = torch.where(last, torch.zeros_like(positions), positions + 1)
+        if eos_idx is not None:
+            tokens = tokens.masked_fill(last, eos_idx)
+    if left_pad:
+        positions = positions + (size - lengths)[segments]
+    rows = torch.empty_like(order)
+    rows[order] = torch.arange(len(order))
+    res = tokens.new_full((len(order), size), pad_idx)
+    res.view(-1)[rows[segments] * size + positions] = tokens
+    return res
+
+
+class GatheredSamples(object):
+    """The samples of a batch as concatenated tokens and lengths, which
+    :func:`LanguagePairDataset.__getitems__` reads from memory-mapped
+    datasets and :func:`collate_gathered` pads."""
+
+    def __init__(self, ids, src_tokens, src_lengths, tgt_tokens=None, tgt_lengths=None):
+        self.ids = ids
+        self.src_tokens = src_tokens
+        self.src_lengths = src_lengths
+        self.tgt_tokens = tgt_tokens
+        self.tgt_lengths = tgt_lengths
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _collate_flat(
     samples,
     pad_idx,
     eos_idx,
@@ -22,20 +88,129 @@ def collate(
     input_feeding=True,
     pad_to_length=None,
     pad_to_multiple=1,
+    prev_output_tokens=None,
 ):
-    if len(samples) == 0:
-        return {}
+    # the batch is sorted by the lengths first, so that every padded tensor
+    # is filled in order with one scatter
+    # lengths without padding, e.g. of bucketed samples
+    src_lengths = torch.zeros(len(samples), dtype=torch.long).index_add_(
+        0,
+        _segment_ids(samples.src_lengths),
+        samples.src_tokens.ne(pad_idx).long(),
+    )
+    src_lengths, sort_order = src_lengths.sort(descending=True)
+    id = samples.ids.index_select(0, sort_order)
+    src_tokens = fill_padded(
+        samples.src_tokens,
+        samples.src_lengths,
+        sort_order,
+        pad_idx,
+        _pad_size(
+            samples.src_lengths,
+            pad_to_length["source"] if pad_to_length is not None else None,
+            pad_to_multiple,
+        ),
+        left_pad=left_pad_source,
+    )
 
-    def merge(key, left_pad, move_eos_to_beginning=False, pad_to_length=None):
-        return data_utils.collate_tokens(
-            [s[key] for s in samples],
+    target = None
+    tgt_lengths = None
+    net_input = {"src_tokens": src_tokens, "src_lengths": src_lengths}
+    if samples.tgt_tokens is not None:
+        tgt_size = _pad_size(
+            samples.tgt_lengths,
+            pad_to_length["target"] if pad_to_length is not None else None,
+            pad_to_multiple,
+        )
+        target = fill_padded(
+            samples.tgt_tokens,
+            samples.tgt_lengths,
+            sort_order,
             pad_idx,
-            eos_idx,
-            left_pad,
-            move_eos_to_beginning,
-            pad_to_length=pad_to_length,
-            pad_to_multiple=pad_to_multiple,
+            tgt_size,
+            left_pad=left_pad_target,
         )
+        tgt_lengths = torch.zeros(len(samples), dtype=torch.long).index_add_(
+            0,
+            _segment_ids(samples.tgt_lengths),
+            samples.tgt_tokens.ne(pad_idx).long(),
+        ).index_select(0, sort_order)
+        ntokens = tgt_lengths.sum().item()
+
+        if prev_output_tokens is not None:
+            prev_tokens, prev_lengths = prev_output_tokens
+            net_input["prev_output_tokens"] = fill_padded(
+                prev_tokens,
+                prev_lengths,
+                sort_order,
+                pad_idx,
+                _pad_size(prev_lengths, None, pad_to_multiple),
+                left_pad=left_pad_target,
+            )
+        elif input_feeding:
+            # we create a shifted version of targets for feeding the
+            # previous output token(s) into the next decoder step, from the
+            # same gathered tokens
+            net_input["prev_output_tokens"] = fill_padded(
+                samples.tgt_tokens,
+                samples.tgt_lengths,
+                sort_order,
+                pad_idx,
+                tgt_size,
+                left_pad=left_pad_target,
+                move_eos_to_beginning=True,
+                eos_idx=eos_idx,
+            )
+    else:
+        ntokens = src_lengths.sum().item()
+
+    batch = {
+        "id": id,
+        "nsentences": len(samples),
+        "ntokens": ntokens,
+        "net_input": net_input,
+        "target": target,
+    }
+    return batch, sort_order, src_lengths, tgt_lengths
+
+
+def collate_gathered(
+    samples,
+    pad_idx,
+    eos_idx,
+    left_pad_source=True,
+    left_pad_target=False,
+    input_feeding=True,
+    pad_to_length=None,
+    pad_to_multiple=1,
+):
+    """Same batch as :func:`collate`, from :class:`GatheredSamples`."""
+    if len(samples) == 0:
+        return {}
+    return _collate_flat(
+        samples,
+        pad_idx,
+        eos_idx,
+        left_pad_source=left_pad_source,
+        left_pad_target=left_pad_target,
+        input_feeding=input_feeding,
+        pad_to_length=pad_to_length,
+        pad_to_multiple=pad_to_multiple,
+    )[0]
+
+
+def collate(
+    samples,
+    pad_idx,
+    eos_idx,
+    left_pad_source=True,
+    left_pad_target=False,
+    input_feeding=True,
+    pad_to_length=None,
+    pad_to_multiple=1,
+):
+    if len(samples) == 0:
+        return {}
 
     def check_alignment(alignment, src_len, tgt_len):
         if alignment is None or len(alignment) == 0:
@@ -64,63 +239,30 @@ def collate(
         align_weights = align_tgt_c[align_tgt_i[np.arange(len(align_tgt))]]
         return 1.0 / align_weights.float()
 
-    id = torch.LongTensor([s["id"] for s in samples])
-    src_tokens = merge(
-        "source",
-        left_pad=left_pad_source,
-        pad_to_length=pad_to_length["source"] if pad_to_length is not None else None,
-    )
-    # sort by descending source length
-    src_lengths = torch.LongTensor(
-        [s["source"].ne(pad_idx).long().sum() for s in samples]
+    def concat(key):
+        values = [s[key] for s in samples]
+        return torch.cat(values), torch.LongTensor([v.numel() for v in values])
+
+    has_target = samples[0].get("target", None) is not None
+    batch, sort_order, src_lengths, tgt_lengths = _collate_flat(
+        GatheredSamples(
+            torch.LongTensor([s["id"] for s in samples]),
+            *concat("source"),
+            *(concat("target") if has_target else (None, None)),
+        ),
+        pad_idx,
+        eos_idx,
+        left_pad_source=left_pad_source,
+        left_pad_target=left_pad_target,
+        input_feeding=input_feeding,
+        pad_to_length=pad_to_length,
+        pad_to_multiple=pad_to_multiple,
+        prev_output_tokens=(
+            concat("prev_output_tokens")
+            if has_target and samples[0].get("prev_output_tokens", None) is not None
+            else None
+        ),
     )
-    src_lengths, sort_order = src_lengths.sort(descending=True)
-    id = id.index_select(0, sort_order)
-    src_tokens = src_tokens.index_select(0, sort_order)
-
-    prev_output_tokens = None
-    target = None
-    if samples[0].get("target", None) is not None:
-        target = merge(
-            "target",
-            left_pad=left_pad_target,
-            pad_to_length=pad_to_length["target"]
-            if pad_to_length is not None
-            else None,
-        )
-        target = target.index_select(0, sort_order)
-        tgt_lengths = torch.LongTensor(
-            [s["target"].ne(pad_idx).long().sum() for s in samples]
-        ).index_select(0, sort_order)
-        ntokens = tgt_lengths.sum().item()
-
-        if samples[0].get("prev_output_tokens", None) is not None:
-            prev_output_tokens = merge("prev_output_tokens", left_pad=left_pad_target)
-        elif input_feeding:
-            # we create a shifted version of targets for feeding the
-            # previous output token(s) into the next decoder step
-            prev_output_tokens = merge(
-                "target",
-                left_pad=left_pad_target,
-                move_eos_to_beginning=True,
-                pad_to_length=pad_to_length["target"]
-                if pad_to_length is not None
-                else None,
-            )
-    else:
-        ntokens = src_lengths.sum().item()
-
-    batch = {
-        "id": id,
-        "nsentences": len(samples),
-        "ntokens": ntokens,
-        "net_input": {"src_tokens": src_tokens, "src_lengths": src_lengths,},
-        "target": target,
-    }
-    if prev_output_tokens is not None:
-        batch["net_input"]["prev_output_tokens"] = prev_output_tokens.index_select(
-            0, sort_order
-        )
 
     if samples[0].get("alignment", None) is not None:
         bsz, tgt_sz = batch["target"].shape
@@ -335,6 +477,32 @@ class LanguagePairDataset(FairseqDataset):
             example["constraints"] = self.constraints[index]
         return example
 
+    def __getitems__(self, indices):
+        """Samples *indices*, read from memory-mapped datasets with one
+        gather per side when the samples are not modified, as a
+        :class:`GatheredSamples` that :func:`collater` pads directly.
+        Used by :class:`torch.utils.data.DataLoader` to fetch a batch."""
+        if len(indices) == 0 or not self.can_gather():
+            return [self[i] for i in indices]
+        src_tokens, src_lengths = self.src.gather(indices)
+        tgt_tokens, tgt_lengths = (
+            self.tgt.gather(indices) if self.tgt is not None else (None, None)
+        )
+        return GatheredSamples(
+            torch.LongTensor(indices), src_tokens, src_lengths, tgt_tokens, tgt_lengths
+        )
+
+    def can_gather(self):
+        return (
+            isinstance(self.src, MMapIndexedDataset)
+            and (self.tgt is None or isinstance(self.tgt, MMapIndexedDataset))
+            and not self.append_eos_to_target
+            and not self.append_bos
+            and not self.remove_eos_from_source
+            and self.align_dataset is None
+            and self.constraints is None
+        )
+
     def __len__(self):
         return len(self.src)
 
@@ -374,7 +542,7 @@ class LanguagePairDataset(FairseqDataset):
                 - `tgt_lang_id` (LongTensor): a long Tensor which contains target language
                    IDs of each sample in the batch
         """
-        res = collate(
+        res = (collate_gathered if isinstance(samples, GatheredSamples) else collate)(
             samples,
             pad_idx=self.src_dict.pad(),
             eos_idx=self.eos,
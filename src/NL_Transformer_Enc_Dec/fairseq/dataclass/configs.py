@@ -13,6 +13,7 @@ from fairseq.dataclass.constants import (
     DATASET_IMPL_CHOICES,
     DDP_BACKEND_CHOICES,
     DDP_COMM_HOOK_CHOICES,
+    EMA_TYPE_CHOICES,
     GENERATION_CONSTRAINTS_CHOICES,
     GENERATION_DECODING_FORMAT_CHOICES,
     LOG_FORMAT_CHOICES,
@@ -418,6 +419,13 @@ class DatasetConfig(FairseqDataclass):
     data_buffer_size: int = field(
         default=10, metadata={"help": "Number of batches to preload"}
     )
+    prefetch_to_device: bool = field(
+        default=False,
+        metadata={
+            "help": "copy the next batch to the GPU on a separate stream "
+            "while the current one is used"
+        },
+    )
     train_subset: str = field(
         default="train",
         metadata={"help": "data subset to use for training (e.g. train, valid, test)"},
@@ -562,6 +570,13 @@ class CheckpointConfig(FairseqDataclass):
             "help": "Needed for layer_initialization"
         },
     )        
+    verify_layer_initialization: bool = field(
+        default=False,
+        metadata={
+            "help": "check that --layer-initialization loaded every tensor "
+            "from the right key of the checkpoint, and log the remapped keys"
+        },
+    )
     finetune_from_model: Optional[str] = field(
         default=None,
         metadata={
@@ -676,11 +691,49 @@ class CheckpointConfig(FairseqDataclass):
         metadata={
             "help": (
                 "Write checkpoints asynchronously in a separate "
-                "thread. NOTE: This feature is currently being tested."
+                "thread. Training only stalls to copy the state to CPU."
             ),
             "argparse_alias": "--save-async",
         },
     )
+    max_pending_checkpoint_writes: int = field(
+        default=2,
+        metadata={
+            "help": "with --write-checkpoints-asynchronously, number of "
+            "checkpoints that can be waiting to be written before saving "
+            "blocks, which bounds the CPU memory held by their copies"
+        },
+    )
+    store_ema: bool = field(
+        default=False,
+        metadata={
+            "help": "keep a moving average of the weights during training, "
+            'saved in the "ema" field of the checkpoints'
+        },
+    )
+    ema_type: EMA_TYPE_CHOICES = field(
+        default="exponential",
+        metadata={
+            "help": "exponential average, or uniform average of the weights "
+            "since --ema-start-update like scripts/average_checkpoints.py"
+        },
+    )
+    ema_decay: float = field(
+        default=0.9999, metadata={"help": "decay of the exponential average"}
+    )
+    ema_start_update: int = field(
+        default=0, metadata={"help": "start the average at this update"}
+    )
+    ema_update_freq: int = field(
+        default=1, metadata={"help": "add the weights to the average every N updates"}
+    )
+    ema_cpu: bool = field(
+        default=False,
+        metadata={"help": "keep the averaged weights on CPU to save accelerator memory"},
+    )
+    validate_with_ema: bool = field(
+        default=False, metadata={"help": "validate the averaged weights"}
+    )
     model_parallel_size: int = II("common.model_parallel_size")
 
 
@@ -887,6 +940,28 @@ class GenerationConfig(FairseqDataclass):
         default=False,
         metadata={"help": "if set, dont use seed for initializing random generators"},
     )
+    nl_paths: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "comma separated paths (0, 1, 2) of NL models to ensemble, "
+            "e.g. 0,1,2; the paths share one encoder and output projection "
+            "(default: 2)"
+        },
+    )
+    continuous_batching: bool = field(
+        default=False,
+        metadata={
+            "help": "decode the sentences that outlive their batch together with "
+            "those of other batches, and output the sentences in their original order"
+        },
+    )
+    continuous_batching_interval: int = field(
+        default=8,
+        metadata={
+            "help": "with --continuous-batching, steps between two chances to "
+            "merge a batch into others"
+        },
+    )
 
 
 @dataclass
@@ -956,6 +1031,21 @@ class InteractiveConfig(FairseqDataclass):
     input: str = field(
         default="-", metadata={"help": "file to read from; use - for stdin"},
     )
+    cache_entries: int = field(
+        default=0,
+        metadata={
+            "help": "cache the hypotheses of up to this many source sentences "
+            "and reuse them for repeated inputs, 0 disables the cache"
+        },
+    )
+    cache_bytes: int = field(
+        default=0,
+        metadata={"help": "maximum size of the cached hypotheses in bytes, 0 for no limit"},
+    )
+    cache_path: Optional[str] = field(
+        default=None,
+        metadata={"help": "also keep the cache in this SQLite file, reused across runs"},
+    )
 
 
 @dataclass
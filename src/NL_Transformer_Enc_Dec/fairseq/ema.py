@@ -0,0 +1,154 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Shadow copy of the model weights averaged during training, kept by
+:class:`fairseq.trainer.Trainer` with --store-ema.
+"""
+
+import contextlib
+
+import torch
+
+
+def _foreach_lerp_(shadow, sources, weight):
+    """shadow = (1 - weight) * shadow + weight * sources, for lists of
+    tensors on the same device."""
+    if hasattr(torch, "_foreach_mul_"):
+        torch._foreach_mul_(shadow, 1.0 - weight)
+        torch._foreach_add_(shadow, sources, alpha=weight)
+    else:
+        for s, t in zip(shadow, sources):
+            s.mul_(1.0 - weight).add_(t, alpha=weight)
+
+
+class ModelEMA(object):
+    """Moving average of the floating point parameters and buffers of a model.
+
+    The exponential average weights each update by ``1 - decay``; the
+    uniform average weights all the updates equally, which gives online the
+    average of the weights that ``scripts/average_checkpoints.py`` computes
+    offline from the checkpoints. The average starts from the current
+    weights and :func:`update` adds the weights of the model at the time of
+    the call, in place with multi-tensor ops.
+
+    Args:
+        model (torch.nn.Module): the model whose weights are averaged
+        decay (float, optional): decay of the exponential average
+            (default: 0.9999)
+        uniform (bool, optional): average all the updates equally
+            (default: False)
+        device (torch.device, optional): device of the shadow copy, e.g. CPU
+            to save accelerator memory (default: the device of the weights)
+    """
+
+    def __init__(self, model, decay=0.9999, uniform=False, device=None):
+        self.decay = decay
+        self.uniform = uniform
+        self.count = 1
+        self.names = []
+        self.tensors = []
+        seen = set()
+        for name, tensor in model.state_dict().items():
+            if not tensor.is_floating_point():
+                continue
+            # tied weights appear under several names but are averaged once
+            key = (tensor.data_ptr(), tensor.dtype, tensor.size())
+            if key in seen:
+                continue
+            seen.add(key)
+            self.names.append(name)
+            self.tensors.append(tensor)
+
+        self.shadow = [
+            t.detach().to(
+                device=device if device is not None else t.device,
+                dtype=torch.float32,
+                copy=True,
+            )
+            for t in self.tensors
+        ]
+        # fp16/bf16 weights and weights on another device than the shadow
+        # copy are first copied to fp32 buffers next to it
+        self.staging = None
+        self.sync_staging = False
+        if any(
+            s.device != t.device or s.dtype != t.dtype
+            for s, t in zip(self.shadow, self.tensors)
+        ):
+            self.sync_staging = any(
+                s.device.type == "cpu" and t.is_cuda
+                for s, t in zip(self.shadow, self.tensors)
+            )
+            self.staging = [
+                torch.empty(
+                    s.size(),
+                    dtype=s.dtype,
+                    device=s.device,
+                    pin_memory=s.device.type == "cpu" and t.is_cuda,
+                )
+                for s, t in zip(self.shadow, self.tensors)
+            ]
+
+    @torch.no_grad()
+    def update(self):
+        """Add the current weights of the model to the average."""
+        self.count += 1
+        weight = 1.0 / self.count if self.uniform else 1.0 - self.decay
+        sources = self.tensors
+        if self.staging is not None:
+            for buf, t in zip(self.staging, self.tensors):
+                buf.copy_(t, non_blocking=True)
+            if self.sync_staging:
+                torch.cuda.synchronize()
+            sources = self.staging
+        _foreach_lerp_(self.shadow, sources, weight)
+
+    @contextlib.contextmanager
+    def averaged_weights(self):
+        """Context manager in which the model holds the averaged weights.
+        Its own weights, kept next to the shadow copy meanwhile, are
+        restored on exit."""
+        with torch.no_grad():
+            backup = [
+                t.to(device=s.device, copy=True)
+                for s, t in zip(self.shadow, self.tensors)
+            ]
+            for s, t in zip(self.shadow, self.tensors):
+                t.copy_(s)
+        try:
+            yield
+        finally:
+            with torch.no_grad():
+                for b, t in zip(backup, self.tensors):
+                    t.copy_(b)
+
+    def state_dict(self, model):
+        """State dict of *model* with the averaged weights in fp32, which
+        can replace the "model" field of a checkpoint."""
+        averaged = {
+            (t.data_ptr(), t.dtype, t.size()): s
+            for s, t in zip(self.shadow, self.tensors)
+        }
+        state_dict = {}
+        for name, tensor in model.state_dict().items():
+            key = (tensor.data_ptr(), tensor.dtype, tensor.size())
+            if tensor.is_floating_point() and key in averaged:
+                state_dict[name] = averaged[key]
+            else:
+                state_dict[name] = tensor
+        return state_dict
+
+    @torch.no_grad()
+    def load_state_dict(self, state_dict, count):
+        """Restore the average from the output of :func:`state_dict`, made
+        of *count* updates."""
+        missing = [name for name in self.names if name not in state_dict]
+        if missing:
+            raise KeyError(
+                "the averaged weights miss {}".format(", ".join(missing))
+            )
+        for name, s in zip(self.names, self.shadow):
+            s.copy_(state_dict[name])
+        self.count = count
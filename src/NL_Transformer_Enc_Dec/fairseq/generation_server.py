@@ -0,0 +1,249 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Dynamic batching of concurrent generation requests, used by the resident
+translation server in :mod:`fairseq_cli.serve`.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest(object):
+    """A single source sentence waiting for its hypotheses."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.arrival = time.perf_counter()
+        self.finish = None
+        self.output = None
+        self.error = None
+        self._done = threading.Event()
+
+    def set_result(self, output=None, error=None):
+        self.output = output
+        self.error = error
+        self.finish = time.perf_counter()
+        self._done.set()
+
+    def result(self, timeout=None):
+        """Wait for the hypotheses and return them, or raise the generation error."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("generation request timed out")
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+
+class MicroBatcher(object):
+    """Merge concurrent generation requests into length-sorted batches.
+
+    A worker thread waits until the oldest pending request is *max_latency*
+    seconds old, or until enough requests are pending to fill a batch, then
+    takes every pending request, sorts them by length and cuts them into
+    batches of at most *max_tokens* padded source tokens and *max_sentences*
+    sentences. Each batch is passed to *generate_fn* and its outputs are
+    handed back to the requests.
+
+    Args:
+        generate_fn (callable): maps a list of 1-D source token tensors to a
+            list with one output per tensor
+        max_tokens (int, optional): maximum number of padded source tokens in
+            a batch (default: no limit)
+        max_sentences (int, optional): maximum number of sentences in a batch
+            (default: no limit)
+        max_latency (float, optional): longest time in seconds that a request
+            waits for others to join its batch (default: 0.01)
+        latency_window (int, optional): number of recent requests the latency
+            percentiles are computed over (default: 10000)
+    """
+
+    def __init__(
+        self,
+        generate_fn,
+        max_tokens=None,
+        max_sentences=None,
+        max_latency=0.01,
+        latency_window=10000,
+    ):
+        self.generate_fn = generate_fn
+        self.max_tokens = max_tokens
+        self.max_sentences = max_sentences
+        self.max_latency = max_latency
+        self.pending = []
+        self.pending_tokens = 0
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_batches = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, tokens):
+        """Queue the source *tokens* and return their :class:`GenerationRequest`."""
+        request = GenerationRequest(tokens)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("the batcher is closed")
+            self.pending.append(request)
+            self.pending_tokens += tokens.numel()
+            self.cond.notify()
+        return request
+
+    def generate(self, tokens_list, timeout=None):
+        """Generate for every tensor of *tokens_list*, blocking until all are done."""
+        requests = [self.submit(tokens) for tokens in tokens_list]
+        return [request.result(timeout) for request in requests]
+
+    def close(self):
+        """Stop the worker once the pending requests are done."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+    def _full(self):
+        return (
+            self.max_sentences is not None and len(self.pending) >= self.max_sentences
+        ) or (self.max_tokens is not None and self.pending_tokens >= self.max_tokens)
+
+    def _take_pending(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return None
+            deadline = self.pending[0].arrival + self.max_latency
+            while not self._full() and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            requests, self.pending, self.pending_tokens = self.pending, [], 0
+            self.in_flight = len(requests)
+            return requests
+
+    def make_batches(self, requests):
+        """Sort *requests* by length and cut them into batches within the budget."""
+        batches, batch = [], []
+        for request in sorted(requests, key=lambda r: r.tokens.numel()):
+            size = len(batch) + 1
+            # the batch is padded to its longest (i.e. latest) sentence
+            if batch and (
+                (self.max_sentences is not None and size > self.max_sentences)
+                or (
+                    self.max_tokens is not None
+                    and size * request.tokens.numel() > self.max_tokens
+                )
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(request)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _run(self):
+        while True:
+            requests = self._take_pending()
+            if requests is None:
+                return
+            for batch in self.make_batches(requests):
+                try:
+                    outputs = self.generate_fn([r.tokens for r in batch])
+                    assert len(outputs) == len(batch)
+                    for request, output in zip(batch, outputs):
+                        request.set_result(output=output)
+                except Exception as e:
+                    logger.exception("generation failed for a batch of {}".format(len(batch)))
+                    for request in batch:
+                        request.set_result(error=e)
+                with self.cond:
+                    self.in_flight -= len(batch)
+                    self.num_requests += len(batch)
+                    self.num_batches += 1
+                    self.latencies.extend(r.finish - r.arrival for r in batch)
+
+    def metrics(self):
+        """Queue depth, request counts and latency percentiles in milliseconds."""
+        with self.cond:
+            latencies = np.array(self.latencies)
+            stats = {
+                "queue_depth": len(self.pending),
+                "in_flight": self.in_flight,
+                "requests": self.num_requests,
+                "batches": self.num_batches,
+                "mean_batch_size": self.num_requests / max(self.num_batches, 1),
+            }
+        for name, q in [("p50_ms", 50), ("p99_ms", 99)]:
+            stats[name] = (
+                float(np.percentile(latencies, q) * 1000) if len(latencies) > 0 else None
+            )
+        return stats
+
+
+def make_http_server(batcher, encode_fn, decode_fn, host="localhost", port=8080):
+    """Build an HTTP server exposing *batcher*.
+
+    ``POST /translate`` takes ``{"source": [line, ...]}`` and returns
+    ``{"translations": [...]}``, where every line is turned into source
+    tokens by *encode_fn* and its output into JSON by ``decode_fn(line,
+    output)``. ``GET /metrics`` returns :func:`MicroBatcher.metrics`. Each
+    connection is handled in its own thread, so the lines of concurrent
+    clients are batched together.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._reply(200, batcher.metrics())
+            else:
+                self._reply(404, {"error": "unknown path " + self.path})
+
+        def do_POST(self):
+            if self.path != "/translate":
+                self._reply(404, {"error": "unknown path " + self.path})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                lines = json.loads(self.rfile.read(length).decode("utf-8"))["source"]
+                if isinstance(lines, str):
+                    lines = [lines]
+                requests = [batcher.submit(encode_fn(line)) for line in lines]
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            try:
+                translations = [
+                    decode_fn(line, request.result()) for line, request in zip(lines, requests)
+                ]
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"translations": translations})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
@@ -114,10 +114,34 @@ class GeneratorHubInterface(nn.Module):
         # this is useful for determining the device
         self.register_buffer("_float_tensor", torch.tensor([0], dtype=torch.float))
 
+        self.cache = None
+
     @property
     def device(self):
         return self._float_tensor.device
 
+    def enable_cache(self, max_entries=10000, max_bytes=0, path=None, model_id=None):
+        """Return cached hypotheses for sentences already translated with the
+        same generation settings, see :class:`fairseq.translation_cache.TranslationCache`.
+
+        *model_id* defaults to a hash of the weights; pass a name instead to
+        skip hashing large models. Call :func:`cache_stats` for the hit and
+        miss counts.
+        """
+        from fairseq.translation_cache import TranslationCache, fingerprint_models
+
+        if self.cache is not None:
+            self.cache.close()
+        if model_id is None:
+            model_id = fingerprint_models(self.models)
+        self.cache = TranslationCache(
+            model_id, max_entries=max_entries, max_bytes=max_bytes, path=path
+        )
+        return self.cache
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
     def translate(
         self, sentences: List[str], beam: int = 5, verbose: bool = False, **kwargs
     ) -> List[str]:
@@ -168,13 +192,36 @@ class GeneratorHubInterface(nn.Module):
 
         inference_step_args = inference_step_args or {}
         results = []
-        for batch in self._build_batches(tokenized_sentences, skip_invalid_size_inputs):
+        # sampling is not deterministic, and prefixes or constraints are not
+        # part of the key
+        use_cache = (
+            self.cache is not None
+            and not getattr(gen_args, "score_reference", False)
+            and not getattr(gen_args, "sampling", False)
+            and not inference_step_args
+        )
+        to_generate = list(range(len(tokenized_sentences)))
+        if use_cache:
+            from fairseq.translation_cache import fingerprint_config
+
+            config_hash = fingerprint_config(gen_args)
+            to_generate = []
+            for i, tokens in enumerate(tokenized_sentences):
+                hypos = self.cache.get(tokens, config_hash)
+                if hypos is None:
+                    to_generate.append(i)
+                else:
+                    results.append((i, hypos))
+        sentences_to_generate = [tokenized_sentences[i] for i in to_generate]
+        for batch in self._build_batches(sentences_to_generate, skip_invalid_size_inputs):
             batch = utils.apply_to_sample(lambda t: t.to(self.device), batch)
             translations = self.task.inference_step(
                 generator, self.models, batch, **inference_step_args
             )
             for id, hypos in zip(batch["id"].tolist(), translations):
-                results.append((id, hypos))
+                if use_cache:
+                    self.cache.put(sentences_to_generate[id], config_hash, hypos)
+                results.append((to_generate[id], hypos))
 
         # sort output to match input order
         outputs = [hypos for _, hypos in sorted(results, key=lambda x: x[0])]
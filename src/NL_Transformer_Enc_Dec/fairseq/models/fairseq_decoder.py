@@ -292,10 +292,13 @@ class FairseqDecoder_NL(nn.Module):
 #         else:
 #             return utils.softmax(logits_1, dim=-1, onnx_trace=self.onnx_trace), utils.softmax(logits_2, dim=-1, onnx_trace=self.onnx_trace), utils.softmax(logits_3, dim=-1, onnx_trace=self.onnx_trace)
         
-        if log_probs:
-            return utils.log_softmax(logits_1, dim=-1, onnx_trace=self.onnx_trace), utils.log_softmax(logits_2, dim=-1, onnx_trace=self.onnx_trace), utils.log_softmax(logits_3, dim=-1, onnx_trace=self.onnx_trace)
-        else:
-            return utils.softmax(logits_1, dim=-1, onnx_trace=self.onnx_trace), utils.softmax(logits_2, dim=-1, onnx_trace=self.onnx_trace), utils.softmax(logits_3, dim=-1, onnx_trace=self.onnx_trace)
+        # paths that were not projected (see the ``path`` argument of the
+        # decoder) stay None
+        normalize = utils.log_softmax if log_probs else utils.softmax
+        return tuple(
+            normalize(logits, dim=-1, onnx_trace=self.onnx_trace) if logits is not None else None
+            for logits in (logits_1, logits_2, logits_3)
+        )
 
     def max_positions(self):
         """Maximum input length supported by the decoder."""
@@ -176,26 +176,32 @@ class FairseqEncoder_NL(nn.Module):
         """
         raise NotImplementedError
 
-    def forward_torchscript(self, net_input: Dict[str, Tensor]):
+    def forward_torchscript(
+        self, net_input: Dict[str, Tensor], paths: Optional[List[int]] = None
+    ):
         """A TorchScript-compatible version of forward.
 
         Encoders which use additional arguments may want to override
-        this method for TorchScript compatibility.
+        this method for TorchScript compatibility. *paths* selects the
+        paths to run (default: all paths).
         """
         if torch.jit.is_scripting():
             return self.forward(
                 src_tokens=net_input["src_tokens"],
                 src_lengths=net_input["src_lengths"],
+                paths=paths,
             )
         else:
-            return self.forward_non_torchscript(net_input)
+            return self.forward_non_torchscript(net_input, paths)
 
     @torch.jit.unused
-    def forward_non_torchscript(self, net_input: Dict[str, Tensor]):
+    def forward_non_torchscript(
+        self, net_input: Dict[str, Tensor], paths: Optional[List[int]] = None
+    ):
         encoder_input = {
             k: v for k, v in net_input.items() if k != "prev_output_tokens"
         }
-        return self.forward(**encoder_input)
+        return self.forward(**encoder_input, paths=paths)
 
     def reorder_encoder_out(self, encoder_out, new_order):
         """
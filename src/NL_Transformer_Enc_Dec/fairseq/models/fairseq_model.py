@@ -8,6 +8,7 @@ Base classes for various fairseq models.
 
 import logging
 from argparse import Namespace
+from collections import OrderedDict
 from typing import Dict, List, Optional, Tuple
 
 import torch
@@ -198,13 +199,15 @@ class BaseFairseqModel(nn.Module):
         strict=True,
         model_cfg: Optional[DictConfig] = None,
         args: Optional[Namespace] = None,
-        layer_init=None
+        layer_init=None,
+        verify=False,
     ):
         """Copies parameters and buffers from *state_dict* into this module and
-        its descendants.
+        its descendants, with the layers remapped by *layer_init* (see
+        :func:`fairseq.checkpoint_utils.layer_init_key_map`).
 
-        Overrides the method in :class:`nn.Module`. Compared with that method
-        this additionally "upgrades" *state_dicts* from old checkpoints.
+        With *verify*, checks that every loaded tensor equals the one of
+        *state_dict* it was read from and logs the remapped keys.
         """
         
         if model_cfg is None and args is not None:
@@ -213,50 +216,27 @@ class BaseFairseqModel(nn.Module):
 
         self.upgrade_state_dict(state_dict)
 
-        from fairseq.checkpoint_utils import prune_state_dict
+        from fairseq.checkpoint_utils import layer_init_key_map, prune_state_dict
 
         new_state_dict = prune_state_dict(state_dict, model_cfg)
-        
-        new_state_dict_ = new_state_dict.copy()
-        check_list = dict()
-        
-        for key in new_state_dict.keys():
-            check_list.update({key: torch.mean(torch.abs(new_state_dict[key]))})
-        # layer_init: dict 
-        
-        for i in range(len(layer_init)):
-            for key in new_state_dict.keys():
-                new_key = None
-                if 'encoder.layers.'+str(int(int(layer_init[i])-1))+'.' in key:
-                    new_key = key.replace('encoder.layers.'+str(int(int(layer_init[i])-1))+'.', 'encoder.layers.'+str(i)+'.')
-                    new_state_dict_.update({new_key: new_state_dict[key]})
-
-        for i in range(len(layer_init)):
-            for key in new_state_dict.keys():
-                new_key = None                    
-                if 'decoder.layers.'+str(int(int(layer_init[i])-1))+'.' in key:
-                    new_key = key.replace('decoder.layers.'+str(int(int(layer_init[i])-1))+'.', 'decoder.layers.'+str(i)+'.')
-                    new_state_dict_.update({new_key: new_state_dict[key]})
-                    
-        for i in range(len(layer_init), 50):
-            for key in new_state_dict.keys():
-                if 'encoder.layers.'+str(i)+'.' in key:
-                    del new_state_dict_[key]
-                if 'decoder.layers.'+str(i)+'.' in key:
-                    del new_state_dict_[key]
-           
-        logger.info("*"*77)
-        logger.info("After Changing the model_state_dict's keys")
-
-        for key in new_state_dict_.keys():
-            x = torch.mean(torch.abs(new_state_dict_[key]))
-            for keykey in check_list.keys():
-                if check_list[keykey] == x:
-                    print(key+" matches with original's")
-                    print(keykey)
-                            
-        return super().load_state_dict(new_state_dict_, strict)  
-    
+        key_map = layer_init_key_map(new_state_dict.keys(), layer_init)
+        remapped = OrderedDict(
+            (key, new_state_dict[source]) for key, source in key_map.items()
+        )
+        result = super().load_state_dict(remapped, strict)
+
+        if verify:
+            own_state_dict = self.state_dict()
+            for key, source in key_map.items():
+                if key not in own_state_dict:
+                    continue
+                loaded = own_state_dict[key].detach().cpu()
+                if not torch.equal(loaded, new_state_dict[source].to(loaded.dtype)):
+                    logger.warning(f"{key} differs from {source} of the checkpoint")
+                elif key != source:
+                    logger.info(f"{key} initialized from {source}")
+        return result
+
     def upgrade_state_dict(self, state_dict):
         """Upgrade old state dicts to work with newer code."""
         self.upgrade_state_dict_named(state_dict, "")
@@ -811,6 +811,14 @@ class TransformerModel_NL(FairseqEncoderDecoderModel_NL):
                 '--offload-activations are passed.'
             )
         )
+        # args for the layer order of the three NL paths
+        parser.add_argument('--encoder-nl-schedule', type=str, metavar='STR', default=None,
+                            help='layer indices applied by each encoder path, comma separated '
+                                 'within a path and ";" between paths, e.g. "0,1,2,3;1,1,3,3;1,4,3,5" '
+                                 '(default: derived from --encoder-layers)')
+        parser.add_argument('--decoder-nl-schedule', type=str, metavar='STR', default=None,
+                            help='layer indices applied by each decoder path, same format as '
+                                 '--encoder-nl-schedule (default: derived from --decoder-layers)')
         # fmt: on
 
     @classmethod
@@ -906,15 +914,24 @@ class TransformerModel_NL(FairseqEncoderDecoderModel_NL):
         features_only: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        path: Optional[int] = None,
+        paths: Optional[List[int]] = None,
     ):
         """
         Run the forward pass for an encoder-decoder model.
 
         Copied from the base class, but without ``**kwargs``,
         which are not supported by TorchScript.
+
+        *paths* runs only these paths of the encoder and the decoder, e.g.
+        the ones sampled for a training step; the outputs of the others are
+        None. *path* only skips the output projection of the other paths.
         """
         encoder_out = self.encoder(
-            src_tokens, src_lengths=src_lengths, return_all_hiddens=return_all_hiddens
+            src_tokens,
+            src_lengths=src_lengths,
+            return_all_hiddens=return_all_hiddens,
+            paths=paths,
         )
         decoder_out = self.decoder(
             prev_output_tokens,
@@ -924,6 +941,8 @@ class TransformerModel_NL(FairseqEncoderDecoderModel_NL):
             alignment_heads=alignment_heads,
             src_lengths=src_lengths,
             return_all_hiddens=return_all_hiddens,
+            path=path,
+            paths=paths,
         )
         return decoder_out
 
@@ -1638,6 +1657,76 @@ class TransformerEncoder_DL(FairseqEncoder_DL):
             state_dict[version_key] = torch.Tensor([1])
         return state_dict
 
+def NL_layer_schedule(num_layers):
+    """
+    Default layer order of the three NL paths over a stack of *num_layers*
+    layers: the first two thirds of the stack are shared and the last third is
+    only used by the third path. For 12 layers this is 0..7 for the first path,
+    1,1,3,3,5,5,7,7 for the second and 1,8,3,9,5,10,7,11 for the third.
+    """
+    if num_layers % 3 != 0:
+        raise ValueError(
+            "NL models need a multiple of 3 layers, got {}; "
+            "pass an explicit --encoder/decoder-nl-schedule instead".format(num_layers)
+        )
+    shared = 2 * num_layers // 3
+    odd = list(range(1, shared, 2))
+    return [
+        list(range(shared)),
+        [i for i in odd for _ in range(2)],
+        [j for k, i in enumerate(odd) for j in (i, shared + k)],
+    ]
+
+
+def parse_NL_schedule(schedule: Optional[str], num_layers: int) -> List[List[int]]:
+    if schedule is None:
+        return NL_layer_schedule(num_layers)
+    paths = [[int(i) for i in path.split(",")] for path in schedule.split(";")]
+    if len(paths) != 3:
+        raise ValueError("expected 3 NL paths separated by ';', got {}".format(schedule))
+    for path in paths:
+        if len(path) == 0 or min(path) < 0 or max(path) >= num_layers:
+            raise ValueError(
+                "NL schedule {} does not fit a stack of {} layers".format(schedule, num_layers)
+            )
+    return paths
+
+
+def run_NL_schedule(schedules, contexts, x, apply_layer):
+    """
+    Run every path of an NL stack, computing each shared prefix only once.
+
+    Args:
+        schedules (List[List[int]]): layer indices applied by each path
+        contexts (list): per-path key of everything besides the hidden state
+            that the layers see (e.g. the encoder output attended to); paths
+            only share a prefix when their contexts are equal
+        x (Tensor): input of every path
+        apply_layer (callable): ``apply_layer(path, idx, layer, h)`` runs
+            layer *layer* as the *idx*-th step of *path* on *h* and returns
+            a tuple whose first element is the new hidden state
+
+    Returns:
+        List[List[tuple]]: the outputs of ``apply_layer`` for every step of
+        every path
+    """
+    computed = {}
+    outputs = []
+    for path, (schedule, context) in enumerate(zip(schedules, contexts)):
+        h = x
+        prefix = (context,)
+        path_outputs = []
+        for idx, layer in enumerate(schedule):
+            prefix = prefix + (layer,)
+            if prefix not in computed:
+                computed[prefix] = apply_layer(path, idx, layer, h)
+            out = computed[prefix]
+            path_outputs.append(out)
+            h = out[0]
+        outputs.append(path_outputs)
+    return outputs
+
+
 class TransformerEncoder_NL(FairseqEncoder_NL):
     """
     Transformer encoder consisting of *args.encoder_layers* layers. Each layer
@@ -1700,6 +1789,9 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
             [self.build_encoder_layer(args) for i in range(args.encoder_layers)]
         )
         self.num_layers = len(self.layers)
+        self.schedule = parse_NL_schedule(
+            getattr(args, "encoder_nl_schedule", None), self.num_layers
+        )
 
         if args.encoder_normalize_before:
             self.layer_norm = LayerNorm(embed_dim)
@@ -1743,6 +1835,7 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         src_lengths: Optional[torch.Tensor] = None,
         return_all_hiddens: bool = False,
         token_embeddings: Optional[torch.Tensor] = None,
+        paths: Optional[List[int]] = None,
     ):
         """
         Args:
@@ -1754,6 +1847,8 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
                 intermediate hidden states (default: False).
             token_embeddings (torch.Tensor, optional): precomputed embeddings
                 default `None` will recompute embeddings
+            paths (List[int], optional): only run these paths; the outputs
+                of the others are empty lists (default: all paths).
 
         Returns:
             dict:
@@ -1770,7 +1865,8 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         return self.forward_scriptable(src_tokens,
                                        src_lengths,
                                        return_all_hiddens,
-                                       token_embeddings)
+                                       token_embeddings,
+                                       paths)
 
     # TorchScript doesn't support super() method so that the scriptable Subclass
     # can't access the base class model in Torchscript.
@@ -1782,6 +1878,7 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         src_lengths: Optional[torch.Tensor] = None,
         return_all_hiddens: bool = False,
         token_embeddings: Optional[torch.Tensor] = None,
+        paths: Optional[List[int]] = None,
     ):
         """
         Args:
@@ -1793,6 +1890,8 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
                 intermediate hidden states (default: False).
             token_embeddings (torch.Tensor, optional): precomputed embeddings
                 default `None` will recompute embeddings
+            paths (List[int], optional): only run these paths; the outputs
+                of the others are empty lists (default: all paths).
 
         Returns:
             dict:
@@ -1820,128 +1919,29 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         x = x.transpose(0, 1)
 
         encoder_states = []
-        encoder_states_2 = []
-        encoder_states_3 = []
-        
+
         if return_all_hiddens:
             encoder_states.append(x)
-            encoder_states_2.append(x)
-            encoder_states_3.append(x)
 
-        # encoder layers
-        y = self.layers[0](x, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)
-        y = self.layers[1](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)        
-        y = self.layers[2](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)        
-        y = self.layers[3](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)        
-        y = self.layers[4](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)        
-        y = self.layers[5](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y) 
-        y = self.layers[6](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y) 
-        y = self.layers[7](y, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states is not None
-            encoder_states.append(y)             
-            
-        z = self.layers[1](x, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)
-        z = self.layers[1](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)        
-        z = self.layers[3](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)        
-        z = self.layers[3](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)        
-        z = self.layers[5](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)        
-        z = self.layers[5](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)
-        z = self.layers[7](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)        
-        z = self.layers[7](z, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_2 is not None
-            encoder_states_2.append(z)            
-            
-        w = self.layers[1](x, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)
-        w = self.layers[8](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)        
-        w = self.layers[3](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)        
-        w = self.layers[9](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)        
-        w = self.layers[5](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)        
-        w = self.layers[10](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)             
-        w = self.layers[7](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)             
-        w = self.layers[11](w, encoder_padding_mask=encoder_padding_mask if has_pads else None)
-        if return_all_hiddens:
-            assert encoder_states_3 is not None
-            encoder_states_3.append(w)             
-            
-            
-#         for layer in self.layers:
-#             x = layer(
-#                 x, encoder_padding_mask=encoder_padding_mask if has_pads else None
-#             )
-#             if return_all_hiddens:
-#                 assert encoder_states is not None
-#                 encoder_states.append(x)
+        def apply_layer(path: int, idx: int, layer: int, h):
+            return (self.layers[layer](h, encoder_padding_mask=encoder_padding_mask if has_pads else None),)
 
-        if self.layer_norm is not None:
-            #x = self.layer_norm(x)
-            y = self.layer_norm(y)
-            z = self.layer_norm(z)
-            w = self.layer_norm(w)
+        if paths is None:
+            paths = [0, 1, 2]
+
+        # encoder paths only differ in their layers, so common prefixes
+        # (e.g. layers[1] on the embeddings) are computed once
+        outputs = run_NL_schedule(
+            [self.schedule[path] for path in paths], [0] * len(paths), x, apply_layer
+        )
+        path_out: List[List[Tensor]] = [[], [], []]
+        for path, path_outputs in zip(paths, outputs):
+            h = path_outputs[-1][0]
+            if self.layer_norm is not None:
+                h = self.layer_norm(h)
+            path_out[path] = [h]
+            if return_all_hiddens and path == 0:
+                encoder_states.extend(out[0] for out in path_outputs)
 
         # The Pytorch Mobile lite interpreter does not supports returning NamedTuple in
         # `forward` so we use a dictionary instead.
@@ -1949,9 +1949,9 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         # The empty list is equivalent to None.
         
         return {
-            "encoder_out": [y],  # T x B x C
-            "encoder_out_2": [z],  # T x B x C
-            "encoder_out_3": [w],  # T x B x C
+            "encoder_out": path_out[0],  # T x B x C
+            "encoder_out_2": path_out[1],  # T x B x C
+            "encoder_out_3": path_out[2],  # T x B x C
             "encoder_padding_mask": [encoder_padding_mask],  # B x T
             "encoder_embedding": [encoder_embedding],  # B x T x C
             "encoder_states": encoder_states,  # List[T x B x C]
@@ -1971,10 +1971,13 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
         Returns:
             *encoder_out* rearranged according to *new_order*
         """
-        if len(encoder_out["encoder_out"]) == 0:
-            new_encoder_out = []
-        else:
-            new_encoder_out = [encoder_out["encoder_out"][0].index_select(1, new_order)]
+        # the paths that were not run have empty outputs
+        new_encoder_outs: List[List[Tensor]] = []
+        for key in ["encoder_out", "encoder_out_2", "encoder_out_3"]:
+            if len(encoder_out[key]) == 0:
+                new_encoder_outs.append([])
+            else:
+                new_encoder_outs.append([encoder_out[key][0].index_select(1, new_order)])
         if len(encoder_out["encoder_padding_mask"]) == 0:
             new_encoder_padding_mask = []
         else:
@@ -2004,7 +2007,9 @@ class TransformerEncoder_NL(FairseqEncoder_NL):
                 encoder_states[idx] = state.index_select(1, new_order)
 
         return {
-            "encoder_out": new_encoder_out,  # T x B x C
+            "encoder_out": new_encoder_outs[0],  # T x B x C
+            "encoder_out_2": new_encoder_outs[1],  # T x B x C
+            "encoder_out_3": new_encoder_outs[2],  # T x B x C
             "encoder_padding_mask": new_encoder_padding_mask,  # B x T
             "encoder_embedding": new_encoder_embedding,  # B x T x C
             "encoder_states": encoder_states,  # List[T x B x C]
@@ -3251,6 +3256,9 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
             ]
         )
         self.num_layers = len(self.layers)
+        self.schedule = parse_NL_schedule(
+            getattr(args, "decoder_nl_schedule", None), self.num_layers
+        )
 
         if args.decoder_normalize_before and not getattr(
             args, "no_decoder_final_norm", False
@@ -3326,6 +3334,8 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         alignment_heads: Optional[int] = None,
         src_lengths: Optional[Any] = None,
         return_all_hiddens: bool = False,
+        path: Optional[int] = None,
+        paths: Optional[List[int]] = None,
     ):
         """
         Args:
@@ -3339,12 +3349,20 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
                 applying output layer (default: False).
             full_context_alignment (bool, optional): don't apply
                 auto-regressive mask to self-attention (default: False).
+            path (int, optional): only project the features of this path
+                (0, 1 or 2) to the vocabulary; the other two outputs are
+                returned as None (default: project all three).
+            paths (List[int], optional): only run these paths; the outputs
+                of the others are returned as None (default: all paths).
 
         Returns:
             tuple:
-                - the decoder's output of shape `(batch, tgt_len, vocab)`
+                - the decoder's output of the three paths, each of shape
+                  `(batch, tgt_len, vocab)`
                 - a dictionary with any model-specific outputs
         """
+        if path is not None:
+            paths = [path]
 
         x,y,z, extra = self.extract_features(
             prev_output_tokens,
@@ -3353,13 +3371,25 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
             full_context_alignment=full_context_alignment,
             alignment_layer=alignment_layer,
             alignment_heads=alignment_heads,
+            paths=paths,
         )
 
         if not features_only:
-            x = self.output_layer(x)
-            y = self.output_layer(y)
-            z = self.output_layer(z)
-        return x, y,z, extra
+            if paths is None:
+                x, y, z = self.output_layer_NL([x, y, z])
+            else:
+                features = [x, y, z]
+                selected: List[Tensor] = []
+                for p in paths:
+                    f = features[p]
+                    assert f is not None
+                    selected.append(f)
+                projected = self.output_layer_NL(selected)
+                outputs: List[Optional[Tensor]] = [None, None, None]
+                for i in range(len(paths)):
+                    outputs[paths[i]] = projected[i]
+                x, y, z = outputs
+        return x, y, z, extra
     
     def extract_features(
         self,
@@ -3369,6 +3399,7 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         full_context_alignment: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        paths: Optional[List[int]] = None,
     ):
         return self.extract_features_scriptable(
             prev_output_tokens,
@@ -3377,6 +3408,7 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
             full_context_alignment,
             alignment_layer,
             alignment_heads,
+            paths,
         )
 
     """
@@ -3393,6 +3425,7 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         full_context_alignment: bool = False,
         alignment_layer: Optional[int] = None,
         alignment_heads: Optional[int] = None,
+        paths: Optional[List[int]] = None,
     ):
         """
         Similar to *forward* but only return features.
@@ -3407,6 +3440,8 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
                 heads at this layer (default: last layer).
             alignment_heads (int, optional): only average alignment over
                 this many heads (default: all heads).
+            paths (List[int], optional): only run these paths; the features
+                of the others are returned as None (default: all paths).
 
         Returns:
             tuple:
@@ -3415,18 +3450,24 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         """
         bs, slen = prev_output_tokens.size()
         if alignment_layer is None:
-            #alignment_layer = self.num_layers - 1
-            alignment_layer = 8 -1
+            alignment_layer = len(self.schedule[0]) - 1
+        if paths is None:
+            paths = [0, 1, 2]
 
         enc: Optional[Tensor] = None
+        enc_2: Optional[Tensor] = None
+        enc_3: Optional[Tensor] = None
         padding_mask: Optional[Tensor] = None
+        # the encoder may only have run some of the paths
         if encoder_out is not None and len(encoder_out["encoder_out"]) > 0:
             enc = encoder_out["encoder_out"][0]
-            enc_2 = encoder_out["encoder_out_2"][0]
-            enc_3 = encoder_out["encoder_out_3"][0]
             assert (
                 enc.size()[1] == bs
             ), f"Expected enc.shape == (t, {bs}, c) got {enc.shape}"
+        if encoder_out is not None and len(encoder_out["encoder_out_2"]) > 0:
+            enc_2 = encoder_out["encoder_out_2"][0]
+        if encoder_out is not None and len(encoder_out["encoder_out_3"]) > 0:
+            enc_3 = encoder_out["encoder_out_3"][0]
         if encoder_out is not None and len(encoder_out["encoder_padding_mask"]) > 0:
             padding_mask = encoder_out["encoder_padding_mask"][0]
 
@@ -3462,340 +3503,110 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         # B x T x C -> T x B x C
         x = x.transpose(0, 1)
         
-        self_attn_padding_mask_1: Optional[Tensor] = None
-        self_attn_padding_mask_2: Optional[Tensor] = None
-        self_attn_padding_mask_3: Optional[Tensor] = None    
+        self_attn_padding_mask: Optional[Tensor] = None
         if self.cross_self_attention or prev_output_tokens.eq(self.padding_idx).any():
-            self_attn_padding_mask_1 = prev_output_tokens.eq(self.padding_idx)
-            self_attn_padding_mask_2 = prev_output_tokens.eq(self.padding_idx)
-            self_attn_padding_mask_3 = prev_output_tokens.eq(self.padding_idx)
-                    
-        # decoder layers
-        attn: Optional[Tensor] = None
-        attn_2: Optional[Tensor] = None
-        attn_3: Optional[Tensor] = None    
-        inner_states: List[Optional[Tensor]] = [x]
-        inner_states_2: List[Optional[Tensor]] = [x]
-        inner_states_3: List[Optional[Tensor]] = [x]
-                
-        # Model 1의 decoder output     
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(x)
-            self_attn_mask_2 = self.buffered_future_mask(x)
-            self_attn_mask_3 = self.buffered_future_mask(x)
-        else:
-            self_attn_mask_1 = None
-            self_attn_mask_2 = None
-            self_attn_mask_3 = None
-        
-        idx = 0
-        y, layer_attn, _ = self.layers[0](x, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(y)
-        else:
-            self_attn_mask_1 = None
-        
-        idx = 1
-        y, layer_attn, _ = self.layers[1](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(y)
-        else:
-            self_attn_mask_1 = None
-        
-        idx =2 
-        y, layer_attn, _ = self.layers[2](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(y)
-        else:
-            self_attn_mask_1 = None
-        
-        idx = 3
-        y, layer_attn, _ = self.layers[3](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(y)
-        else:
-            self_attn_mask_1 = None
-        
-        idx = 4
-        y, layer_attn, _ = self.layers[4](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_1 = self.buffered_future_mask(y)
-        else:
-            self_attn_mask_1 = None
-        
-        idx = 5
-        y, layer_attn, _ = self.layers[5](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y) 
-            
-        idx = 6
-        y, layer_attn, _ = self.layers[6](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)  
-
-        idx = 7
-        y, layer_attn, _ = self.layers[7](y, enc, padding_mask, self_attn_mask = self_attn_mask_1, self_attn_padding_mask = self_attn_padding_mask_1,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states.append(y)
-        if layer_attn is not None and idx == alignment_layer:
-            attn = layer_attn.float().to(y)  
-            
-        ##################### Model 2의 decoder output     
-        
-        idx = 0
-        z, layer_attn, _ = self.layers[1](x, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_2 = self.buffered_future_mask(z)
-        else:
-            self_attn_mask_2 = None
-        
-        idx = 1
-        z, layer_attn, _ = self.layers[1](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_2 = self.buffered_future_mask(z)
-        else:
-            self_attn_mask_2 = None
-        
-        idx = 2
-        z, layer_attn, _ = self.layers[3](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_2 = self.buffered_future_mask(z)
-        else:
-            self_attn_mask_2 = None
-        
-        idx =3 
-        z, layer_attn, _ = self.layers[3](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_2 = self.buffered_future_mask(z)
-        else:
-            self_attn_mask_2 = None
-        
-        idx = 4
-        z, layer_attn, _ = self.layers[5](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_2 = self.buffered_future_mask(z)
-        else:
-            self_attn_mask_2 = None
-        
-        idx = 5 
-        z, layer_attn, _ = self.layers[5](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
- 
-        idx = 6 
-        z, layer_attn, _ = self.layers[7](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)
-            
-        idx = 7 
-        z, layer_attn, _ = self.layers[7](z, enc_2, padding_mask, self_attn_mask = self_attn_mask_2, self_attn_padding_mask = self_attn_padding_mask_2,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_2.append(z)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_2 = layer_attn.float().to(z)            
+            self_attn_padding_mask = prev_output_tokens.eq(self.padding_idx)
 
-        ######################### Model 3의 decoder output     
-        
-        idx = 0
-        w, layer_attn, _ = self.layers[1](x, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_3 = self.buffered_future_mask(w)
-        else:
-            self_attn_mask_3 = None
-        
-        idx = 1
-        w, layer_attn, _ = self.layers[8](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_3 = self.buffered_future_mask(w)
-        else:
-            self_attn_mask_3 = None
-        
-        idx = 2
-        w, layer_attn, _ = self.layers[3](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_3 = self.buffered_future_mask(w)
-        else:
-            self_attn_mask_3 = None
-        
-        idx = 3
-        w, layer_attn, _ = self.layers[9](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_3 = self.buffered_future_mask(w)
-        else:
-            self_attn_mask_3 = None
-        
-        idx = 4
-        w, layer_attn, _ = self.layers[5](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)
-            
-        if incremental_state is None and not full_context_alignment:   
-            self_attn_mask_3 = self.buffered_future_mask(w)
+        # one future mask serves every layer application of every path
+        if incremental_state is None and not full_context_alignment:
+            self_attn_mask = self.buffered_future_mask(x)
         else:
-            self_attn_mask_3 = None
-        
-        idx = 5
-        w, layer_attn, _ = self.layers[10](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w) 
-            
-        idx = 6
-        w, layer_attn, _ = self.layers[7](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w) 
-            
-        idx = 7
-        w, layer_attn, _ = self.layers[11](w, enc_3, padding_mask, self_attn_mask = self_attn_mask_3, self_attn_padding_mask = self_attn_padding_mask_3,
-                                          need_attn=bool((idx == alignment_layer)), need_head_weights=bool((idx == alignment_layer)),)
-        inner_states_3.append(w)
-        if layer_attn is not None and idx == alignment_layer:
-            attn_3 = layer_attn.float().to(w)             
-            
-########################################################################################################            
-#         for idx, layer in enumerate(self.layers):
-#             if incremental_state is None and not full_context_alignment:
-#                 self_attn_mask = self.buffered_future_mask(x)
-#             else:
-#                 self_attn_mask = None
-
-#             x, layer_attn, _ = layer(
-#                 x,
-#                 enc,
-#                 padding_mask,
-#                 incremental_state,
-#                 self_attn_mask=self_attn_mask,
-#                 self_attn_padding_mask=self_attn_padding_mask,
-#                 need_attn=bool((idx == alignment_layer)),
-#                 need_head_weights=bool((idx == alignment_layer)),
-#             )
-#             inner_states.append(x)
-#             if layer_attn is not None and idx == alignment_layer:
-#                 attn = layer_attn.float().to(x)
-#########################################################################################################
-        if attn is not None:
-            if alignment_heads is not None:
-                attn = attn[:alignment_heads]
-
-            # average probabilities over heads
-            attn = attn.mean(dim=0)
-
-        if attn_2 is not None:
-            if alignment_heads is not None:
-                attn_2 = attn_2[:alignment_heads]
-
-            # average probabilities over heads
-            attn_2 = attn_2.mean(dim=0)
-
-        if attn_3 is not None:
-            if alignment_heads is not None:
-                attn_3 = attn_3[:alignment_heads]
+            self_attn_mask = None
 
-            # average probabilities over heads
-            attn_3 = attn_3.mean(dim=0)
-            
-        if self.layer_norm is not None:
-            #x = self.layer_norm(x)
-            y = self.layer_norm(y)
-            z = self.layer_norm(z)
-            w = self.layer_norm(w)
+        encs = [enc, enc_2, enc_3]
 
-        # T x B x C -> B x T x C
-        #x = x.transpose(0, 1)
-        y = y.transpose(0, 1)
-        z = z.transpose(0, 1)
-        w = w.transpose(0, 1)
+        def apply_layer(path: int, idx: int, layer: int, h):
+            out, layer_attn, _ = self.layers[layer](
+                h,
+                encs[path],
+                padding_mask,
+                self._path_incremental_state(incremental_state, path + 1, idx, layer),
+                self_attn_mask=self_attn_mask,
+                self_attn_padding_mask=self_attn_padding_mask,
+                need_attn=bool((idx == alignment_layer)),
+                need_head_weights=bool((idx == alignment_layer)),
+            )
+            return out, layer_attn
+
+        # every path attends to its own encoder output, so decoder paths
+        # never share a prefix
+        outputs = run_NL_schedule(
+            [self.schedule[path] for path in paths],
+            paths,
+            x,
+            lambda i, idx, layer, h: apply_layer(paths[i], idx, layer, h),
+        )
 
-        if self.project_out_dim is not None:
-            #x = self.project_out_dim(x)
-            y = self.project_out_dim(y)
-            z = self.project_out_dim(z)
-            w = self.project_out_dim(w)
+        features: List[Optional[Tensor]] = [None, None, None]
+        attns: List[Optional[Tensor]] = [None, None, None]
+        all_inner_states: List[List[Optional[Tensor]]] = [[], [], []]
+        for path, path_outputs in zip(paths, outputs):
+            attn: Optional[Tensor] = None
+            inner_states: List[Optional[Tensor]] = [x]
+            for idx, (h, layer_attn) in enumerate(path_outputs):
+                inner_states.append(h)
+                if layer_attn is not None and idx == alignment_layer:
+                    attn = layer_attn.float().to(h)
+            if attn is not None:
+                if alignment_heads is not None:
+                    attn = attn[:alignment_heads]
+
+                # average probabilities over heads
+                attn = attn.mean(dim=0)
+            attns[path] = attn
+            all_inner_states[path] = inner_states
+
+            h = path_outputs[-1][0]
+            if self.layer_norm is not None:
+                h = self.layer_norm(h)
+            # T x B x C -> B x T x C
+            h = h.transpose(0, 1)
+            if self.project_out_dim is not None:
+                h = self.project_out_dim(h)
+            features[path] = h
+        y, z, w = features
+
+        return y, z, w, {
+            "attn": [attns[0]],
+            "inner_states": all_inner_states[0],
+            "attn_2": [attns[1]],
+            "inner_states_2": all_inner_states[1],
+            "attn_3": [attns[2]],
+            "inner_states_3": all_inner_states[2],
+        }
 
-        return y,z, w, {"attn": [attn], "inner_states": inner_states, "attn_2": [attn_2], "inner_states_2": inner_states_2, "attn_3": [attn_3], "inner_states_3": inner_states_3}
+    def _path_incremental_state(
+        self,
+        incremental_state: Optional[Dict[str, Dict[str, Optional[Tensor]]]],
+        path: int,
+        idx: int,
+        layer: int,
+    ):
+        """
+        Cache of one layer application. The paths apply the same layer module
+        several times, so the module's own incremental state key would be
+        shared between them; instead every (path, position) gets its own
+        nested state, keyed by the layer it runs for reordering.
+        """
+        if incremental_state is None:
+            return None
+        key = "NL_state.{}.{}.{}".format(path, idx, layer)
+        if key not in incremental_state:
+            incremental_state[key] = {}
+        return incremental_state[key]
+
+    def reorder_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        new_order: Tensor,
+    ):
+        for key, state in incremental_state.items():
+            if not key.startswith("NL_state."):
+                continue
+            layer = self.layers[int(key.rsplit(".", 1)[1])]
+            for module in layer.modules():
+                if module is not layer and hasattr(module, "reorder_incremental_state"):
+                    module.reorder_incremental_state(state, new_order)
 
     def output_layer(self, features):
         """Project features to the vocabulary size."""
@@ -3805,6 +3616,17 @@ class TransformerDecoder_NL(FairseqIncrementalDecoder_NL):
         else:
             return features
 
+    def output_layer_NL(self, features: List[Tensor]):
+        """
+        Project the features of several paths to the vocabulary size with a
+        single matrix multiplication instead of one per path.
+        """
+        if self.adaptive_softmax is not None:
+            return features
+        bsz = features[0].size(0)
+        logits = self.output_projection(torch.cat(features, dim=0))
+        return list(logits.split(bsz, dim=0))
+
     def max_positions(self):
         """Maximum output length supported by the decoder."""
         if self.embed_positions is None:
@@ -4026,6 +3848,20 @@ def transformer_iwslt_de_en_NL(args):
     args.decoder_layers = getattr(args, "decoder_layers", 12)
     base_architecture(args)  
     
+@register_model_architecture("transformer_nl", "transformer_iwslt_de_en_NL_3_3")
+def transformer_iwslt_de_en_NL_3_3(args):
+    # 9 layers: 6 shared by the paths and 3 for the third path, whose students
+    # have the 3 layers of transformer_iwslt_de_en_3_3
+    args.encoder_embed_dim = getattr(args, "encoder_embed_dim", 512)
+    args.encoder_ffn_embed_dim = getattr(args, "encoder_ffn_embed_dim", 1024)
+    args.encoder_attention_heads = getattr(args, "encoder_attention_heads", 4)
+    args.encoder_layers = getattr(args, "encoder_layers", 9)
+    args.decoder_embed_dim = getattr(args, "decoder_embed_dim", 512)
+    args.decoder_ffn_embed_dim = getattr(args, "decoder_ffn_embed_dim", 1024)
+    args.decoder_attention_heads = getattr(args, "decoder_attention_heads", 4)
+    args.decoder_layers = getattr(args, "decoder_layers", 9)
+    base_architecture(args)
+
 @register_model_architecture("transformer", "transformer_wmt_en_de")
 def transformer_wmt_en_de(args):
     base_architecture(args)
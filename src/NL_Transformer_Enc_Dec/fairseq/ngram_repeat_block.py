@@ -1,7 +1,7 @@
 # Originally from Microsoft Corporation.
 # Licensed under the MIT License.
 
-""" Wrapper for ngram_repeat_block cuda extension """
+""" Wrapper for ngram_repeat_block cuda extension, with a vectorised fallback """
 import torch
 from torch import nn
 
@@ -94,7 +94,29 @@ class NGramRepeatBlock(nn.Module):
             )
 
     def _no_repeat_ngram(self, tokens, lprobs, bsz: int, beam_size: int, step: int):
-        """For each hypothesis generate a list of previous ngrams and set associated lprobs to -inf"""
+        """Set to -inf the lprobs of the tokens that would complete an ngram
+        already present in the hypothesis. All ngrams of all hypotheses are
+        compared with the last (ngram size - 1) tokens at once, so there is
+        no per-hypothesis Python loop. Same output as :func:`_no_repeat_ngram_loop`."""
+        n = self.no_repeat_ngram_size
+        if step + 2 - n < 0 or tokens.size(1) < n:
+            # no banned tokens if we haven't generated no_repeat_ngram_size tokens yet
+            return lprobs
+        # (bsz * beam_size) x num ngrams x n
+        ngrams = tokens.unfold(1, n, 1)
+        prefix = tokens[:, step + 2 - n : step + 1].unsqueeze(1)
+        matches = (ngrams[:, :, : n - 1] == prefix).all(dim=2)
+        idx = matches.nonzero()
+        rows = idx[:, 0]
+        banned = ngrams[rows, idx[:, 1], n - 1]
+        lprobs[rows.to(lprobs.device), banned.to(lprobs.device)] = torch.tensor(
+            -math.inf
+        ).to(lprobs)
+        return lprobs
+
+    def _no_repeat_ngram_loop(self, tokens, lprobs, bsz: int, beam_size: int, step: int):
+        """For each hypothesis generate a list of previous ngrams and set associated lprobs to -inf.
+        Reference for :func:`_no_repeat_ngram`."""
         gen_ngrams: List[Dict[str, List[int]]] = [
             torch.jit.annotate(Dict[str, List[int]], {})
             for bbsz_idx in range(bsz * beam_size)
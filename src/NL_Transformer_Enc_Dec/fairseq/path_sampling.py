@@ -0,0 +1,184 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Sampling of the NL paths trained at each step, so that a training step runs
+*k* of the *N* paths instead of all of them. Used by
+:class:`~fairseq.criterions.label_smoothed_cross_entropy.LabelSmoothedCrossEntropyCriterion_NL`.
+NL_BERT, which is installed on its own, keeps a copy in its
+``utils/path_sampling.py``.
+"""
+
+from typing import List, Optional, Tuple
+
+import torch
+
+
+def parse_probs(probs: Optional[str], num_paths: int) -> Optional[List[float]]:
+    if probs is None:
+        return None
+    values = [float(p) for p in probs.split(",")]
+    if len(values) != num_paths or min(values) < 0 or sum(values) <= 0:
+        raise ValueError(
+            "expected {} non-negative path probabilities, got {}".format(num_paths, probs)
+        )
+    return [p / sum(values) for p in values]
+
+
+class PathSampler(object):
+    """Draws *num_samples* of *num_paths* paths per training step.
+
+    The full NL loss is the mean of the path losses. Weighting the loss of
+    each sampled path by :meth:`sample`'s weights keeps it an unbiased
+    estimate of that mean, so the expected gradient is unchanged.
+
+    Modes:
+        - ``uniform``: *num_samples* distinct paths, all equally likely.
+        - ``scheduled``: paths drawn with probabilities annealed linearly
+          from *probs* to *final_probs* (default: uniform) over
+          *anneal_updates* updates.
+        - ``learned``: paths drawn with probabilities proportional to an
+          exponential moving average of their loss per token, so that the
+          paths that are still far from converged are trained more often.
+          *min_prob* of the mass is spread uniformly so that every path
+          keeps being visited. Losses given as tensors are moved to the host
+          *sync_every* at a time, so the averages lag by up to that many
+          steps.
+
+    The ``scheduled`` and ``learned`` modes draw with replacement and train
+    a path drawn twice once, with twice the weight.
+
+    Args:
+        num_paths (int): number of paths of the model
+        num_samples (int): number of draws per step
+        mode (str, optional): one of ``uniform``, ``scheduled`` and
+            ``learned`` (default: ``uniform``)
+        probs (List[float], optional): initial probabilities of the
+            ``scheduled`` mode
+        final_probs (List[float], optional): final probabilities of the
+            ``scheduled`` mode
+        anneal_updates (int, optional): length of the ``scheduled`` annealing
+        ema_decay (float, optional): decay of the ``learned`` loss averages
+        min_prob (float, optional): uniform share of the ``learned`` mode
+        sync_every (int, optional): number of tensor losses the ``learned``
+            mode gathers before moving them to the host at once
+    """
+
+    def __init__(
+        self,
+        num_paths,
+        num_samples,
+        mode="uniform",
+        probs=None,
+        final_probs=None,
+        anneal_updates=0,
+        ema_decay=0.99,
+        min_prob=0.1,
+        sync_every=32,
+    ):
+        if not 0 < num_samples <= num_paths:
+            raise ValueError(
+                "cannot sample {} of {} paths".format(num_samples, num_paths)
+            )
+        if mode not in ["uniform", "scheduled", "learned"]:
+            raise ValueError("unknown path sampling mode {}".format(mode))
+        if mode == "scheduled" and probs is None:
+            raise ValueError("scheduled path sampling needs initial probabilities")
+        self.num_paths = num_paths
+        self.num_samples = num_samples
+        self.mode = mode
+        uniform = [1.0 / num_paths] * num_paths
+        self.initial_probs = probs if probs is not None else uniform
+        self.final_probs = final_probs if final_probs is not None else uniform
+        self.anneal_updates = anneal_updates
+        self.ema_decay = ema_decay
+        self.min_prob = min_prob
+        self.sync_every = sync_every
+        self.loss_ema = [None] * num_paths
+        self._pending = []
+        self.visits = [0] * num_paths
+
+    def probs(self, num_updates: int = 0) -> List[float]:
+        """Probability of drawing each path at update *num_updates*."""
+        if self.mode == "uniform":
+            return [1.0 / self.num_paths] * self.num_paths
+        if self.mode == "scheduled":
+            if self.anneal_updates > 0:
+                t = min(num_updates / self.anneal_updates, 1.0)
+            else:
+                t = 1.0
+            return [
+                (1 - t) * p + t * q
+                for p, q in zip(self.initial_probs, self.final_probs)
+            ]
+        seen = [ema for ema in self.loss_ema if ema is not None]
+        # paths not seen yet count as the worst seen so far
+        default = max(seen) if len(seen) > 0 else 1.0
+        emas = [default if ema is None else ema for ema in self.loss_ema]
+        total = sum(emas)
+        if total <= 0:
+            return [1.0 / self.num_paths] * self.num_paths
+        return [
+            (1 - self.min_prob) * ema / total + self.min_prob / self.num_paths
+            for ema in emas
+        ]
+
+    def sample(self, num_updates: int = 0) -> Tuple[List[int], List[float]]:
+        """Draws the paths of one step.
+
+        Returns:
+            tuple:
+                - the sorted, distinct paths to run
+                - the weight of the loss of each of them
+        """
+        if self.mode == "uniform":
+            paths = sorted(torch.randperm(self.num_paths)[: self.num_samples].tolist())
+            weights = [1.0 / self.num_samples] * len(paths)
+        else:
+            probs = self.probs(num_updates)
+            draws = torch.multinomial(
+                torch.tensor(probs), self.num_samples, replacement=True
+            ).tolist()
+            paths = sorted(set(draws))
+            # E[count_i] = k * p_i, so this averages to the mean path loss
+            weights = [
+                draws.count(path) / (self.num_samples * self.num_paths * probs[path])
+                for path in paths
+            ]
+        for path in paths:
+            self.visits[path] += 1
+        return paths, weights
+
+    def observe(self, path: int, loss):
+        """Record the loss per token of *path* for the ``learned`` mode.
+
+        *loss* is a float or a scalar tensor. Tensors are kept on their
+        device until *sync_every* of them are moved to the host at once,
+        which avoids a synchronization per step.
+        """
+        if torch.is_tensor(loss):
+            self._pending.append((path, loss.detach().float()))
+            if len(self._pending) >= self.sync_every:
+                self.flush()
+            return
+        self.flush()
+        self._update_ema(path, loss)
+
+    def flush(self):
+        """Fold the losses gathered by :meth:`observe` into the averages."""
+        if len(self._pending) == 0:
+            return
+        paths = [path for path, _ in self._pending]
+        losses = torch.stack([loss for _, loss in self._pending]).tolist()
+        self._pending = []
+        for path, loss in zip(paths, losses):
+            self._update_ema(path, loss)
+
+    def _update_ema(self, path: int, loss: float):
+        if self.loss_ema[path] is None:
+            self.loss_ema[path] = loss
+        else:
+            self.loss_ema[path] = (
+                self.ema_decay * self.loss_ema[path] + (1 - self.ema_decay) * loss
+            )
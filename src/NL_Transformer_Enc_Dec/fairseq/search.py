@@ -10,6 +10,7 @@ import torch
 import torch.nn as nn
 from fairseq.token_generation_constraints import (
     ConstraintState,
+    ConstraintTable,
     OrderedConstraintState,
     UnorderedConstraintState,
 )
@@ -224,18 +225,42 @@ class LexicallyConstrainedBeamSearch(Search):
     ConstraintState object (see constraints.py) that tracks which
     constraints have been generated and using this information to
     shape the beam for each input sentence.
+
+    The constraint states of a batch are compiled into a ConstraintTable,
+    so that each hypothesis' state is an integer and a step runs as
+    batched tensor operations over the whole beam. Batches with more than
+    *max_constraint_states* states for a sentence fall back to walking
+    the ConstraintState objects sentence by sentence.
     """
 
-    def __init__(self, tgt_dict, representation):
+    def __init__(self, tgt_dict, representation, max_constraint_states=10000):
         super().__init__(tgt_dict)
         self.representation = representation
         self.vocab_size = len(tgt_dict)
         self.num_cands = 0
         self.supports_constraints = True
+        self.max_constraint_states = max_constraint_states
+        self.constraint_states = []
+        self.constraint_table: Optional[ConstraintTable] = None
+        # (batch, beam) the state of each hypothesis in the table
+        self.states = torch.empty(0).long()
+        # (batch, 2 * beam) the state of each candidate of the last step
+        self.cand_states = torch.empty(0).long()
 
     @torch.jit.export
     def init_constraints(self, batch_constraints: Optional[Tensor], beam_size: int):
         self.constraint_states = []
+        self.constraint_table = None
+        if batch_constraints is None:
+            return
+
+        self.constraint_table = ConstraintTable.create(
+            batch_constraints, self.representation, self.max_constraint_states
+        )
+        if self.constraint_table is not None:
+            self.states = self.constraint_table.roots.unsqueeze(1).repeat(1, beam_size)
+            return
+
         for constraint_tensor in batch_constraints:
             if self.representation == "ordered":
                 constraint_state = OrderedConstraintState.create(constraint_tensor)
@@ -246,13 +271,18 @@ class LexicallyConstrainedBeamSearch(Search):
 
     @torch.jit.export
     def prune_sentences(self, batch_idxs: Tensor):
+        if self.constraint_table is not None:
+            self.cand_states = self.cand_states[batch_idxs]
+            return
         self.constraint_states = [
             self.constraint_states[i] for i in batch_idxs.tolist()
         ]
 
     @torch.jit.export
     def update_constraints(self, active_hypos: Tensor):
-        if self.constraint_states:
+        if self.constraint_table is not None:
+            self.states = self.cand_states.gather(1, active_hypos)
+        elif self.constraint_states:
             batch_size = active_hypos.size(0)
             for sentid in range(batch_size):
                 self.constraint_states[sentid] = [
@@ -293,6 +323,9 @@ class LexicallyConstrainedBeamSearch(Search):
             constraints: (batch, output beam size)
                 the new constraint states
         """
+        if self.constraint_table is not None:
+            return self.step_tensorized(step, lprobs, scores)
+
         each_k = 1
         device = lprobs.device
 
@@ -377,6 +410,121 @@ class LexicallyConstrainedBeamSearch(Search):
 
         return new_scores_buf, new_indices_buf, new_beams_buf
 
+    @torch.jit.export
+    def step_tensorized(self, step: int, lprobs: Tensor, scores: Optional[Tensor]):
+        """Does the work of :func:`step` for the whole batch at once, with
+        the constraint states looked up in the ConstraintTable. The
+        candidates, banks and stripes are those of :func:`step_sentence`.
+        """
+        table = self.constraint_table
+        assert table is not None
+        device = lprobs.device
+        batch_size, beam_size, vocab_size = lprobs.size()
+
+        self.num_cands = min(
+            beam_size * 2,
+            lprobs.view(batch_size, -1).size(1) - 1,  # -1 so we never select pad
+        )
+
+        # STEP 0: Prevent EOS for hypotheses that have not met their constraints
+        states = self.states
+        if step > 0:
+            lprobs[:, :, self.eos].masked_fill_(~table.finished[states], -math.inf)
+
+        if step == 0:
+            # all hypotheses are equal at the first step, use only the first
+            lprobs = lprobs[:, ::beam_size, :].contiguous()
+            states = states[:, :1]
+        else:
+            assert scores is not None
+            lprobs = lprobs + scores[:, :, step - 1].unsqueeze(-1)
+        num_hypos = lprobs.size(1)
+
+        # STEP 1: the top candidates over the whole beam, and at later
+        # steps the top-1 of each hypothesis
+        scores_buf, indices_buf = torch.topk(lprobs.view(batch_size, -1), self.num_cands)
+        beams_buf = indices_buf // vocab_size
+        indices_buf = indices_buf.fmod(vocab_size)
+        if step > 0:
+            top_scores, top_indices = lprobs.max(dim=2)
+            scores_buf = torch.cat((scores_buf, top_scores), dim=1)
+            indices_buf = torch.cat((indices_buf, top_indices), dim=1)
+            beams_buf = torch.cat(
+                (beams_buf, torch.arange(beam_size, device=device).repeat(batch_size, 1)),
+                dim=1,
+            )
+
+        # STEP 2: add the tokens that advance the constraints of each hypothesis
+        next_tokens = table.next_tokens[states]
+        valid = torch.cat(
+            (
+                torch.ones_like(indices_buf, dtype=torch.bool),
+                next_tokens.ge(0).view(batch_size, -1),
+            ),
+            dim=1,
+        )
+        next_tokens = next_tokens.clamp(min=0)
+        scores_buf = torch.cat(
+            (scores_buf, lprobs.gather(2, next_tokens).view(batch_size, -1)), dim=1
+        )
+        indices_buf = torch.cat((indices_buf, next_tokens.view(batch_size, -1)), dim=1)
+        next_beams = torch.arange(num_hypos, device=device).view(1, -1, 1)
+        beams_buf = torch.cat(
+            (beams_buf, next_beams.expand_as(next_tokens).reshape(batch_size, -1)),
+            dim=1,
+        )
+
+        # STEP 3: the new state and bank of each candidate
+        cand_states = table.advance(states.gather(1, beams_buf), indices_buf)
+        banks = table.banks[cand_states]
+
+        # STEP 4: sort by score, with the invalid padding last. The ranks
+        # within each bank are counted below, so unlike step_sentence the
+        # banks need not be sorted together.
+        sort_key = scores_buf.masked_fill(~valid, -math.inf)
+        sort_indices = sort_key.sort(dim=1, descending=True)[1]
+        scores_buf = scores_buf.gather(1, sort_indices)
+        indices_buf = indices_buf.gather(1, sort_indices)
+        beams_buf = beams_buf.gather(1, sort_indices)
+        cand_states = cand_states.gather(1, sort_indices)
+        banks = banks.gather(1, sort_indices)
+        valid = valid.gather(1, sort_indices)
+
+        # STEP 5: drop the repeats of a (beam, token) extension
+        num_cands = indices_buf.size(1)
+        earlier = torch.ones(
+            (num_cands, num_cands), dtype=torch.bool, device=device
+        ).tril(-1)
+        extensions = beams_buf * (self.vocab_size + 1) + indices_buf
+        repeated = (
+            (extensions.unsqueeze(2) == extensions.unsqueeze(1))
+            & valid.unsqueeze(1)
+            & earlier
+        ).any(dim=2)
+        keep = valid & ~repeated
+
+        # STEP 6: stripe round-robin across the banks: the best of each bank
+        # from the highest down, then the second-best of each, and so on
+        rank = (
+            (banks.unsqueeze(2) == banks.unsqueeze(1)) & keep.unsqueeze(1) & earlier
+        ).sum(dim=2)
+        stripes = rank * (table.max_bank + 1) + (table.max_bank - banks)
+        stripes = stripes.masked_fill(~keep, (num_cands + 1) * (table.max_bank + 1))
+
+        # STEP 7: sort by the stripes and truncate to the candidates size
+        sort_indices = stripes.sort(dim=1)[1][:, : self.num_cands]
+
+        new_scores_buf = torch.zeros((batch_size, 2 * beam_size), device=device)
+        new_indices_buf = torch.zeros((batch_size, 2 * beam_size), device=device).long()
+        new_beams_buf = torch.zeros((batch_size, 2 * beam_size), device=device).long()
+        self.cand_states = states[:, :1].repeat(1, 2 * beam_size)
+        new_scores_buf[:, : self.num_cands] = scores_buf.gather(1, sort_indices)
+        new_indices_buf[:, : self.num_cands] = indices_buf.gather(1, sort_indices)
+        new_beams_buf[:, : self.num_cands] = beams_buf.gather(1, sort_indices)
+        self.cand_states[:, : self.num_cands] = cand_states.gather(1, sort_indices)
+
+        return new_scores_buf, new_indices_buf, new_beams_buf
+
     @torch.jit.export
     def step_sentence(
         self,
@@ -11,7 +11,7 @@ import torch
 import torch.nn as nn
 from fairseq import search, utils
 from fairseq.data import data_utils
-from fairseq.models import FairseqIncrementalDecoder
+from fairseq.models import FairseqIncrementalDecoder, FairseqIncrementalDecoder_NL
 from torch import Tensor
 from fairseq.ngram_repeat_block import NGramRepeatBlock
 
@@ -37,6 +37,7 @@ class SequenceGenerator(nn.Module):
         symbols_to_strip_from_output=None,
         lm_model=None,
         lm_weight=1.0,
+        NL_paths=None,
     ):
         """Generates translations of a given source sentence.
 
@@ -61,12 +62,14 @@ class SequenceGenerator(nn.Module):
                 sharper samples (default: 1.0)
             match_source_len (bool, optional): outputs should match the source
                 length (default: False)
+            NL_paths (List[int], optional): paths (0, 1 and/or 2) of NL models
+                that are ensembled (default: [2])
         """
         super().__init__()
         if isinstance(models, EnsembleModel):
             self.model = models
         else:
-            self.model = EnsembleModel(models)
+            self.model = EnsembleModel(models, NL_paths=NL_paths)
         self.tgt_dict = tgt_dict
         self.pad = tgt_dict.pad()
         self.unk = tgt_dict.unk()
@@ -202,6 +205,13 @@ class SequenceGenerator(nn.Module):
         """
         return self._generate_RT(sample, **kwargs)    
 
+    @torch.no_grad()
+    def generate_NL(self, models, sample: Dict[str, Dict[str, Tensor]], **kwargs) -> List[List[Dict[str, Tensor]]]:
+        """Generate translations with the paths *NL_paths* of NL models.
+        Takes the same arguments as :func:`generate`.
+        """
+        return self._generate(sample, **kwargs)
+
     def _generate(
         self,
         sample: Dict[str, Dict[str, Tensor]],
@@ -1133,18 +1143,31 @@ class SequenceGenerator(nn.Module):
         return False
 
 
+# keys of the alignment attention of each path in the NL decoder's extra output
+NL_ATTN_KEYS = ["attn", "attn_2", "attn_3"]
+
+
 class EnsembleModel(nn.Module):
-    """A wrapper around an ensemble of models."""
+    """A wrapper around an ensemble of models.
 
-    def __init__(self, models):
+    Each NL model (with a :class:`FairseqIncrementalDecoder_NL`) contributes
+    one ensemble member per path in *NL_paths*."""
+
+    def __init__(self, models, NL_paths: Optional[List[int]] = None):
         super().__init__()
         self.models_size = len(models)
         # method '__len__' is not supported in ModuleList for torch script
         self.single_model = models[0]
         self.models = nn.ModuleList(models)
 
+        self.is_NL: bool = all(
+            hasattr(m, "decoder") and isinstance(m.decoder, FairseqIncrementalDecoder_NL)
+            for m in models
+        )
+        self.NL_paths: List[int] = [2] if NL_paths is None else list(NL_paths)
+
         self.has_incremental: bool = False
-        if all(
+        if self.is_NL or all(
             hasattr(m, "decoder") and isinstance(m.decoder, FairseqIncrementalDecoder)
             for m in models
         ):
@@ -1166,6 +1189,12 @@ class EnsembleModel(nn.Module):
     def forward_encoder(self, net_input: Dict[str, Tensor]):
         if not self.has_encoder():
             return None
+        if self.is_NL:
+            # the encoder paths of the other decoder paths are not needed
+            return [
+                model.encoder.forward_torchscript(net_input, paths=self.NL_paths)
+                for model in self.models
+            ]
         return [model.encoder.forward_torchscript(net_input) for model in self.models]
     
     def forward_encoder_RT(self, net_input: Dict[str, Tensor]):
@@ -1180,6 +1209,10 @@ class EnsembleModel(nn.Module):
         incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]],
         temperature: float = 1.0,
     ):
+        if self.is_NL:
+            return self.forward_decoder_NL(
+                tokens, encoder_outs, incremental_states, temperature
+            )
         log_probs = []
         avg_attn: Optional[Tensor] = None
         encoder_out: Optional[Dict[str, List[Tensor]]] = None
@@ -1239,6 +1272,53 @@ class EnsembleModel(nn.Module):
             avg_attn.div_(self.models_size)
         return avg_probs, avg_attn
 
+    def forward_decoder_NL(
+        self,
+        tokens,
+        encoder_outs: List[Dict[str, List[Tensor]]],
+        incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]],
+        temperature: float = 1.0,
+    ):
+        """Path ensemble of NL models.
+
+        Only the paths in *NL_paths* are run. They share the encoder
+        embeddings, the decoder embeddings and the output projection, so the
+        last states of all paths of a model are projected in one matrix
+        multiplication, and the log-probs of all members (models x paths)
+        are averaged in one logsumexp.
+        """
+        log_probs = []
+        avg_attn: Optional[Tensor] = None
+        num_attn = 0
+        for i, model in enumerate(self.models):
+            features = model.decoder.extract_features(
+                tokens,
+                encoder_out=encoder_outs[i],
+                incremental_state=incremental_states[i],
+                paths=self.NL_paths,
+            )
+            # paths x bsz x embed_dim -> paths x bsz x vocab
+            last = torch.stack([features[p][:, -1, :] for p in self.NL_paths], dim=0)
+            logits = model.decoder.output_layer(last).div_(temperature)
+            log_probs.append(utils.log_softmax(logits, dim=-1))
+
+            for p in self.NL_paths:
+                attn_holder = features[3][NL_ATTN_KEYS[p]]
+                if attn_holder is not None and attn_holder[0] is not None:
+                    attn = attn_holder[0][:, -1, :]
+                    avg_attn = attn if avg_attn is None else avg_attn + attn
+                    num_attn += 1
+
+        log_probs = torch.cat(log_probs, dim=0)
+        if log_probs.size(0) == 1:
+            avg_probs = log_probs[0]
+        else:
+            avg_probs = torch.logsumexp(log_probs, dim=0) - math.log(log_probs.size(0))
+
+        if avg_attn is not None:
+            avg_attn = avg_attn / num_attn
+        return avg_probs, avg_attn
+
     @torch.jit.export
     def reorder_encoder_out(
         self, encoder_outs: Optional[List[Dict[str, List[Tensor]]]], new_order
@@ -223,6 +223,7 @@ class FairseqTask(object):
         epoch=1,
         data_buffer_size=0,
         disable_iterator_cache=False,
+        prefetch_device=None,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -255,6 +256,8 @@ class FairseqTask(object):
             disable_iterator_cache (bool, optional): don't cache the
                 EpochBatchIterator (ignores `FairseqTask::can_reuse_epoch_itr`)
                 (default: False).
+            prefetch_device (torch.device, optional): CUDA device to copy
+                the batches to ahead of their use (default: None).
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
                 given dataset split
@@ -300,6 +303,7 @@ class FairseqTask(object):
             num_workers=num_workers,
             epoch=epoch,
             buffer_size=data_buffer_size,
+            prefetch_device=prefetch_device,
         )
 
         if can_reuse_epoch_itr:
@@ -420,6 +424,14 @@ class FairseqTask(object):
             search_strategy = search.BeamSearch(self.target_dictionary)
 
         extra_gen_cls_kwargs = extra_gen_cls_kwargs or {}
+        nl_paths = getattr(args, "nl_paths", None)
+        if nl_paths is not None:
+            # "0,1,2" on the command line, also a list or int in --eval-bleu-args
+            if isinstance(nl_paths, str):
+                nl_paths = nl_paths.split(",")
+            elif isinstance(nl_paths, int):
+                nl_paths = [nl_paths]
+            extra_gen_cls_kwargs["NL_paths"] = [int(path) for path in nl_paths]
         if seq_gen_cls is None:
             if getattr(args, "print_alignment", False):
                 logger.info("Check 1")
@@ -467,111 +479,33 @@ class FairseqTask(object):
 
         Returns:
             tuple:
-                - the loss
+                - the loss, or for criteria with several paths (e.g. DL and
+                  NL) a dict of the loss of every path, with the total loss
+                  under "loss"
                 - the sample size, which is used as the denominator for the
                   gradient
                 - logging outputs to display while training
         """
         model.train()
         model.set_num_updates(update_num)
+        if hasattr(criterion, "set_num_updates"):
+            # e.g. for the annealed path sampling of the NL criterion
+            criterion.set_num_updates(update_num)
         with torch.autograd.profiler.record_function("forward"):
             loss, sample_size, logging_output = criterion(model, sample)
+        total_loss = loss["loss"] if isinstance(loss, dict) else loss
         if ignore_grad:
-            loss *= 0
+            total_loss *= 0
         with torch.autograd.profiler.record_function("backward"):
-            optimizer.backward(loss)
+            optimizer.backward(total_loss)
         return loss, sample_size, logging_output
 
-    def train_step_DL(
-        self, sample, model, criterion, optimizer, update_num, ignore_grad=False
-    ):
-        """
-        Do forward and backward, and return the loss as computed by *criterion*
-        for the given *model* and *sample*.
-
-        Args:
-            sample (dict): the mini-batch. The format is defined by the
-                :class:`~fairseq.data.FairseqDataset`.
-            model (~fairseq.models.BaseFairseqModel): the model
-            criterion (~fairseq.criterions.FairseqCriterion): the criterion
-            optimizer (~fairseq.optim.FairseqOptimizer): the optimizer
-            update_num (int): the current update
-            ignore_grad (bool): multiply loss by 0 if this is set to True
-
-        Returns:
-            tuple:
-                - the loss
-                - the sample size, which is used as the denominator for the
-                  gradient
-                - logging outputs to display while training
-        """
-        model.train()
-        model.set_num_updates(update_num)
-        with torch.autograd.profiler.record_function("forward"):
-            #loss, loss_1, loss_2, loss_3, sample_size, logging_output = criterion(model, sample)
-            loss, loss_1, loss_2, sample_size, logging_output = criterion(model, sample)
-        if ignore_grad:
-            loss *= 0
-        with torch.autograd.profiler.record_function("backward"):
-            optimizer.backward(loss)
-#         return loss, loss_1, loss_2, loss_3, sample_size, logging_output
-        return loss, loss_1, loss_2, sample_size, logging_output
-
-    def train_step_NL(
-        self, sample, model, criterion, optimizer, update_num, ignore_grad=False
-    ):
-        """
-        Do forward and backward, and return the loss as computed by *criterion*
-        for the given *model* and *sample*.
-
-        Args:
-            sample (dict): the mini-batch. The format is defined by the
-                :class:`~fairseq.data.FairseqDataset`.
-            model (~fairseq.models.BaseFairseqModel): the model
-            criterion (~fairseq.criterions.FairseqCriterion): the criterion
-            optimizer (~fairseq.optim.FairseqOptimizer): the optimizer
-            update_num (int): the current update
-            ignore_grad (bool): multiply loss by 0 if this is set to True
-
-        Returns:
-            tuple:
-                - the loss
-                - the sample size, which is used as the denominator for the
-                  gradient
-                - logging outputs to display while training
-        """
-        model.train()
-        model.set_num_updates(update_num)
-        with torch.autograd.profiler.record_function("forward"):
-            loss, loss_1, loss_2, loss_3, sample_size, logging_output = criterion(model, sample)
-            #loss, loss_1, loss_2, sample_size, logging_output = criterion(model, sample)
-        if ignore_grad:
-            loss *= 0
-        with torch.autograd.profiler.record_function("backward"):
-            optimizer.backward(loss)
-        return loss, loss_1, loss_2, loss_3, sample_size, logging_output
-
     def valid_step(self, sample, model, criterion):
         model.eval()
         with torch.no_grad():
             loss, sample_size, logging_output = criterion(model, sample)
         return loss, sample_size, logging_output
     
-    def valid_step_DL(self, sample, model, criterion):
-        model.eval()
-        with torch.no_grad():
-            #loss, loss_1, loss_2, loss_3, sample_size, logging_output = criterion(model, sample)
-            loss, loss_1, loss_2, sample_size, logging_output = criterion(model, sample)
-        #return loss, loss_1, loss_2, loss_3, sample_size, logging_output
-        return loss, loss_1, loss_2, sample_size, logging_output
-    
-    def valid_step_NL(self, sample, model, criterion):
-        model.eval()
-        with torch.no_grad():
-            loss, loss_1, loss_2, loss_3, sample_size, logging_output = criterion(model, sample)
-     
-        return loss, loss_1, loss_2, loss_3, sample_size, logging_output
-            
     def optimizer_step(self, optimizer, model, update_num):
         optimizer.step()
 
@@ -657,76 +591,6 @@ class FairseqTask(object):
             metrics.log_scalar("bsz", nsentences, priority=190, round=1)
         criterion.__class__.reduce_metrics(logging_outputs)
 
-    def reduce_metrics_DL(self, logging_outputs, criterion):
-        """Aggregate logging outputs from data parallel training."""
-        # backward compatibility for tasks that override aggregate_logging_outputs
-        base_func = FairseqTask.aggregate_logging_outputs
-        self_func = getattr(self, "aggregate_logging_outputs").__func__
-        if self_func is not base_func:
-            utils.deprecation_warning(
-                "Tasks should implement the reduce_metrics API. "
-                "Falling back to deprecated aggregate_logging_outputs API."
-            )
-            agg_logging_outputs = self.aggregate_logging_outputs(
-                logging_outputs, criterion
-            )
-            for k, v in agg_logging_outputs.items():
-                metrics.log_scalar(k, v)
-            return
-
-        if not any("ntokens" in log for log in logging_outputs):
-            warnings.warn(
-                "ntokens not found in Criterion logging outputs, cannot log wpb or wps"
-            )
-        else:
-            ntokens = sum(log.get("ntokens", 0) for log in logging_outputs)
-            metrics.log_scalar("wpb", ntokens, priority=180, round=1)
-            metrics.log_speed("wps", ntokens, priority=90, round=1)
-
-        if not any("nsentences" in log for log in logging_outputs):
-            warnings.warn(
-                "nsentences not found in Criterion logging outputs, cannot log bsz"
-            )
-        else:
-            nsentences = sum(log.get("nsentences", 0) for log in logging_outputs)
-            metrics.log_scalar("bsz", nsentences, priority=190, round=1)
-        criterion.__class__.reduce_metrics_DL(logging_outputs)
-
-    def reduce_metrics_NL(self, logging_outputs, criterion):
-        """Aggregate logging outputs from data parallel training."""
-        # backward compatibility for tasks that override aggregate_logging_outputs
-        base_func = FairseqTask.aggregate_logging_outputs
-        self_func = getattr(self, "aggregate_logging_outputs").__func__
-        if self_func is not base_func:
-            utils.deprecation_warning(
-                "Tasks should implement the reduce_metrics API. "
-                "Falling back to deprecated aggregate_logging_outputs API."
-            )
-            agg_logging_outputs = self.aggregate_logging_outputs(
-                logging_outputs, criterion
-            )
-            for k, v in agg_logging_outputs.items():
-                metrics.log_scalar(k, v)
-            return
-
-        if not any("ntokens" in log for log in logging_outputs):
-            warnings.warn(
-                "ntokens not found in Criterion logging outputs, cannot log wpb or wps"
-            )
-        else:
-            ntokens = sum(log.get("ntokens", 0) for log in logging_outputs)
-            metrics.log_scalar("wpb", ntokens, priority=180, round=1)
-            metrics.log_speed("wps", ntokens, priority=90, round=1)
-
-        if not any("nsentences" in log for log in logging_outputs):
-            warnings.warn(
-                "nsentences not found in Criterion logging outputs, cannot log bsz"
-            )
-        else:
-            nsentences = sum(log.get("nsentences", 0) for log in logging_outputs)
-            metrics.log_scalar("bsz", nsentences, priority=190, round=1)
-        criterion.__class__.reduce_metrics_NL(logging_outputs)
-        
     def state_dict(self):
         if self.state is not None:
             return self.state.state_dict
@@ -4,15 +4,19 @@
 # LICENSE file in the root directory of this source tree.
 
 from dataclasses import dataclass, field
+import copy
 import itertools
 import json
 import logging
 import os
+import queue
+import threading
 from typing import Optional
 from argparse import Namespace
 from omegaconf import II
 
 import numpy as np
+import torch
 from fairseq import metrics, utils
 from fairseq.data import (
     AppendTokenDataset,
@@ -36,6 +40,124 @@ EVAL_BLEU_ORDER = 4
 logger = logging.getLogger(__name__)
 
 
+def bleu_sample_mask(ids, ratio):
+    """Mask keeping about *ratio* of the sentences with ids *ids*.
+
+    Ids are hashed rather than drawn at random, so the subset does not depend
+    on the batching and is the same at every validation.
+    """
+    # Knuth's multiplicative hash spreads consecutive ids over [0, 2**32)
+    return (ids.long() * 2654435761) % (1 << 32) < int(ratio * (1 << 32))
+
+
+def select_sentences(sample, index):
+    """Restrict a translation batch to the sentences at *index*."""
+    return {
+        "id": sample["id"].index_select(0, index),
+        "nsentences": index.numel(),
+        "net_input": utils.apply_to_sample(
+            lambda t: t.index_select(0, index), sample["net_input"]
+        ),
+        "target": sample["target"].index_select(0, index),
+    }
+
+
+def bleu_logging_output(bleu=None):
+    """Logging output entries of sacrebleu statistics, zero if *bleu* is None."""
+    # we split counts into separate entries so that they can be
+    # summed efficiently across workers using fast-stat-sync
+    logging_output = {
+        "_bleu_sys_len": bleu.sys_len if bleu is not None else 0,
+        "_bleu_ref_len": bleu.ref_len if bleu is not None else 0,
+    }
+    if bleu is not None:
+        assert len(bleu.counts) == EVAL_BLEU_ORDER
+    for i in range(EVAL_BLEU_ORDER):
+        logging_output["_bleu_counts_" + str(i)] = bleu.counts[i] if bleu is not None else 0
+        logging_output["_bleu_totals_" + str(i)] = bleu.totals[i] if bleu is not None else 0
+    return logging_output
+
+
+class BackgroundBleuScorer(object):
+    """Decode validation batches for BLEU in a background thread.
+
+    The batches of one validation are decoded by a CPU copy of the model taken
+    when that validation begins, so training goes on while they are decoded.
+    Their summed statistics are handed out once the next validation begins.
+
+    Args:
+        build_generator (callable): builds the sequence generator of the CPU
+            copy of the model
+    """
+
+    def __init__(self, build_generator):
+        self.build_generator = build_generator
+        self.model = None
+        self.generator = None
+        self.queue = queue.Queue()
+        self.stats = bleu_logging_output()
+        self.sentences = 0
+        self.result = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            inference_fn, sample = self.queue.get()
+            try:
+                bleu = inference_fn(self.generator, sample, self.model)
+                for key, value in bleu_logging_output(bleu).items():
+                    self.stats[key] += value
+                self.sentences += sample["nsentences"]
+            except Exception:
+                logger.exception("background BLEU decoding failed")
+            finally:
+                self.queue.task_done()
+
+    def begin_round(self, model):
+        """Wait for the batches of the previous round, keep their statistics
+        and copy the weights of *model* for the new round."""
+        self.queue.join()
+        if self.sentences > 0:
+            logger.info(
+                "BLEU of the previous validation decoded in the background "
+                "on {} sentences".format(self.sentences)
+            )
+            self.result = self.stats
+        self.stats = bleu_logging_output()
+        self.sentences = 0
+
+        if self.model is None:
+            self.model = self._cpu_copy(model).float()
+            self.model.eval()
+            self.generator = self.build_generator(self.model)
+        else:
+            self.model.load_state_dict(model.state_dict())
+
+    @staticmethod
+    def _cpu_copy(model):
+        """Deep copy of *model* with its weights copied straight to the CPU,
+        so that no second copy is made on the training device."""
+        memo = {}
+        for tensor in itertools.chain(model.parameters(), model.buffers()):
+            cpu_tensor = tensor.detach().to("cpu", copy=True)
+            if isinstance(tensor, torch.nn.Parameter):
+                cpu_tensor = torch.nn.Parameter(
+                    cpu_tensor, requires_grad=tensor.requires_grad
+                )
+            memo[id(tensor)] = cpu_tensor
+        return copy.deepcopy(model, memo)
+
+    def submit(self, inference_fn, sample):
+        """Queue *sample* to be scored by ``inference_fn(generator, sample, model)``."""
+        self.queue.put((inference_fn, utils.move_to_cpu(sample)))
+
+    def take_result(self):
+        """Statistics of the previous round, or zeros if they were already taken."""
+        result, self.result = self.result, None
+        return result if result is not None else bleu_logging_output()
+
+
 def load_langpair_dataset(
     data_path,
     split,
@@ -262,6 +384,21 @@ class TranslationConfig(FairseqDataclass):
     eval_bleu_print_samples: bool = field(
         default=False, metadata={"help": "print sample generations during validation"}
     )
+    eval_bleu_sample_ratio: float = field(
+        default=1.0,
+        metadata={
+            "help": "fraction of the validation sentences decoded for BLEU; the subset is "
+            "picked by sentence id, so it is the same at every validation"
+        },
+    )
+    eval_bleu_async: bool = field(
+        default=False,
+        metadata={
+            "help": "decode the BLEU sentences in a background thread on a CPU copy of the "
+            "model; the BLEU of a validation is reported at the next validation, so it "
+            "should not be the --best-checkpoint-metric"
+        },
+    )
 
 
 @register_task("translation", dataclass=TranslationConfig)
@@ -285,6 +422,7 @@ class TranslationTask(FairseqTask):
         super().__init__(cfg)
         self.src_dict = src_dict
         self.tgt_dict = tgt_dict
+        self.background_bleu = None
 
     @classmethod
     def setup_task(cls, cfg: TranslationConfig, **kwargs):
@@ -379,94 +517,92 @@ class TranslationTask(FairseqTask):
             )
         return model
 
+    def begin_valid_epoch(self, epoch, model):
+        super().begin_valid_epoch(epoch, model)
+        if self.cfg.eval_bleu and self.cfg.eval_bleu_async:
+            if self.background_bleu is None:
+                gen_args = Namespace(**json.loads(self.cfg.eval_bleu_args))
+                self.background_bleu = BackgroundBleuScorer(
+                    lambda cpu_model: self.build_generator([cpu_model], gen_args)
+                )
+            self.background_bleu.begin_round(model)
+
     def valid_step(self, sample, model, criterion):
         loss, sample_size, logging_output = super().valid_step(sample, model, criterion)
         if self.cfg.eval_bleu:
-            bleu = self._inference_with_bleu(self.sequence_generator, sample, model)
-            logging_output["_bleu_sys_len"] = bleu.sys_len
-            logging_output["_bleu_ref_len"] = bleu.ref_len
-            # we split counts into separate entries so that they can be
-            # summed efficiently across workers using fast-stat-sync
-            assert len(bleu.counts) == EVAL_BLEU_ORDER
-            for i in range(EVAL_BLEU_ORDER):
-                logging_output["_bleu_counts_" + str(i)] = bleu.counts[i]
-                logging_output["_bleu_totals_" + str(i)] = bleu.totals[i]
+            # the criterion tells how many decoder paths the model has
+            inference_fn = {
+                1: self._inference_with_bleu,
+                2: self._inference_with_bleu_DL,
+                3: self._inference_with_bleu_NL,
+            }[getattr(criterion, "num_paths", 1)]
+            logging_output.update(
+                self._bleu_logging_output(sample, model, inference_fn)
+            )
         return loss, sample_size, logging_output
-    
-    def valid_step_DL(self, sample, model, criterion):
-        #loss, loss_1, loss_2, loss_3, sample_size, logging_output = super().valid_step_DL(sample, model, criterion)
-        loss, loss_1, loss_2, sample_size, logging_output = super().valid_step_DL(sample, model, criterion)
-        
-        if self.cfg.eval_bleu:
-            bleu = self._inference_with_bleu_DL(self.sequence_generator, sample, model)
-            logging_output["_bleu_sys_len"] = bleu.sys_len
-            logging_output["_bleu_ref_len"] = bleu.ref_len
-            # we split counts into separate entries so that they can be
-            # summed efficiently across workers using fast-stat-sync
-            assert len(bleu.counts) == EVAL_BLEU_ORDER
-            for i in range(EVAL_BLEU_ORDER):
-                logging_output["_bleu_counts_" + str(i)] = bleu.counts[i]
-                logging_output["_bleu_totals_" + str(i)] = bleu.totals[i]
-        #return loss, loss_1, loss_2, loss_3, sample_size, logging_output    
-        return loss, loss_1, loss_2, sample_size, logging_output    
-
-    def valid_step_NL(self, sample, model, criterion):
-        loss, loss_1, loss_2, loss_3, sample_size, logging_output = super().valid_step_NL(sample, model, criterion)
-        
-        if self.cfg.eval_bleu:
-            bleu = self._inference_with_bleu_NL(self.sequence_generator, sample, model)
-            logging_output["_bleu_sys_len"] = bleu.sys_len
-            logging_output["_bleu_ref_len"] = bleu.ref_len
-            # we split counts into separate entries so that they can be
-            # summed efficiently across workers using fast-stat-sync
-            assert len(bleu.counts) == EVAL_BLEU_ORDER
-            for i in range(EVAL_BLEU_ORDER):
-                logging_output["_bleu_counts_" + str(i)] = bleu.counts[i]
-                logging_output["_bleu_totals_" + str(i)] = bleu.totals[i]
-        return loss, loss_1, loss_2, loss_3, sample_size, logging_output    
-        
+
+    def _bleu_logging_output(self, sample, model, inference_fn):
+        """BLEU statistics of the sampled sentences of *sample*.
+
+        With --eval-bleu-async the sentences are queued for the background
+        scorer instead, and the statistics of the previous validation are
+        returned by the first call of this one.
+        """
+        if self.cfg.eval_bleu_sample_ratio < 1.0:
+            index = bleu_sample_mask(sample["id"], self.cfg.eval_bleu_sample_ratio)
+            index = index.nonzero(as_tuple=False).squeeze(1)
+            sample = select_sentences(sample, index) if index.numel() > 0 else None
+        if self.background_bleu is not None:
+            if sample is not None:
+                self.background_bleu.submit(inference_fn, sample)
+            return self.background_bleu.take_result()
+        if sample is None:
+            return bleu_logging_output()
+        return bleu_logging_output(inference_fn(self.sequence_generator, sample, model))
+
     def reduce_metrics(self, logging_outputs, criterion):
         super().reduce_metrics(logging_outputs, criterion)
         if self.cfg.eval_bleu:
+            self._reduce_bleu_metrics(logging_outputs)
+
+    def _reduce_bleu_metrics(self, logging_outputs):
+        def sum_logs(key):
+            result = sum(log.get(key, 0) for log in logging_outputs)
+            if torch.is_tensor(result):
+                result = result.cpu()
+            return result
+
+        counts, totals = [], []
+        for i in range(EVAL_BLEU_ORDER):
+            counts.append(sum_logs("_bleu_counts_" + str(i)))
+            totals.append(sum_logs("_bleu_totals_" + str(i)))
+
+        if max(totals) > 0:
+            # log counts as numpy arrays -- log_scalar will sum them correctly
+            metrics.log_scalar("_bleu_counts", np.array(counts))
+            metrics.log_scalar("_bleu_totals", np.array(totals))
+            metrics.log_scalar("_bleu_sys_len", sum_logs("_bleu_sys_len"))
+            metrics.log_scalar("_bleu_ref_len", sum_logs("_bleu_ref_len"))
+
+            def compute_bleu(meters):
+                import inspect
+                import sacrebleu
+
+                fn_sig = inspect.getfullargspec(sacrebleu.compute_bleu)[0]
+                if "smooth_method" in fn_sig:
+                    smooth = {"smooth_method": "exp"}
+                else:
+                    smooth = {"smooth": "exp"}
+                bleu = sacrebleu.compute_bleu(
+                    correct=meters["_bleu_counts"].sum,
+                    total=meters["_bleu_totals"].sum,
+                    sys_len=meters["_bleu_sys_len"].sum,
+                    ref_len=meters["_bleu_ref_len"].sum,
+                    **smooth
+                )
+                return round(bleu.score, 2)
 
-            def sum_logs(key):
-                import torch
-                result = sum(log.get(key, 0) for log in logging_outputs)
-                if torch.is_tensor(result):
-                    result = result.cpu()
-                return result
-
-            counts, totals = [], []
-            for i in range(EVAL_BLEU_ORDER):
-                counts.append(sum_logs("_bleu_counts_" + str(i)))
-                totals.append(sum_logs("_bleu_totals_" + str(i)))
-
-            if max(totals) > 0:
-                # log counts as numpy arrays -- log_scalar will sum them correctly
-                metrics.log_scalar("_bleu_counts", np.array(counts))
-                metrics.log_scalar("_bleu_totals", np.array(totals))
-                metrics.log_scalar("_bleu_sys_len", sum_logs("_bleu_sys_len"))
-                metrics.log_scalar("_bleu_ref_len", sum_logs("_bleu_ref_len"))
-
-                def compute_bleu(meters):
-                    import inspect
-                    import sacrebleu
-
-                    fn_sig = inspect.getfullargspec(sacrebleu.compute_bleu)[0]
-                    if "smooth_method" in fn_sig:
-                        smooth = {"smooth_method": "exp"}
-                    else:
-                        smooth = {"smooth": "exp"}
-                    bleu = sacrebleu.compute_bleu(
-                        correct=meters["_bleu_counts"].sum,
-                        total=meters["_bleu_totals"].sum,
-                        sys_len=meters["_bleu_sys_len"].sum,
-                        ref_len=meters["_bleu_ref_len"].sum,
-                        **smooth
-                    )
-                    return round(bleu.score, 2)
-
-                metrics.log_derived("bleu", compute_bleu)
+            metrics.log_derived("bleu", compute_bleu)
 
     def max_positions(self):
         """Return the max sentence length allowed by the task."""
@@ -349,6 +349,7 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
         epoch=1,
         data_buffer_size=0,
         disable_iterator_cache=False,
+        prefetch_device=None,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -381,6 +382,8 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
             disable_iterator_cache (bool, optional): don't cache the
                 EpochBatchIterator (ignores `FairseqTask::can_reuse_epoch_itr`)
                 (default: False).
+            prefetch_device (torch.device, optional): CUDA device to copy
+                the batches to ahead of their use (default: None).
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
                 given dataset split
@@ -404,6 +407,7 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
                 epoch=epoch,
                 data_buffer_size=data_buffer_size,
                 disable_iterator_cache=disable_iterator_cache,
+                prefetch_device=prefetch_device,
             )
             self.dataset_to_epoch_iter[dataset] = batch_iter
             return batch_iter
@@ -426,5 +430,6 @@ class TranslationMultiSimpleEpochTask(LegacyFairseqTask):
             shard_id=shard_id,
             num_workers=num_workers,
             epoch=epoch,
+            prefetch_device=prefetch_device,
         )
         return epoch_iter
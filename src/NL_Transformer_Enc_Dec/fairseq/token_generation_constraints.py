@@ -504,3 +504,144 @@ class OrderedConstraintState(ConstraintState):
             next_state = OrderedConstraintState(self.sequence, -1)
 
         return next_state
+
+
+def _state_signature(state: ConstraintState):
+    """A hashable summary of everything that determines how a state behaves."""
+    if isinstance(state, OrderedConstraintState):
+        return state.state
+    return (
+        id(state.node),
+        tuple(sorted((id(n), c) for n, c in state.generated.items() if c != 0)),
+        tuple(sorted((id(n), c) for n, c in state.completed.items() if c != 0)),
+    )
+
+
+def _enumerate_states(root: ConstraintState, tokens: List[int], max_states: int):
+    """Visits the states reachable from *root*, reading *tokens*. Returns
+    the states and the transition rows (indices into the states, one
+    entry per token), or None if there are more than *max_states*."""
+    index = {_state_signature(root): 0}
+    states = [root]
+    transitions = []
+    while len(transitions) < len(states):
+        state = states[len(transitions)]
+        row = []
+        for token in tokens:
+            next_state = state.advance(token)
+            signature = _state_signature(next_state)
+            if signature not in index:
+                if len(states) >= max_states:
+                    return None
+                index[signature] = len(states)
+                states.append(next_state)
+            row.append(index[signature])
+        transitions.append(row)
+    return states, transitions
+
+
+class ConstraintTable:
+    """
+    Compiles the constraint states of a batch into dense tables, so that the
+    states of a whole beam can be tracked as an integer tensor.
+
+    The states reachable from the start state of each sentence are
+    enumerated once, and numbered consecutively across the batch. Tokens
+    that do not occur in any constraint behave alike, so they share column
+    0 of the transition table; every constraint token has its own column.
+
+    Attributes:
+        transitions: (num states, num columns) the state reached from each
+            state by a token of each column
+        token_columns: (max token + 2) the column of each token; larger
+            tokens are mapped to the last entry, i.e. column 0
+        banks: (num states) the bank of each state
+        finished: (num states) whether each state has met all constraints
+        next_tokens: (num states, max next tokens) the tokens that advance
+            each state, padded with -1
+        roots: (batch size) the start state of each sentence
+    """
+
+    # the extra token that stands for those outside of the constraints
+    OTHER = -1
+
+    def __init__(self, transitions, token_columns, banks, finished, next_tokens, roots):
+        self.transitions = transitions
+        self.token_columns = token_columns
+        self.banks = banks
+        self.finished = finished
+        self.next_tokens = next_tokens
+        self.roots = roots
+        self.max_bank = int(banks.max()) if banks.numel() > 0 else 0
+
+    @staticmethod
+    def create(
+        batch_constraints: torch.Tensor, representation: str, max_states: int = 10000
+    ) -> Optional["ConstraintTable"]:
+        """Compiles the packed *batch_constraints* (see :func:`pack_constraints`).
+        Returns None if a sentence has more than *max_states* states."""
+        columns = {}
+        sentences = []
+        for constraint_tensor in batch_constraints.cpu():
+            if representation == "ordered":
+                root = OrderedConstraintState.create(constraint_tensor)
+            elif representation == "unordered":
+                root = UnorderedConstraintState.create(constraint_tensor)
+            else:
+                raise ValueError(f"unknown constraint representation {representation}")
+            tokens = sorted(set(int(token) for token in root.tokens))
+            for token in tokens:
+                columns.setdefault(token, len(columns) + 1)
+            enumerated = _enumerate_states(root, [ConstraintTable.OTHER] + tokens, max_states)
+            if enumerated is None:
+                return None
+            sentences.append((tokens, enumerated))
+
+        num_columns = len(columns) + 1
+        transitions, banks, finished, next_tokens, roots = [], [], [], [], []
+        for tokens, (states, rows) in sentences:
+            offset = len(banks)
+            roots.append(offset)
+            for state, row in zip(states, rows):
+                # tokens outside of this sentence's constraints go to column 0
+                global_row = [offset + row[0]] * num_columns
+                for i, token in enumerate(tokens):
+                    global_row[columns[token]] = offset + row[i + 1]
+                transitions.append(global_row)
+                banks.append(state.bank)
+                finished.append(state.finished)
+                next_tokens.append(sorted(int(t) for t in state.next_tokens()))
+
+        max_next = max([len(t) for t in next_tokens] + [1])
+        token_columns = torch.zeros(max(columns.keys(), default=-1) + 2).long()
+        for token, column in columns.items():
+            token_columns[token] = column
+        return ConstraintTable(
+            torch.tensor(transitions).long().view(-1, num_columns),
+            token_columns,
+            torch.tensor(banks).long(),
+            torch.tensor(finished).bool(),
+            torch.tensor(
+                [t + [-1] * (max_next - len(t)) for t in next_tokens]
+            ).long().view(-1, max_next),
+            torch.tensor(roots).long(),
+        ).to(batch_constraints.device)
+
+    @property
+    def num_states(self):
+        return self.banks.size(0)
+
+    def to(self, device) -> "ConstraintTable":
+        return ConstraintTable(
+            self.transitions.to(device),
+            self.token_columns.to(device),
+            self.banks.to(device),
+            self.finished.to(device),
+            self.next_tokens.to(device),
+            self.roots.to(device),
+        )
+
+    def advance(self, states: torch.Tensor, tokens: torch.Tensor) -> torch.Tensor:
+        """The states reached from *states* by reading *tokens*, elementwise."""
+        columns = self.token_columns[tokens.clamp(max=self.token_columns.size(0) - 1)]
+        return self.transitions[states, columns]
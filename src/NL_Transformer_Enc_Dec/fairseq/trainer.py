@@ -17,9 +17,11 @@ from typing import Any, Dict, List
 
 import torch
 from fairseq import checkpoint_utils, models, optim, utils
+from fairseq.checkpoint_writer import AsyncCheckpointWriter, snapshot_to_cpu
 from fairseq.dataclass.configs import FairseqConfig
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
 from fairseq.distributed import utils as distributed_utils
+from fairseq.ema import ModelEMA
 from fairseq.file_io import PathManager
 from fairseq.logging import meters, metrics
 from fairseq.nan_detector import NanDetector
@@ -39,6 +41,10 @@ class Trainer(object):
     are accumulated across workers before each update. We use
     :class:`~torch.nn.parallel.DistributedDataParallel` to handle
     communication of the gradients across workers.
+
+    The DL and NL criteria return a dict of the loss of every path, with the
+    total loss under ``"loss"``, so the same trainer runs single-path and
+    multi-path training.
     """
 
     def __init__(self, cfg: FairseqConfig, task, model, criterion, quantizer=None):
@@ -74,6 +80,10 @@ class Trainer(object):
                     "FullyShardedDataParallel is not compatible with --zero-sharding "
                     "option (it's already built in)"
                 )
+            if self.cfg.checkpoint.store_ema:
+                raise ValueError(
+                    "FullyShardedDataParallel is not compatible with --store-ema"
+                )
         else:
             if self.cfg.distributed_training.cpu_offload:
                 raise ValueError("--cpu-offload requires --ddp-backend=fully_sharded")
@@ -112,7 +122,9 @@ class Trainer(object):
                 )
                 _set_module_by_path(self._model, path, ref)
 
+        self._checkpoint_writer = None
         self._dummy_batch = None  # indicates we don't have a dummy batch at first
+        self._ema = None
         self._lr_scheduler = None
         self._num_updates = 0
         self._num_xla_compiles = 0  # for TPUs
@@ -365,6 +377,13 @@ class Trainer(object):
                 }
             ],
             "task_state": self.task.state_dict() if self.task is not None else {},
+            "ema": (
+                {
+                    "model": self._ema.state_dict(self.get_model()),
+                    "count": self._ema.count,
+                }
+                if self._ema is not None else None
+            ),
             "extra_state": {
                 "metrics": metrics.state_dict(),
                 "previous_training_time": self.cumulative_training_time(),
@@ -378,20 +397,48 @@ class Trainer(object):
                 state_dict["last_optimizer_state"] = self.optimizer.state_dict()
         return state_dict
 
-    def save_checkpoint(self, filename, extra_state):
-        """Save all training state in a checkpoint file."""
+    def save_checkpoint(self, filename, extra_state, aliases=()):
+        """Save all training state in a checkpoint file, and link the
+        *aliases* to it.
+
+        With --write-checkpoints-asynchronously, the state is only copied to
+        CPU here and the file is written by a background thread.
+        """
         logger.info(f"Saving checkpoint to {filename}")
+        write_async = self.cfg.checkpoint.write_checkpoints_asynchronously
         # call state_dict on all ranks in case it needs internal communication
-        state_dict = utils.move_to_cpu(self.state_dict())
+        if write_async:
+            state_dict = snapshot_to_cpu(self.state_dict())
+        else:
+            state_dict = utils.move_to_cpu(self.state_dict())
         state_dict["extra_state"].update(extra_state)
         if self.should_save_checkpoint_on_current_rank:
-            checkpoint_utils.torch_persistent_save(
-                state_dict,
-                filename,
-                async_write=self.cfg.checkpoint.write_checkpoints_asynchronously,
-            )
+            if write_async:
+                if self._checkpoint_writer is None:
+                    self._checkpoint_writer = AsyncCheckpointWriter(
+                        self.cfg.checkpoint.max_pending_checkpoint_writes
+                    )
+                self._checkpoint_writer.submit(state_dict, [filename] + list(aliases))
+                logger.info(f"Queued checkpoint {filename} for writing")
+                return
+            checkpoint_utils.torch_persistent_save(state_dict, filename)
+            for alias in aliases:
+                checkpoint_utils.link_checkpoint(filename, alias)
         logger.info(f"Finished saving checkpoint to {filename}")
 
+    def after_checkpoint_writes(self, fn):
+        """Call *fn* once the checkpoints saved so far are written."""
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.submit(None, [], callback=fn)
+        else:
+            fn()
+
+    def close_checkpoint_writer(self):
+        """Wait for the asynchronous checkpoint writes to finish."""
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.close()
+            self._checkpoint_writer = None
+
     def load_checkpoint(
         self,
         filename,
@@ -476,6 +523,18 @@ class Trainer(object):
             extra_state = state["extra_state"]
             self._optim_history = state["optimizer_history"]
 
+            # the average belongs to the training run, like the optimizer state
+            if (
+                self.cfg.checkpoint.store_ema
+                and state.get("ema") is not None
+                and not reset_optimizer
+            ):
+                self._ema = self._build_ema()
+                self._ema.load_state_dict(state["ema"]["model"], state["ema"]["count"])
+                logger.info(
+                    "loaded the average of {} updates".format(self._ema.count)
+                )
+
         if last_optim_state is not None and not reset_optimizer:
             # rebuild optimizer after loading model, since params may have changed
             self._build_optimizer()
@@ -568,8 +627,10 @@ class Trainer(object):
             )
 
             if load_on_all_ranks or self.data_parallel_rank == 0:
+                # the optimizer state is not needed when it is reset, so
+                # only the model weights are read
                 state = checkpoint_utils.load_checkpoint_to_cpu(
-                    filename, load_on_all_ranks=load_on_all_ranks
+                    filename, load_on_all_ranks=load_on_all_ranks, lazy=reset_optimizer
                 )
                 last_optim_state = state.get("last_optimizer_state", None)
                 if last_optim_state == -1:
@@ -604,7 +665,11 @@ class Trainer(object):
             # load model parameters            
             try:
                 self.model.load_state_dict_naive(
-                    state["model"], strict=True, model_cfg=self.cfg.model, layer_init =layer_init
+                    state["model"],
+                    strict=True,
+                    model_cfg=self.cfg.model,
+                    layer_init=layer_init,
+                    verify=self.cfg.checkpoint.verify_layer_initialization,
                 )
                 # save memory for later steps
                 del state["model"]
@@ -720,6 +785,7 @@ class Trainer(object):
             epoch=epoch,
             data_buffer_size=self.cfg.dataset.data_buffer_size,
             disable_iterator_cache=disable_iterator_cache,
+            prefetch_device=self._prefetch_device(),
         )
         self.reset_dummy_batch(batch_iterator.first_batch)
         return batch_iterator
@@ -749,10 +815,22 @@ class Trainer(object):
             epoch=1,
             data_buffer_size=self.cfg.dataset.data_buffer_size,
             disable_iterator_cache=disable_iterator_cache,
+            prefetch_device=self._prefetch_device(),
         )
         self.reset_dummy_batch(batch_iterator.first_batch)
         return batch_iterator
 
+    def _prefetch_device(self):
+        """Device the batch iterators copy the batches to ahead of their use
+        with --prefetch-to-device, or None."""
+        if (
+            self.cfg.dataset.prefetch_to_device
+            and self.cuda
+            and not self.pipeline_model_parallel
+        ):
+            return torch.device("cuda", torch.cuda.current_device())
+        return None
+
     def begin_epoch(self, epoch):
         """Called at the beginning of each epoch."""
         logger.info("begin training epoch {}".format(epoch))
@@ -777,6 +855,37 @@ class Trainer(object):
         # task specific setup per validation epoch
         self.task.begin_valid_epoch(epoch, self.get_model())
 
+    def validation_weights(self):
+        """Context manager in which the model holds the weights to validate,
+        the averaged ones with --validate-with-ema."""
+        if self._ema is not None and self.cfg.checkpoint.validate_with_ema:
+            return self._ema.averaged_weights()
+        return contextlib.ExitStack()
+
+    def _build_ema(self):
+        return ModelEMA(
+            self.get_model(),
+            decay=self.cfg.checkpoint.ema_decay,
+            uniform=self.cfg.checkpoint.ema_type == "uniform",
+            device=torch.device("cpu") if self.cfg.checkpoint.ema_cpu else None,
+        )
+
+    def _update_ema(self):
+        """Add the weights to the average every --ema-update-freq updates
+        from --ema-start-update on."""
+        if not self.cfg.checkpoint.store_ema:
+            return
+        num_updates = self.get_num_updates()
+        if (
+            num_updates < self.cfg.checkpoint.ema_start_update
+            or num_updates % self.cfg.checkpoint.ema_update_freq != 0
+        ):
+            return
+        if self._ema is None:
+            self._ema = self._build_ema()
+        else:
+            self._ema.update()
+
     def reset_dummy_batch(self, batch):
         self._dummy_batch = batch
 
@@ -821,6 +930,8 @@ class Trainer(object):
                         update_num=self.get_num_updates(),
                         ignore_grad=is_dummy_batch,
                     )
+                    # the per-path losses of multi-path criteria are in the
+                    # logging output as well
                     del loss
 
                 logging_outputs.append(logging_output)
@@ -971,6 +1082,7 @@ class Trainer(object):
         logging_output = None
         if not overflow or self.cfg.distributed_training.ddp_backend == "slow_mo":
             self.set_num_updates(self.get_num_updates() + 1)
+            self._update_ema()
 
             if self.tpu:
                 import torch_xla.core.xla_model as xm
@@ -1427,6 +1539,13 @@ class Trainer(object):
 
         with metrics.aggregate() as agg:
             if logging_outputs is not None:
+                if (
+                    not self.tpu
+                    and self.get_criterion().logging_outputs_can_be_summed()
+                ):
+                    # sum all the keys at once, so that the meters hold
+                    # Python numbers and reading them does not sync per key
+                    logging_outputs = [utils.sum_logging_outputs(logging_outputs)]
                 self.task.reduce_metrics(logging_outputs, self.get_criterion())
                 del logging_outputs
 
@@ -0,0 +1,194 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Cache of generated hypotheses, so that repeated source sentences are not
+translated again. Used by :mod:`fairseq_cli.interactive` and
+:class:`fairseq.hub_utils.GeneratorHubInterface`.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint_models(models):
+    """Hash of the weights of an ensemble, identifying it across runs."""
+    h = hashlib.sha1()
+    for model in models:
+        for name, tensor in sorted(model.state_dict().items()):
+            h.update(name.encode("utf-8"))
+            h.update(str(tuple(tensor.shape)).encode("utf-8"))
+            tensor = tensor.detach().cpu().contiguous().view(-1)
+            if tensor.dtype == torch.bfloat16:
+                # numpy has no bfloat16
+                tensor = tensor.view(torch.int16)
+            h.update(tensor.numpy().tobytes())
+    return h.hexdigest()
+
+
+def fingerprint_config(cfg):
+    """Hash of a generation config given as a dict, Namespace or DictConfig."""
+    from omegaconf import DictConfig, OmegaConf
+
+    if isinstance(cfg, DictConfig):
+        cfg = OmegaConf.to_container(cfg, resolve=True)
+    elif not isinstance(cfg, dict):
+        cfg = vars(cfg)
+    return hashlib.sha1(
+        json.dumps(cfg, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _hypos_to_cpu(hypos):
+    return [
+        {k: v.detach().cpu().clone() if torch.is_tensor(v) else v for k, v in hypo.items()}
+        for hypo in hypos
+    ]
+
+
+def _hypos_nbytes(hypos):
+    return sum(
+        v.numel() * v.element_size()
+        for hypo in hypos
+        for v in hypo.values()
+        if torch.is_tensor(v)
+    )
+
+
+class TranslationCache(object):
+    """Bounded LRU cache of the hypotheses generated for source sentences.
+
+    Entries are keyed by (model id, generation config hash, binarized source
+    tokens), so a cached translation is only returned for the same model and
+    generation settings. The in-memory tier evicts the least recently used
+    entries beyond *max_entries* entries or *max_bytes* bytes of tensors.
+    When *path* is given, every entry is also written to an SQLite file
+    there, which later runs read entries back from.
+
+    Returned hypotheses are copies, so callers may modify them in place.
+
+    Args:
+        model_id (str): identifies the model, see :func:`fingerprint_models`
+        max_entries (int, optional): maximum number of in-memory entries
+            (default: 10000)
+        max_bytes (int, optional): maximum size of the in-memory tensors,
+            0 for no limit (default: 0)
+        path (str, optional): file of the persistent tier (default: none)
+    """
+
+    # entries written to disk between two commits
+    commit_interval = 64
+
+    def __init__(self, model_id, max_entries=10000, max_bytes=0, path=None):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        self.uncommitted = 0
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, hypos BLOB)"
+            )
+            self.db.commit()
+
+    def key(self, src_tokens, config_hash):
+        prefix = "{}:{}:".format(self.model_id, config_hash).encode("utf-8")
+        return hashlib.sha1(
+            prefix + src_tokens.detach().cpu().long().numpy().tobytes()
+        ).hexdigest()
+
+    def get(self, src_tokens, config_hash):
+        """Hypotheses cached for *src_tokens* (1-D, without padding) under
+        the generation settings *config_hash*, or None."""
+        key = self.key(src_tokens, config_hash)
+        with self.lock:
+            hypos = self.entries.get(key)
+            if hypos is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return _hypos_to_cpu(hypos)
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT hypos FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    hypos = torch.load(io.BytesIO(row[0]))
+                    self._insert(key, hypos)
+                    self.disk_hits += 1
+                    return _hypos_to_cpu(hypos)
+            self.misses += 1
+            return None
+
+    def put(self, src_tokens, config_hash, hypos):
+        """Cache the *hypos* generated for *src_tokens* under *config_hash*."""
+        key = self.key(src_tokens, config_hash)
+        hypos = _hypos_to_cpu(hypos)
+        with self.lock:
+            self._insert(key, hypos)
+            if self.db is not None:
+                buffer = io.BytesIO()
+                torch.save(hypos, buffer)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?)",
+                    (key, sqlite3.Binary(buffer.getvalue())),
+                )
+                self.uncommitted += 1
+                if self.uncommitted >= self.commit_interval:
+                    self.db.commit()
+                    self.uncommitted = 0
+
+    def _insert(self, key, hypos):
+        if key in self.entries:
+            self.nbytes -= _hypos_nbytes(self.entries.pop(key))
+        self.entries[key] = hypos
+        self.nbytes += _hypos_nbytes(hypos)
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries
+            or (self.max_bytes > 0 and self.nbytes > self.max_bytes)
+        ):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= _hypos_nbytes(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def flush(self):
+        """Commit the entries not yet committed to the persistent tier."""
+        with self.lock:
+            if self.db is not None and self.uncommitted > 0:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -311,6 +311,45 @@ def item(tensor):
     return tensor
 
 
+def sum_logging_outputs(logging_outputs):
+    """Sum every key over *logging_outputs*, as
+    ``sum(log.get(key, 0) for log in logging_outputs)`` does for one key.
+
+    The scalar tensors of all keys are stacked into one float64 tensor,
+    summed per key in a single op and copied to the CPU with one
+    synchronization, instead of one per key when the meters are read. The
+    sums are Python numbers (ints for integer tensors); other values are
+    summed as they are.
+    """
+    sums = {}
+    keys, values, is_int = [], [], {}
+    for log in logging_outputs:
+        for key, value in log.items():
+            if torch.is_tensor(value) and value.numel() == 1:
+                keys.append(key)
+                values.append(value.detach().reshape(()))
+                is_int[key] = is_int.get(key, True) and not (
+                    value.is_floating_point() or value.is_complex()
+                )
+            else:
+                sums[key] = sums.get(key, 0) + value
+    if len(values) == 0:
+        return sums
+
+    device = values[0].device
+    unique_keys = list(is_int.keys())
+    index = {key: i for i, key in enumerate(unique_keys)}
+    stacked = torch.stack([v.to(device=device, dtype=torch.float64) for v in values])
+    segments = torch.tensor([index[key] for key in keys], device=device)
+    totals = torch.zeros(len(unique_keys), dtype=torch.float64, device=device)
+    totals.index_add_(0, segments, stacked)
+    for key, total in zip(unique_keys, totals.tolist()):
+        if is_int[key]:
+            total = int(round(total))
+        sums[key] = sums.get(key, 0) + total
+    return sums
+
+
 def multi_tensor_total_norm(grads, chunk_size=2048 * 32) -> torch.Tensor:
     per_device_grads = {}
     norms = []
@@ -23,6 +23,7 @@ from fairseq import checkpoint_utils, distributed_utils, options, tasks, utils
 from fairseq.dataclass.configs import FairseqConfig
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
 from fairseq.token_generation_constraints import pack_constraints, unpack_constraints
+from fairseq.translation_cache import TranslationCache, fingerprint_config, fingerprint_models
 from fairseq_cli.generate import get_symbols_to_strip_from_output
 
 
@@ -199,6 +200,19 @@ def main(cfg: FairseqConfig):
             "NOTE: Constrained decoding currently assumes a shared subword vocabulary."
         )
 
+    cache = None
+    if cfg.interactive.cache_entries > 0:
+        if cfg.generation.constraints or cfg.generation.sampling:
+            logger.warning("the translation cache is disabled with --constraints or --sampling")
+        else:
+            cache = TranslationCache(
+                fingerprint_models(models),
+                max_entries=cfg.interactive.cache_entries,
+                max_bytes=cfg.interactive.cache_bytes,
+                path=cfg.interactive.cache_path,
+            )
+            config_hash = fingerprint_config(cfg.generation)
+
     if cfg.interactive.buffer_size > 1:
         logger.info("Sentence buffer size: %s", cfg.interactive.buffer_size)
     logger.info("NOTE: hypothesis and token scores are output in base 2")
@@ -206,7 +220,21 @@ def main(cfg: FairseqConfig):
     start_id = 0
     for inputs in buffered_read(cfg.interactive.input, cfg.interactive.buffer_size):
         results = []
-        for batch in make_batches(inputs, cfg, task, max_positions, encode_fn):
+        # positions in inputs of the lines to translate
+        input_ids = list(range(len(inputs)))
+        if cache is not None:
+            tokens, _ = task.get_interactive_tokens_and_lengths(inputs, encode_fn)
+            input_ids = []
+            for i, src_tokens_i in enumerate(tokens):
+                hypos = cache.get(src_tokens_i, config_hash)
+                if hypos is None:
+                    input_ids.append(i)
+                else:
+                    results.append(
+                        (start_id + i, src_tokens_i, hypos, {"constraints": [], "time": 0.0})
+                    )
+        lines = [inputs[i] for i in input_ids]
+        for batch in make_batches(lines, cfg, task, max_positions, encode_fn):
             bsz = batch.src_tokens.size(0)
             src_tokens = batch.src_tokens
             src_lengths = batch.src_lengths
@@ -235,9 +263,11 @@ def main(cfg: FairseqConfig):
             for i, (id, hypos) in enumerate(zip(batch.ids.tolist(), translations)):
                 src_tokens_i = utils.strip_pad(src_tokens[i], tgt_dict.pad())
                 constraints = list_constraints[i]
+                if cache is not None:
+                    cache.put(src_tokens_i, config_hash, hypos)
                 results.append(
                     (
-                        start_id + id,
+                        start_id + input_ids[id],
                         src_tokens_i,
                         hypos,
                         {
@@ -304,6 +334,9 @@ def main(cfg: FairseqConfig):
             time.time() - start_time, total_translate_time
         )
     )
+    if cache is not None:
+        logger.info("translation cache: {}".format(cache.stats()))
+        cache.close()
 
 
 def cli_main():
@@ -15,6 +15,7 @@ from collections import Counter
 from itertools import zip_longest
 from multiprocessing import Pool
 
+import numpy as np
 from fairseq import options, tasks, utils
 from fairseq.binarizer import Binarizer
 from fairseq.data import indexed_dataset
@@ -133,6 +134,13 @@ def main(args):
         input_file = "{}{}".format(
             input_prefix, ("." + lang) if lang is not None else ""
         )
+        if args.dataset_impl == "mmap":
+            merge_result(
+                binarize_mmap(args, input_file, vocab, output_prefix, lang, num_workers)
+            )
+            log_binary_dataset(lang, input_file, vocab, n_seq_tok, replaced)
+            return
+
         offsets = Binarizer.find_offsets(input_file, num_workers)
         pool = None
         if num_workers > 1:
@@ -175,6 +183,9 @@ def main(args):
 
         ds.finalize(dataset_dest_file(args, output_prefix, lang, "idx"))
 
+        log_binary_dataset(lang, input_file, vocab, n_seq_tok, replaced)
+
+    def log_binary_dataset(lang, input_file, vocab, n_seq_tok, replaced):
         logger.info(
             "[{}] {}: {} sents, {} tokens, {:.3}% replaced by {}".format(
                 lang,
@@ -353,6 +364,95 @@ def binarize(args, filename, vocab, output_prefix, lang, offset, end, append_eos
     return res
 
 
+# dictionary of the binarize_mmap() workers, inherited rather than sent with
+# every chunk
+_worker_vocab = None
+
+
+def _init_worker_vocab(vocab):
+    global _worker_vocab
+    _worker_vocab = vocab
+
+
+def _line_sizes(filename, offset, end):
+    return Binarizer.line_sizes(filename, offset=offset, end=end)
+
+
+def _binarize_chunk(filename, data_file, dtype, start, length, offset, end):
+    if length == 0:
+        return {"nseq": 0, "nunk": 0, "ntok": 0, "replaced": Counter()}
+    out = np.memmap(
+        data_file,
+        dtype=dtype,
+        mode="r+",
+        offset=start * np.dtype(dtype).itemsize,
+        shape=(length,),
+    )
+    res = Binarizer.binarize_into(filename, _worker_vocab, out, offset=offset, end=end)
+    out.flush()
+    del out
+    return res
+
+
+def binarize_mmap(args, filename, vocab, output_prefix, lang, num_workers):
+    """Binarize *filename* into an mmap dataset with *num_workers* processes.
+
+    A first pass over the chunks of the file counts the tokens of every
+    line, which gives the index and the size of the data file up front.
+    The second pass encodes the chunks in parallel, each written straight
+    into its own region of the data file, so nothing is merged afterwards.
+    """
+    offsets = Binarizer.find_offsets(filename, num_workers)
+    chunks = list(zip(offsets[:-1], offsets[1:]))
+    dtype = indexed_dataset.best_fitting_int_dtype(len(vocab))
+    data_file = dataset_dest_file(args, output_prefix, lang, "bin")
+
+    pool = None
+    if num_workers > 1:
+        pool = Pool(
+            processes=num_workers,
+            initializer=_init_worker_vocab,
+            initargs=(vocab,),
+        )
+    else:
+        _init_worker_vocab(vocab)
+
+    def run(fn, tasks):
+        if pool is None:
+            return [fn(*task) for task in tasks]
+        return pool.starmap(fn, tasks)
+
+    try:
+        sizes = run(_line_sizes, [(filename, start, end) for start, end in chunks])
+        lengths = [int(s.sum()) for s in sizes]
+        starts = np.cumsum([0] + lengths).tolist()
+        with open(data_file, "wb") as f:
+            f.truncate(starts[-1] * np.dtype(dtype).itemsize)
+        results = run(
+            _binarize_chunk,
+            [
+                (filename, data_file, dtype, starts[i], lengths[i], start, end)
+                for i, (start, end) in enumerate(chunks)
+            ],
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    with indexed_dataset.MMapIndexedDataset.Index.writer(
+        dataset_dest_file(args, output_prefix, lang, "idx"), dtype
+    ) as index:
+        index.write(np.concatenate(sizes))
+
+    res = {"nseq": 0, "nunk": 0, "ntok": 0, "replaced": Counter()}
+    for worker_result in results:
+        for k in ["nseq", "nunk", "ntok"]:
+            res[k] += worker_result[k]
+        res["replaced"].update(worker_result["replaced"])
+    return res
+
+
 def binarize_alignments(args, filename, parse_alignment, output_prefix, offset, end):
     ds = indexed_dataset.make_builder(
         dataset_dest_file(args, output_prefix, None, "bin"),
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3 -u
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Serve a trained model over localhost HTTP. The model stays loaded between
+requests and the sentences of concurrent requests are batched together.
+
+    curl -d '{"source": ["ein kleiner test ."]}' localhost:8080/translate
+    curl localhost:8080/metrics
+"""
+
+import ast
+import logging
+import math
+import os
+import sys
+from argparse import Namespace
+
+import numpy as np
+import torch
+from fairseq import checkpoint_utils, options, tasks, utils
+from fairseq.dataclass.configs import FairseqConfig
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+from fairseq.generation_server import MicroBatcher, make_http_server
+from fairseq_cli.generate import get_symbols_to_strip_from_output
+
+
+logging.basicConfig(
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    stream=sys.stdout,
+)
+logger = logging.getLogger("fairseq_cli.serve")
+
+
+def add_server_args(parser):
+    group = parser.add_argument_group("Server")
+    group.add_argument("--host", default="localhost",
+                       help="address the server listens on")
+    group.add_argument("--port", type=int, default=8080,
+                       help="port the server listens on")
+    group.add_argument("--max-latency-ms", type=float, default=10.0,
+                       help="longest time a request waits for others to join its batch")
+    return group
+
+
+def main(cfg: FairseqConfig, host="localhost", port=8080, max_latency_ms=10.0):
+    if isinstance(cfg, Namespace):
+        cfg = convert_namespace_to_omegaconf(cfg)
+
+    utils.import_user_module(cfg.common)
+
+    assert (
+        not cfg.generation.sampling or cfg.generation.nbest == cfg.generation.beam
+    ), "--sampling requires --nbest to be equal to --beam"
+    assert not cfg.generation.constraints, "the server does not support --constraints"
+
+    logger.info(cfg)
+
+    # Fix seed for stochastic decoding
+    if cfg.common.seed is not None and not cfg.generation.no_seed_provided:
+        np.random.seed(cfg.common.seed)
+        utils.set_torch_seed(cfg.common.seed)
+
+    use_cuda = torch.cuda.is_available() and not cfg.common.cpu
+
+    # Setup task, e.g., translation
+    task = tasks.setup_task(cfg.task)
+
+    # Load ensemble
+    overrides = ast.literal_eval(cfg.common_eval.model_overrides)
+    logger.info("loading model(s) from {}".format(cfg.common_eval.path))
+    models, _model_args = checkpoint_utils.load_model_ensemble(
+        utils.split_paths(cfg.common_eval.path),
+        arg_overrides=overrides,
+        task=task,
+        suffix=cfg.checkpoint.checkpoint_suffix,
+        strict=(cfg.checkpoint.checkpoint_shard_count == 1),
+        num_shards=cfg.checkpoint.checkpoint_shard_count,
+    )
+
+    src_dict = task.source_dictionary
+    tgt_dict = task.target_dictionary
+
+    # Optimize ensemble for generation
+    for model in models:
+        if model is None:
+            continue
+        if cfg.common.fp16:
+            model.half()
+        if use_cuda and not cfg.distributed_training.pipeline_model_parallel:
+            model.cuda()
+        model.prepare_for_inference_(cfg)
+
+    generator = task.build_generator(models, cfg.generation)
+    extra_symbols_to_ignore = get_symbols_to_strip_from_output(generator)
+
+    # Handle tokenization and BPE
+    tokenizer = task.build_tokenizer(cfg.tokenizer)
+    bpe = task.build_bpe(cfg.bpe)
+
+    def encode_fn(x):
+        if tokenizer is not None:
+            x = tokenizer.encode(x)
+        if bpe is not None:
+            x = bpe.encode(x)
+        return x
+
+    def decode_fn(x):
+        if bpe is not None:
+            x = bpe.decode(x)
+        if tokenizer is not None:
+            x = tokenizer.decode(x)
+        return x
+
+    align_dict = utils.load_align_dict(cfg.generation.replace_unk)
+
+    max_positions = utils.resolve_max_positions(
+        task.max_positions(), *[model.max_positions() for model in models]
+    )
+    max_source_positions = (
+        max_positions[0] if isinstance(max_positions, tuple) else max_positions
+    )
+
+    def encode_line(line):
+        tokens = task.get_interactive_tokens_and_lengths([line], encode_fn)[0][0]
+        if max_source_positions is not None and tokens.numel() > max_source_positions:
+            raise ValueError(
+                "source has {} tokens, more than the {} the model accepts".format(
+                    tokens.numel(), max_source_positions
+                )
+            )
+        return tokens
+
+    def generate_batch(tokens_list):
+        dataset = task.build_dataset_for_inference(
+            tokens_list, [t.numel() for t in tokens_list]
+        )
+        sample = dataset.collater([dataset[i] for i in range(len(tokens_list))])
+        if use_cuda:
+            sample = utils.move_to_cuda(sample)
+        translations = task.inference_step(generator, models, sample)
+        # the collater sorts the batch by length, "id" maps it back
+        outputs = [None] * len(tokens_list)
+        for id, hypos in zip(sample["id"].tolist(), translations):
+            outputs[id] = [
+                {
+                    "tokens": hypo["tokens"].int().cpu(),
+                    "score": hypo["score"].item(),
+                    "alignment": hypo["alignment"],
+                    "positional_scores": hypo["positional_scores"].cpu(),
+                }
+                for hypo in hypos[: cfg.generation.nbest]
+            ]
+        return outputs
+
+    def decode_output(line, hypos):
+        src_str = line
+        results = []
+        for hypo in hypos:
+            _, hypo_str, _ = utils.post_process_prediction(
+                hypo_tokens=hypo["tokens"],
+                src_str=src_str,
+                alignment=hypo["alignment"],
+                align_dict=align_dict,
+                tgt_dict=tgt_dict,
+                remove_bpe=cfg.common_eval.post_process,
+                extra_symbols_to_ignore=extra_symbols_to_ignore,
+            )
+            results.append(
+                {
+                    "hypothesis": decode_fn(hypo_str),
+                    # convert to base 2, as fairseq-interactive does
+                    "score": hypo["score"] / math.log(2),
+                    "positional_scores": hypo["positional_scores"].div(math.log(2)).tolist(),
+                }
+            )
+        return results
+
+    batcher = MicroBatcher(
+        generate_batch,
+        max_tokens=cfg.dataset.max_tokens,
+        max_sentences=cfg.dataset.batch_size,
+        max_latency=max_latency_ms / 1000,
+    )
+    server = make_http_server(batcher, encode_line, decode_output, host=host, port=port)
+    logger.info(
+        "serving {} on http://{}:{} (source dictionary: {} types)".format(
+            cfg.common_eval.path, host, server.server_address[1], len(src_dict)
+        )
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        logger.info("final metrics: {}".format(batcher.metrics()))
+
+
+def cli_main():
+    parser = options.get_interactive_generation_parser()
+    add_server_args(parser)
+    args = options.parse_args_and_arch(parser)
+    main(
+        convert_namespace_to_omegaconf(args),
+        host=args.host,
+        port=args.port,
+        max_latency_ms=args.max_latency_ms,
+    )
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -12,6 +12,7 @@ import logging
 import math
 import os
 import sys
+import time
 from typing import Dict, Optional, Any, List, Tuple, Callable
 
 import numpy as np
@@ -28,7 +29,6 @@ from fairseq.data.plasma_utils import PlasmaStore
 from fairseq.dataclass.configs import FairseqConfig
 from fairseq.dataclass.utils import convert_namespace_to_omegaconf
 from fairseq.distributed import fsdp_enable_wrap, fsdp_wrap, utils as distributed_utils
-from fairseq.file_io import PathManager
 from fairseq.logging import meters, metrics, progress_bar
 from fairseq.model_parallel.megatron_trainer import MegatronTrainer
 from fairseq.trainer import Trainer
@@ -72,16 +72,6 @@ def main(cfg: FairseqConfig) -> None:
     # Print args
     logger.info(cfg)
 
-    if cfg.checkpoint.write_checkpoints_asynchronously:
-        try:
-            import iopath  # noqa: F401
-        except ImportError:
-            logging.exception(
-                "Asynchronous checkpoint writing is specified but iopath is "
-                "not installed: `pip install iopath`"
-            )
-            return
-
     # Setup task, e.g., translation, language modeling, etc.
     task = tasks.setup_task(cfg.task)
 
@@ -208,14 +198,11 @@ def main(cfg: FairseqConfig) -> None:
     train_meter.stop()
     logger.info("done training in {:.1f} seconds".format(train_meter.sum))
 
-    # ioPath implementation to wait for all asynchronous file writes to complete.
+    # wait for the asynchronous checkpoint writes to finish
     if cfg.checkpoint.write_checkpoints_asynchronously:
-        logger.info(
-            "ioPath PathManager waiting for all asynchronous checkpoint "
-            "writes to finish."
-        )
-        PathManager.async_close()
-        logger.info("ioPath PathManager finished waiting.")
+        logger.info("waiting for the asynchronous checkpoint writes to finish")
+        trainer.close_checkpoint_writer()
+        logger.info("finished waiting")
 
 
 def should_stop_early(cfg: DictConfig, valid_loss: float) -> bool:
@@ -298,11 +285,22 @@ def train(
     should_stop = False
     num_updates = trainer.get_num_updates()
     logger.info("Start iterating over samples")
+    step_end = time.perf_counter()
     for i, samples in enumerate(progress):
+        # time spent waiting for the batches of the update; a large share of
+        # the update time means training is data-bound
+        input_wait = time.perf_counter() - step_end
         with metrics.aggregate("train_inner"), torch.autograd.profiler.record_function(
             "train_step-%d" % i
         ):
+            step_start = time.perf_counter()
             log_output = trainer.train_step(samples)
+            metrics.log_scalar(
+                "input_stall",
+                100 * input_wait / max(input_wait + time.perf_counter() - step_start, 1e-9),
+                priority=810,
+                round=1,
+            )
 
         if log_output is not None:  # not OOM, overflow, ...
             # log mid-epoch stats
@@ -322,6 +320,7 @@ def train(
 
         if should_stop:
             break
+        step_end = time.perf_counter()
 
     # log end-of-epoch stats
     logger.info("end of epoch {} (average epoch stats below)".format(epoch_itr.epoch))
@@ -434,56 +433,58 @@ def validate(
         # set fixed seed for every validation
         utils.set_torch_seed(cfg.dataset.fixed_validation_seed)
 
-    trainer.begin_valid_epoch(epoch_itr.epoch)
-    valid_losses = []
-    for subset in subsets:
-        logger.info('begin validation on "{}" subset'.format(subset))
+    # with --validate-with-ema, evaluate the averaged weights
+    with trainer.validation_weights():
+        trainer.begin_valid_epoch(epoch_itr.epoch)
+        valid_losses = []
+        for subset in subsets:
+            logger.info('begin validation on "{}" subset'.format(subset))
 
-        # Initialize data iterator
-        itr = trainer.get_valid_iterator(subset).next_epoch_itr(
-            shuffle=False, set_dataset_epoch=False  # use a fixed valid set
-        )
-        if cfg.common.tpu:
-            itr = utils.tpu_data_loader(itr)
-        progress = progress_bar.progress_bar(
-            itr,
-            log_format=cfg.common.log_format,
-            log_interval=cfg.common.log_interval,
-            epoch=epoch_itr.epoch,
-            prefix=f"valid on '{subset}' subset",
-            tensorboard_logdir=(
-                cfg.common.tensorboard_logdir
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
-            wandb_project=(
-                cfg.common.wandb_project
-                if distributed_utils.is_master(cfg.distributed_training)
-                else None
-            ),
-            wandb_run_name=os.environ.get(
-                "WANDB_NAME", os.path.basename(cfg.checkpoint.load_model_dir)
-            ),
-        )
+            # Initialize data iterator
+            itr = trainer.get_valid_iterator(subset).next_epoch_itr(
+                shuffle=False, set_dataset_epoch=False  # use a fixed valid set
+            )
+            if cfg.common.tpu:
+                itr = utils.tpu_data_loader(itr)
+            progress = progress_bar.progress_bar(
+                itr,
+                log_format=cfg.common.log_format,
+                log_interval=cfg.common.log_interval,
+                epoch=epoch_itr.epoch,
+                prefix=f"valid on '{subset}' subset",
+                tensorboard_logdir=(
+                    cfg.common.tensorboard_logdir
+                    if distributed_utils.is_master(cfg.distributed_training)
+                    else None
+                ),
+                default_log_format=("tqdm" if not cfg.common.no_progress_bar else "simple"),
+                wandb_project=(
+                    cfg.common.wandb_project
+                    if distributed_utils.is_master(cfg.distributed_training)
+                    else None
+                ),
+                wandb_run_name=os.environ.get(
+                    "WANDB_NAME", os.path.basename(cfg.checkpoint.load_model_dir)
+                ),
+            )
 
-        # create a new root metrics aggregator so validation metrics
-        # don't pollute other aggregators (e.g., train meters)
-        with metrics.aggregate(new_root=True) as agg:
-            for i, sample in enumerate(progress):
-                if cfg.dataset.max_valid_steps is not None and i > cfg.dataset.max_valid_steps:
-                    break
-                trainer.valid_step(sample)
+            # create a new root metrics aggregator so validation metrics
+            # don't pollute other aggregators (e.g., train meters)
+            with metrics.aggregate(new_root=True) as agg:
+                for i, sample in enumerate(progress):
+                    if cfg.dataset.max_valid_steps is not None and i > cfg.dataset.max_valid_steps:
+                        break
+                    trainer.valid_step(sample)
 
-        # log validation stats
-        stats = get_valid_stats(cfg, trainer, agg.get_smoothed_values())
+            # log validation stats
+            stats = get_valid_stats(cfg, trainer, agg.get_smoothed_values())
 
-        if hasattr(task, "post_validate"):
-            task.post_validate(trainer.get_model(), stats, agg)
+            if hasattr(task, "post_validate"):
+                task.post_validate(trainer.get_model(), stats, agg)
 
-        progress.print(stats, tag=subset, step=trainer.get_num_updates())
+            progress.print(stats, tag=subset, step=trainer.get_num_updates())
 
-        valid_losses.append(stats[cfg.checkpoint.best_checkpoint_metric])
+            valid_losses.append(stats[cfg.checkpoint.best_checkpoint_metric])
     return valid_losses
 
 
@@ -10,6 +10,7 @@ import os
 import re
 
 import torch
+from fairseq.checkpoint_utils import torch_load_lazily
 from fairseq.file_io import PathManager
 
 
@@ -73,6 +74,67 @@ def average_checkpoints(inputs):
     return new_state
 
 
+def _load_lazily(fpath):
+    """Loads a checkpoint with its tensors memory-mapped and without its
+    optimizer state, see :func:`fairseq.checkpoint_utils.torch_load_lazily`."""
+    state = torch_load_lazily(PathManager.get_local_path(fpath))
+    # only the model weights are needed
+    state.pop("last_optimizer_state", None)
+    return state
+
+
+def average_checkpoints_streaming(inputs):
+    """Same as :func:`average_checkpoints`, but in bounded memory.
+
+    The checkpoints are read one at a time, memory-mapped where the torch
+    version and the checkpoint format allow it, and only their "model"
+    weights are summed into float64 accumulators. At most one checkpoint is
+    held at a time, also when the loader falls back to a full load. The
+    optimizer state of the first checkpoint is dropped from the returned
+    dict.
+    """
+    params_keys = None
+    new_state = None
+    totals = collections.OrderedDict()
+    dtypes = {}
+    num_models = len(inputs)
+
+    for fpath in inputs:
+        state = _load_lazily(fpath)
+        model_params = state["model"]
+        model_params_keys = list(model_params.keys())
+        if params_keys is None:
+            params_keys = model_params_keys
+            # Copies over the settings from the first checkpoint
+            new_state = {k: v for k, v in state.items() if k != "model"}
+        elif params_keys != model_params_keys:
+            raise KeyError(
+                "For checkpoint {}, expected list of params: {}, "
+                "but found: {}".format(fpath, params_keys, model_params_keys)
+            )
+
+        for k in params_keys:
+            p = model_params[k]
+            if k not in totals:
+                totals[k] = torch.zeros(p.size(), dtype=torch.float64)
+                dtypes[k] = p.dtype
+            totals[k].add_(p)
+        del state, model_params
+
+    averaged_params = collections.OrderedDict()
+    for k in params_keys:
+        total, dtype = totals.pop(k), dtypes[k]
+        if dtype.is_floating_point:
+            dtype = torch.float32 if dtype == torch.float16 else dtype
+            averaged_params[k] = total.div_(num_models).to(dtype)
+        else:
+            averaged_params[k] = total.div_(num_models).floor_().to(dtype)
+        del total
+
+    new_state["model"] = averaged_params
+    return new_state
+
+
 def last_n_checkpoints(paths, n, update_based, upper_bound=None):
     assert len(paths) == 1
     path = paths[0]
@@ -119,6 +181,9 @@ def main():
                         'e.g., with --num-epoch-checkpoints=10 --checkpoint-upper-bound=50, checkpoints 41-50 would be averaged.'
                         'e.g., with --num-update-checkpoints=10 --checkpoint-upper-bound=50000, checkpoints 40500-50000 would be averaged assuming --save-interval-updates 500'
                         )
+    parser.add_argument('--streaming', action='store_true',
+                        help='memory-map the checkpoints and average one parameter at a time, in about one model\'s '
+                        'worth of memory; the optimizer state is not copied to the output')
     # fmt: on
     args = parser.parse_args()
     print(args)
@@ -148,7 +213,10 @@ def main():
         )
         print("averaging checkpoints: ", args.inputs)
 
-    new_state = average_checkpoints(args.inputs)
+    if args.streaming:
+        new_state = average_checkpoints_streaming(args.inputs)
+    else:
+        new_state = average_checkpoints(args.inputs)
     with PathManager.open(args.output, "wb") as f:
         torch.save(new_state, f)
     print("Finished writing averaged checkpoint to {}".format(args.output))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Time the CPU implementations of --no-repeat-ngram-size blocking, the
+vectorised one used by generation and the per-hypothesis loop it replaces,
+across beam sizes, and check that they ban the same tokens.
+"""
+
+import argparse
+import time
+
+import torch
+from fairseq.ngram_repeat_block import NGramRepeatBlock
+
+
+def time_fn(fn, repeats):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ngram-size", type=int, default=3)
+    parser.add_argument("--bsz", type=int, default=32)
+    parser.add_argument("--beam-sizes", default="1,2,4,5,8")
+    parser.add_argument("--step", type=int, default=50,
+                        help="decoding step, i.e. length of the hypotheses")
+    parser.add_argument("--max-len", type=int, default=200,
+                        help="width of the token buffer of the generator")
+    parser.add_argument("--vocab-size", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    blocker = NGramRepeatBlock(args.ngram_size, use_extension=False)
+
+    print("beam\tloop (ms)\tvectorised (ms)\tspeedup")
+    for beam_size in [int(b) for b in args.beam_sizes.split(",")]:
+        rows = args.bsz * beam_size
+        tokens = torch.ones(rows, args.max_len + 2, dtype=torch.long)
+        # a small vocabulary in the hypotheses so that ngrams do repeat
+        tokens[:, : args.step + 1] = torch.randint(4, 50, (rows, args.step + 1))
+        lprobs = torch.rand(rows, args.vocab_size)
+
+        expected = blocker._no_repeat_ngram_loop(
+            tokens, lprobs.clone(), args.bsz, beam_size, args.step
+        )
+        result = blocker._no_repeat_ngram(
+            tokens, lprobs.clone(), args.bsz, beam_size, args.step
+        )
+        assert torch.equal(result, expected), "implementations disagree"
+
+        loop_ms = time_fn(
+            lambda: blocker._no_repeat_ngram_loop(
+                tokens, lprobs.clone(), args.bsz, beam_size, args.step
+            ),
+            args.repeats,
+        )
+        vectorised_ms = time_fn(
+            lambda: blocker._no_repeat_ngram(
+                tokens, lprobs.clone(), args.bsz, beam_size, args.step
+            ),
+            args.repeats,
+        )
+        print(
+            "{}\t{:.2f}\t{:.2f}\t{:.1f}x".format(
+                beam_size, loop_ms, vectorised_ms, loop_ms / vectorised_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
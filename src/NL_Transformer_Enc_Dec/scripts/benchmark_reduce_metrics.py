@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Time the per-update logging of the NL criterion, with the logging outputs
+reduced key by key as before and summed at once by
+:func:`fairseq.utils.sum_logging_outputs` as the trainer now does, and
+check that they log the same values.
+"""
+
+import argparse
+import time
+
+import torch
+from fairseq import utils
+from fairseq.criterions.label_smoothed_cross_entropy import (
+    LabelSmoothedCrossEntropyCriterion_NL,
+)
+from fairseq.logging import metrics
+
+EVAL_BLEU_ORDER = 4
+
+
+def make_logging_outputs(num_outputs, device, bleu):
+    logging_outputs = []
+    for _ in range(num_outputs):
+        log = {
+            "ntokens": 4000,
+            "nsentences": 128,
+            "sample_size": 4000,
+        }
+        for key in ["loss", "loss_1", "loss_2", "loss_3"]:
+            log[key] = torch.rand((), device=device) * 1e4
+            log["nll_" + key] = torch.rand((), device=device) * 1e4
+        if bleu:
+            log["_bleu_sys_len"] = 3900
+            log["_bleu_ref_len"] = 4000
+            for i in range(EVAL_BLEU_ORDER):
+                log["_bleu_counts_" + str(i)] = torch.randint(4000, (), device=device)
+                log["_bleu_totals_" + str(i)] = torch.randint(4000, (), device=device)
+        logging_outputs.append(log)
+    return logging_outputs
+
+
+def reduce(logging_outputs, vectorised):
+    with metrics.aggregate(new_root=True) as agg:
+        if vectorised:
+            logging_outputs = [utils.sum_logging_outputs(logging_outputs)]
+        LabelSmoothedCrossEntropyCriterion_NL.reduce_metrics(logging_outputs)
+        for i in range(EVAL_BLEU_ORDER):
+            for key in ["_bleu_counts_", "_bleu_totals_"]:
+                value = sum(log.get(key + str(i), 0) for log in logging_outputs)
+                if torch.is_tensor(value):
+                    value = value.cpu()
+                metrics.log_scalar(key + str(i), value)
+        # the trainer reads the smoothed values after every update
+        return agg.get_smoothed_values()
+
+
+def time_fn(fn, repeats, cuda):
+    fn()  # warm up
+    if cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-outputs", default="1,8",
+                        help="logging outputs per update, e.g. 1 after the "
+                        "fast stat sync or one per batch with --update-freq")
+    parser.add_argument("--no-bleu", action="store_true",
+                        help="leave out the BLEU count keys")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--cpu", action="store_true")
+    args = parser.parse_args()
+
+    cuda = torch.cuda.is_available() and not args.cpu
+    device = torch.device("cuda" if cuda else "cpu")
+
+    print("outputs\tper key (ms)\tstacked (ms)\tspeedup")
+    for num_outputs in [int(n) for n in args.num_outputs.split(",")]:
+        logging_outputs = make_logging_outputs(num_outputs, device, not args.no_bleu)
+        expected = reduce(logging_outputs, vectorised=False)
+        result = reduce(logging_outputs, vectorised=True)
+        for key, value in expected.items():
+            assert abs(result[key] - value) <= 1e-3 * max(1.0, abs(value)), key
+
+        per_key_ms = time_fn(lambda: reduce(logging_outputs, False), args.repeats, cuda)
+        stacked_ms = time_fn(lambda: reduce(logging_outputs, True), args.repeats, cuda)
+        print(
+            "{}\t{:.3f}\t{:.3f}\t{:.1f}x".format(
+                num_outputs, per_key_ms, stacked_ms, per_key_ms / stacked_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
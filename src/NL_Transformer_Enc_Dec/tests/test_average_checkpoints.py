@@ -8,10 +8,15 @@ import os
 import shutil
 import tempfile
 import unittest
+import weakref
+from unittest import mock
 
 import numpy as np
 import torch
-from scripts.average_checkpoints import average_checkpoints
+from scripts.average_checkpoints import (
+    average_checkpoints,
+    average_checkpoints_streaming,
+)
 from torch import nn
 
 
@@ -129,6 +134,66 @@ class TestAverageCheckpoints(unittest.TestCase):
         )
         shutil.rmtree(tmpdir)
 
+    def test_average_checkpoints_streaming(self):
+        tmpdir = tempfile.mkdtemp()
+        paths = []
+        for i, value in enumerate([1.0, 2.0, 4.0]):
+            m = ModelWithSharedParameter()
+            nn.init.constant_(m.FC1.weight, value)
+            state = {
+                "model": m.state_dict(),
+                "step": torch.IntTensor([i]),
+                "last_optimizer_state": {"exp_avg": torch.ones(10)},
+            }
+            state["model"]["num_updates"] = torch.LongTensor([7 + i])
+            paths.append(os.path.join(tmpdir, "m{}.pt".format(i)))
+            torch.save(state, paths[-1])
+
+        expected = average_checkpoints(paths)
+        output = average_checkpoints_streaming(paths)
+        self.assertEqual(list(output["model"].keys()), list(expected["model"].keys()))
+        for k, v in expected["model"].items():
+            self.assertEqual(output["model"][k].dtype, v.dtype)
+            np.testing.assert_allclose(
+                output["model"][k].numpy(), v.numpy(), rtol=1e-6, err_msg=k
+            )
+        self.assertEqual(output["model"]["num_updates"].tolist(), [8])
+        self.assertTrue(torch.equal(output["step"], torch.IntTensor([0])))
+        self.assertNotIn("last_optimizer_state", output)
+        shutil.rmtree(tmpdir)
+
+    def test_average_checkpoints_streaming_eager_fallback(self):
+        tmpdir = tempfile.mkdtemp()
+        paths = []
+        for value in [1.0, 2.0, 4.0]:
+            m = ModelWithSharedParameter()
+            nn.init.constant_(m.FC1.weight, value)
+            paths.append(os.path.join(tmpdir, "m{}.pt".format(len(paths))))
+            torch.save({"model": m.state_dict()}, paths[-1])
+
+        torch_load = torch.load
+        loaded = []
+
+        def eager_load(*args, **kwargs):
+            # as torch versions without mmap support
+            if "mmap" in kwargs:
+                raise TypeError("load() got an unexpected keyword argument 'mmap'")
+            # only one checkpoint may be alive at a time
+            self.assertTrue(all(ref() is None for ref in loaded))
+            state = torch_load(*args, **kwargs)
+            loaded.append(weakref.ref(state["model"]))
+            return state
+
+        expected = average_checkpoints(paths)
+        with mock.patch("torch.load", side_effect=eager_load):
+            output = average_checkpoints_streaming(paths)
+        self.assertEqual(len(loaded), len(paths))
+        for k, v in expected["model"].items():
+            np.testing.assert_allclose(
+                output["model"][k].numpy(), v.numpy(), rtol=1e-6, err_msg=k
+            )
+        shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     unittest.main()
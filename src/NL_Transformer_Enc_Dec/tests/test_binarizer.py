@@ -0,0 +1,47 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+
+import torch
+from fairseq.binarizer import Binarizer
+from fairseq.data import Dictionary
+from fairseq.data.indexed_dataset import MMapIndexedDataset
+from fairseq_cli.preprocess import binarize_mmap
+
+
+class TestBinarizer(unittest.TestCase):
+    def test_binarize_mmap(self):
+        vocab = Dictionary()
+        for word in "a b c d".split():
+            vocab.add_symbol(word)
+        lines = ["a b c", "", "d d x", "b", "c a y z", "a"] * 5
+        with tempfile.TemporaryDirectory("test_binarize_mmap") as data_dir:
+            filename = os.path.join(data_dir, "train.in")
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            expected = []
+            expected_res = Binarizer.binarize(filename, vocab, expected.append)
+
+            args = Namespace(
+                destdir=data_dir, source_lang="in", target_lang="out", only_source=False
+            )
+            for num_workers in [1, 4]:
+                prefix = "train{}".format(num_workers)
+                res = binarize_mmap(args, filename, vocab, prefix, "in", num_workers)
+                self.assertEqual(res, expected_res)
+                dataset = MMapIndexedDataset(
+                    os.path.join(data_dir, prefix + ".in-out.in")
+                )
+                self.assertEqual(len(dataset), len(lines))
+                for item, ids in zip(dataset, expected):
+                    self.assertTrue(torch.equal(item, ids.long()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,7 +11,9 @@ import unittest
 from io import StringIO
 from unittest.mock import patch
 
+import torch
 from fairseq import checkpoint_utils
+from fairseq.checkpoint_writer import AsyncCheckpointWriter, snapshot_to_cpu
 from omegaconf import OmegaConf
 
 from tests.utils import (
@@ -101,6 +103,88 @@ class TestCheckpointUtils(unittest.TestCase):
                 mock_opena.assert_called_with(filename, "wb")
                 mock_save.assert_called()
 
+    def test_link_checkpoint(self):
+        with tempfile.TemporaryDirectory("test_link_checkpoint") as save_dir:
+            src = os.path.join(save_dir, "checkpoint1.pt")
+            dst = os.path.join(save_dir, "checkpoint_last.pt")
+            checkpoint_utils.torch_persistent_save({"step": 1}, src)
+            checkpoint_utils.link_checkpoint(src, dst)
+            self.assertEqual(torch.load(dst), {"step": 1})
+
+            # a later save replaces the alias without changing the first file
+            src_2 = os.path.join(save_dir, "checkpoint2.pt")
+            checkpoint_utils.torch_persistent_save({"step": 2}, src_2)
+            checkpoint_utils.link_checkpoint(src_2, dst)
+            self.assertEqual(torch.load(dst), {"step": 2})
+            self.assertEqual(torch.load(src), {"step": 1})
+            self.assertEqual(sorted(os.listdir(save_dir)), ["checkpoint1.pt", "checkpoint2.pt", "checkpoint_last.pt"])
+
+    def test_async_checkpoint_writer(self):
+        weight = torch.ones(3)
+        state = snapshot_to_cpu({"model": {"weight": weight, "tied": weight}, "step": 1})
+        # the snapshot is a copy that training can keep updating
+        weight.add_(1)
+        self.assertTrue(torch.equal(state["model"]["weight"], torch.ones(3)))
+        self.assertIs(state["model"]["weight"], state["model"]["tied"])
+
+        with tempfile.TemporaryDirectory("test_async_checkpoint_writer") as save_dir:
+            filenames = [os.path.join(save_dir, fn) for fn in ["checkpoint1.pt", "checkpoint_best.pt"]]
+            done = []
+            writer = AsyncCheckpointWriter(max_pending=1)
+            writer.submit(state, filenames)
+            writer.submit(None, [], callback=lambda: done.append(os.path.exists(filenames[1])))
+            writer.close()
+            self.assertEqual(done, [True])
+            for filename in filenames:
+                loaded = torch.load(filename)
+                self.assertEqual(loaded["step"], 1)
+                self.assertTrue(torch.equal(loaded["model"]["weight"], torch.ones(3)))
+
+    def test_load_checkpoint_to_cpu_lazily(self):
+        with tempfile.TemporaryDirectory("test_load_lazily") as save_dir:
+            filename = os.path.join(save_dir, "checkpoint1.pt")
+            checkpoint_utils.torch_persistent_save(
+                {
+                    "model": {"weight": torch.arange(4.0)},
+                    "optimizer_history": [{"num_updates": 1}],
+                    "last_optimizer_state": {"state": {0: torch.zeros(4)}},
+                    "extra_state": {"train_iterator": None},
+                },
+                filename,
+            )
+            state = checkpoint_utils.load_checkpoint_to_cpu(filename, lazy=True)
+            self.assertNotIn("last_optimizer_state", state)
+            self.assertTrue(torch.equal(state["model"]["weight"], torch.arange(4.0)))
+            state = checkpoint_utils.load_checkpoint_to_cpu(filename)
+            self.assertIn("last_optimizer_state", state)
+
+    def test_layer_init_key_map(self):
+        keys = [
+            "encoder.embed_tokens.weight",
+            "encoder.layers.0.fc1.weight",
+            "encoder.layers.1.fc1.weight",
+            "encoder.layers.2.fc1.weight",
+            "decoder.layers.0.fc1.weight",
+            "decoder.layers.1.fc1.weight",
+            "decoder.layers.2.fc1.weight",
+        ]
+        # a 2-layer model from layers 3 and 1 of a 3-layer one
+        key_map = checkpoint_utils.layer_init_key_map(keys, ["3", "1"])
+        self.assertEqual(
+            dict(key_map),
+            {
+                "encoder.embed_tokens.weight": "encoder.embed_tokens.weight",
+                "encoder.layers.0.fc1.weight": "encoder.layers.2.fc1.weight",
+                "encoder.layers.1.fc1.weight": "encoder.layers.0.fc1.weight",
+                "decoder.layers.0.fc1.weight": "decoder.layers.2.fc1.weight",
+                "decoder.layers.1.fc1.weight": "decoder.layers.0.fc1.weight",
+            },
+        )
+        self.assertEqual(
+            dict(checkpoint_utils.layer_init_key_map(keys, None)),
+            {key: key for key in keys},
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
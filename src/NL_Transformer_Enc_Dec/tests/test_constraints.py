@@ -7,6 +7,8 @@ import sys
 import unittest
 
 import torch
+from fairseq.data import Dictionary
+from fairseq.search import LexicallyConstrainedBeamSearch
 from fairseq.token_generation_constraints import *
 
 
@@ -265,5 +267,83 @@ class TestOrderedConstraintState(unittest.TestCase):
             ), f"TEST({tokens}) GOT: {result} WANTED: {expected}"
 
 
+class TestConstraintTable(unittest.TestCase):
+    def assert_matches_states(self, representation, sequences):
+        for constraints, tokens, expected in sequences:
+            packed = pack_constraints([constraints])
+            table = ConstraintTable.create(packed, representation)
+            if representation == "ordered":
+                state = OrderedConstraintState.create(packed[0])
+            else:
+                state = UnorderedConstraintState.create(packed[0])
+            index = table.roots
+            for token in tokens:
+                state = state.advance(token)
+                index = table.advance(index, torch.tensor([token]))
+                assert table.banks[index].item() == state.bank, f"TEST({tokens})"
+                assert table.finished[index].item() == state.finished, f"TEST({tokens})"
+                next_tokens = set(table.next_tokens[index].view(-1).tolist()) - {-1}
+                assert next_tokens == set(int(t) for t in state.next_tokens())
+            assert table.banks[index].item() == expected["bank"]
+            assert table.finished[index].item() == expected["finished"]
+
+    def test_unordered(self):
+        sequences = TestUnorderedConstraintState()
+        sequences.setUp()
+        self.assert_matches_states("unordered", sequences.sequences)
+
+    def test_ordered(self):
+        sequences = TestOrderedConstraintState()
+        sequences.setUp()
+        self.assert_matches_states("ordered", sequences.sequences)
+
+    def test_state_limit(self):
+        packed = pack_constraints([tensorize([[1, 2, 3], [1, 3], [4, 5]])])
+        self.assertIsNone(ConstraintTable.create(packed, "unordered", max_states=2))
+
+    def test_search_matches_per_sentence_search(self):
+        tgt_dict = Dictionary()
+        for i in range(20):
+            tgt_dict.add_symbol(str(i))
+        constraints = pack_constraints(
+            [tensorize([[5, 6, 7], [9]]), [], tensorize([[8, 8], [5]])]
+        )
+        bsz, beam_size, max_steps = 3, 3, 6
+        for representation in ["ordered", "unordered"]:
+            torch.manual_seed(0)
+            searches = [
+                LexicallyConstrainedBeamSearch(tgt_dict, representation),
+                # too few states to compile, so the ConstraintState objects are walked
+                LexicallyConstrainedBeamSearch(
+                    tgt_dict, representation, max_constraint_states=1
+                ),
+            ]
+            for search in searches:
+                search.init_constraints(constraints, beam_size)
+            self.assertIsNotNone(searches[0].constraint_table)
+            self.assertIsNone(searches[1].constraint_table)
+
+            scores = torch.zeros(bsz, beam_size, max_steps)
+            for step in range(max_steps):
+                lprobs = torch.randn(bsz, beam_size, len(tgt_dict)).log_softmax(-1)
+                (cand_scores, cand_indices, cand_beams), expected = [
+                    search.step(step, lprobs.clone(), scores) for search in searches
+                ]
+                self.assertTrue(torch.allclose(cand_scores, expected[0]))
+                self.assertTrue(torch.equal(cand_indices, expected[1]))
+                self.assertTrue(torch.equal(cand_beams, expected[2]))
+                active_hypos = torch.arange(beam_size).repeat(bsz, 1)
+                for search in searches:
+                    search.update_constraints(active_hypos)
+                scores[:, :, step] = cand_scores[:, :beam_size]
+                for sentno in range(bsz):
+                    self.assertEqual(
+                        searches[0].constraint_table.finished[
+                            searches[0].states[sentno]
+                        ].tolist(),
+                        [s.finished for s in searches[1].constraint_states[sentno]],
+                    )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+from fairseq.continuous_sequence_generator import ContinuousSequenceGenerator
+from fairseq.sequence_generator import SequenceGenerator
+
+from tests.test_transformer import mk_transformer, mk_transformer_NL
+
+
+def mk_batches(lengths_per_batch, pad=1, eos=2):
+    """Left-padded batches of random sources, as LanguagePairDataset collates them."""
+    torch.manual_seed(1)
+    batches, start = [], 0
+    for lengths in lengths_per_batch:
+        src_len = max(lengths)
+        src_tokens = torch.full((len(lengths), src_len), pad, dtype=torch.long)
+        for i, n in enumerate(lengths):
+            src_tokens[i, src_len - n : -1] = torch.randint(4, 100, (n - 1,))
+            src_tokens[i, -1] = eos
+        batches.append(
+            {
+                "id": torch.arange(start, start + len(lengths)),
+                "net_input": {
+                    "src_tokens": src_tokens,
+                    "src_lengths": torch.tensor(lengths),
+                },
+            }
+        )
+        start += len(lengths)
+    return batches
+
+
+class TestContinuousSequenceGenerator(unittest.TestCase):
+    def setUp(self):
+        # the first batch sets the budget; the three small ones are set aside
+        # at step 2 and merged, with different source and maximum lengths
+        self.batches = mk_batches([[8, 8, 7, 7], [3, 2], [5, 4], [2]])
+
+    def assertSameHypos(self, model):
+        model.eval()
+        generator = SequenceGenerator(
+            [model], model.decoder.dictionary, beam_size=2, max_len_a=1, max_len_b=3
+        )
+        expected = {}
+        for sample in self.batches:
+            hypos = generator.generate([model], sample)
+            expected.update(zip(sample["id"].tolist(), hypos))
+
+        continuous = ContinuousSequenceGenerator(generator, merge_interval=2, refill_ratio=1.0)
+        results = dict(continuous.generate(self.batches))
+        self.assertEqual(sorted(results), sorted(expected))
+        for sample_id, hypos in expected.items():
+            self.assertEqual(len(results[sample_id]), len(hypos))
+            for hypo, expected_hypo in zip(results[sample_id], hypos):
+                self.assertTrue(torch.equal(hypo["tokens"], expected_hypo["tokens"]))
+                self.assertTrue(
+                    torch.allclose(
+                        hypo["positional_scores"],
+                        expected_hypo["positional_scores"],
+                        atol=1e-4,
+                    )
+                )
+
+    def test_transformer(self):
+        self.assertSameHypos(mk_transformer())
+
+    def test_transformer_NL(self):
+        self.assertSameHypos(mk_transformer_NL())
+
+    def test_rejects_constraints(self):
+        model = mk_transformer()
+        generator = SequenceGenerator([model], model.decoder.dictionary)
+        generator.search.supports_constraints = True
+        with self.assertRaises(ValueError):
+            ContinuousSequenceGenerator(generator)
+
+
+if __name__ == "__main__":
+    unittest.main()
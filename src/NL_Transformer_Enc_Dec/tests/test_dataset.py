@@ -4,10 +4,26 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
+import tempfile
 import unittest
 from typing import Sequence
 
-from fairseq.data import LanguagePairDataset, ListDataset, RoundRobinZipDatasets
+import numpy as np
+import torch
+from fairseq.data import (
+    LanguagePairDataset,
+    ListDataset,
+    RoundRobinZipDatasets,
+    data_utils,
+)
+from fairseq.data.language_pair_dataset import collate
+from fairseq.data.indexed_dataset import (
+    MMapIndexedDataset,
+    MMapIndexedDatasetBuilder,
+    data_file_path,
+    index_file_path,
+)
 from tests.test_train import mock_dict
 
 
@@ -64,3 +80,109 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(dict(dataset[0]), {"a": sample(5, 7), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[2]), {"a": sample(0, 10), "b": sample(2, 9)})
         self.assertEqual(dict(dataset[4]), {"a": sample(6, 12), "b": sample(2, 9)})
+
+    def test_gathered_batch_matches_collate(self):
+        def build(prefix, lengths):
+            builder = MMapIndexedDatasetBuilder(data_file_path(prefix), dtype=np.uint16)
+            for length in lengths:
+                tokens = torch.randint(4, 100, (length,))
+                tokens[-1] = 2  # eos
+                builder.add_item(tokens)
+            builder.finalize(index_file_path(prefix))
+            return MMapIndexedDataset(prefix)
+
+        torch.manual_seed(0)
+        src_lengths, tgt_lengths = [5, 3, 8, 1, 6], [4, 7, 2, 5, 1]
+        with tempfile.TemporaryDirectory("test_gathered_batch") as data_dir:
+            src = build(os.path.join(data_dir, "src"), src_lengths)
+            tgt = build(os.path.join(data_dir, "tgt"), tgt_lengths)
+            for left_pad_target, pad_to_multiple in [(False, 1), (True, 8)]:
+                dataset = LanguagePairDataset(
+                    src,
+                    src.sizes,
+                    mock_dict(),
+                    tgt,
+                    tgt.sizes,
+                    mock_dict(),
+                    left_pad_target=left_pad_target,
+                    pad_to_multiple=pad_to_multiple,
+                )
+                indices = [3, 0, 4, 2]
+                expected = dataset.collater([dataset[i] for i in indices])
+                batch = dataset.collater(dataset.__getitems__(indices))
+                self.assertEqual(batch["ntokens"], expected["ntokens"])
+                for key in ["id", "target"]:
+                    self.assertTrue(torch.equal(batch[key], expected[key]))
+                for key, value in expected["net_input"].items():
+                    self.assertTrue(torch.equal(batch["net_input"][key], value), key)
+
+    def test_collate_matches_collate_tokens(self):
+        pad, eos = 1, 2
+
+        def sentence(length):
+            tokens = torch.randint(4, 100, (length,))
+            tokens[-1] = eos
+            return tokens
+
+        torch.manual_seed(0)
+        samples = [
+            {
+                "id": i,
+                "source": sentence(src_len),
+                "target": sentence(tgt_len),
+                "prev_output_tokens": sentence(tgt_len + 1),
+            }
+            for i, (src_len, tgt_len) in enumerate([(5, 4), (3, 7), (8, 2), (1, 5)])
+        ]
+        for left_pad_source, left_pad_target, pad_to_length, own_prev in [
+            (True, False, None, False),
+            (False, True, None, False),
+            (True, True, {"source": 10, "target": 9}, False),
+            (False, False, None, True),
+            (True, True, {"source": 10, "target": 9}, True),
+        ]:
+            batch_samples = [
+                {k: v for k, v in s.items() if own_prev or k != "prev_output_tokens"}
+                for s in samples
+            ]
+            batch = collate(
+                batch_samples,
+                pad,
+                eos,
+                left_pad_source=left_pad_source,
+                left_pad_target=left_pad_target,
+                pad_to_length=pad_to_length,
+                pad_to_multiple=4,
+            )
+
+            # the behaviour before the flat fill: pad, then reorder the rows
+            src_lengths = torch.LongTensor([s["source"].numel() for s in samples])
+            _, sort_order = src_lengths.sort(descending=True)
+
+            def merge(key, left_pad, move_eos_to_beginning=False, pad_to_length=None):
+                return data_utils.collate_tokens(
+                    [s[key] for s in samples],
+                    pad,
+                    eos,
+                    left_pad,
+                    move_eos_to_beginning,
+                    pad_to_length=pad_to_length,
+                    pad_to_multiple=4,
+                ).index_select(0, sort_order)
+
+            src_pad_to = pad_to_length["source"] if pad_to_length else None
+            tgt_pad_to = pad_to_length["target"] if pad_to_length else None
+            expected_src = merge("source", left_pad_source, pad_to_length=src_pad_to)
+            expected_tgt = merge("target", left_pad_target, pad_to_length=tgt_pad_to)
+            if own_prev:
+                expected_prev = merge("prev_output_tokens", left_pad_target)
+            else:
+                expected_prev = merge(
+                    "target", left_pad_target, True, pad_to_length=tgt_pad_to
+                )
+            self.assertTrue(torch.equal(batch["id"], sort_order))
+            self.assertTrue(torch.equal(batch["net_input"]["src_tokens"], expected_src))
+            self.assertTrue(torch.equal(batch["target"], expected_tgt))
+            self.assertTrue(
+                torch.equal(batch["net_input"]["prev_output_tokens"], expected_prev)
+            )
@@ -0,0 +1,87 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+from fairseq.ema import ModelEMA
+
+
+class TiedModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = torch.nn.Embedding(5, 3)
+        self.proj = torch.nn.Linear(3, 5, bias=False)
+        self.proj.weight = self.embed.weight
+        self.register_buffer("version", torch.tensor([2]))
+
+
+def set_weights(model, value):
+    with torch.no_grad():
+        model.embed.weight.fill_(value)
+
+
+class TestModelEMA(unittest.TestCase):
+    def test_exponential_average(self):
+        model = TiedModel()
+        set_weights(model, 1.0)
+        ema = ModelEMA(model, decay=0.5)
+        set_weights(model, 3.0)
+        ema.update()
+        set_weights(model, 5.0)
+        ema.update()
+        # 0.5 * (0.5 * 1 + 0.5 * 3) + 0.5 * 5
+        self.assertTrue(torch.allclose(ema.shadow[0], torch.full((5, 3), 3.5)))
+
+    def test_uniform_average(self):
+        model = TiedModel()
+        ema = None
+        for value in [1.0, 2.0, 6.0]:
+            set_weights(model, value)
+            if ema is None:
+                ema = ModelEMA(model, uniform=True)
+            else:
+                ema.update()
+        self.assertEqual(ema.count, 3)
+        self.assertTrue(torch.allclose(ema.shadow[0], torch.full((5, 3), 3.0)))
+
+    def test_half_weights_are_averaged_in_fp32(self):
+        model = TiedModel().half()
+        set_weights(model, 1.0)
+        ema = ModelEMA(model, decay=0.999)
+        ema.update()
+        self.assertEqual(ema.shadow[0].dtype, torch.float32)
+        self.assertTrue(torch.allclose(ema.shadow[0], torch.ones(5, 3)))
+
+    def test_averaged_weights_are_restored(self):
+        model = TiedModel()
+        set_weights(model, 1.0)
+        ema = ModelEMA(model, uniform=True)
+        set_weights(model, 3.0)
+        ema.update()
+        with ema.averaged_weights():
+            self.assertTrue(torch.equal(model.proj.weight, torch.full((5, 3), 2.0)))
+        self.assertTrue(torch.equal(model.proj.weight, torch.full((5, 3), 3.0)))
+
+    def test_state_dict_round_trip(self):
+        model = TiedModel()
+        set_weights(model, 1.0)
+        ema = ModelEMA(model, uniform=True)
+        set_weights(model, 3.0)
+        ema.update()
+        state_dict = ema.state_dict(model)
+        # a full state dict of the model, tied weights and buffers included
+        self.assertEqual(set(state_dict.keys()), set(model.state_dict().keys()))
+        self.assertTrue(torch.equal(state_dict["proj.weight"], torch.full((5, 3), 2.0)))
+        self.assertTrue(torch.equal(state_dict["version"], torch.tensor([2])))
+
+        restored = ModelEMA(model, uniform=True)
+        restored.load_state_dict(state_dict, ema.count)
+        self.assertEqual(restored.count, 2)
+        self.assertTrue(torch.equal(restored.shadow[0], ema.shadow[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
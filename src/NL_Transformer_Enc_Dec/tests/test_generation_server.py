@@ -0,0 +1,91 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import threading
+import unittest
+import urllib.request
+
+import torch
+from fairseq.generation_server import MicroBatcher, make_http_server
+
+
+class FakeGenerator(object):
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, tokens_list):
+        self.batches.append([t.numel() for t in tokens_list])
+        return [t.flip(0) for t in tokens_list]
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_concurrent_requests_are_batched(self):
+        generator = FakeGenerator()
+        batcher = MicroBatcher(generator, max_latency=0.2)
+        tokens_list = [torch.arange(n) for n in [3, 1, 2]]
+        outputs = batcher.generate(tokens_list, timeout=5)
+        batcher.close()
+        for tokens, output in zip(tokens_list, outputs):
+            self.assertTrue(torch.equal(output, tokens.flip(0)))
+        # one batch, sorted by length
+        self.assertEqual(generator.batches, [[1, 2, 3]])
+        metrics = batcher.metrics()
+        self.assertEqual(metrics["requests"], 3)
+        self.assertEqual(metrics["batches"], 1)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertIsNotNone(metrics["p99_ms"])
+
+    def test_batches_respect_the_token_budget(self):
+        batcher = MicroBatcher(FakeGenerator(), max_tokens=8, max_sentences=3, max_latency=0)
+        requests = [batcher.submit(torch.arange(n)) for n in [2, 2, 2, 2, 4, 4, 5]]
+        batcher.close()
+        batches = batcher.make_batches(requests)
+        self.assertEqual(
+            [[r.tokens.numel() for r in batch] for batch in batches],
+            [[2, 2, 2], [2, 4], [4], [5]],
+        )
+
+    def test_errors_are_returned_to_the_requests(self):
+        def fail(tokens_list):
+            raise RuntimeError("boom")
+
+        batcher = MicroBatcher(fail, max_latency=0)
+        request = batcher.submit(torch.arange(3))
+        with self.assertRaises(RuntimeError):
+            request.result(timeout=5)
+        batcher.close()
+
+
+class TestHTTPServer(unittest.TestCase):
+    def test_translate_and_metrics(self):
+        batcher = MicroBatcher(FakeGenerator(), max_latency=0.01)
+        server = make_http_server(
+            batcher,
+            lambda line: torch.tensor([int(w) for w in line.split()]),
+            lambda line, output: " ".join(str(i) for i in output.tolist()),
+            host="127.0.0.1",
+            port=0,
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+        try:
+            request = urllib.request.Request(
+                url + "/translate",
+                data=json.dumps({"source": ["1 2 3", "4 5"]}).encode("utf-8"),
+            )
+            with urllib.request.urlopen(request, timeout=5) as response:
+                self.assertEqual(json.load(response)["translations"], ["3 2 1", "5 4"])
+            with urllib.request.urlopen(url + "/metrics", timeout=5) as response:
+                self.assertEqual(json.load(response)["requests"], 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@
 
 import unittest
 
+import torch
 from fairseq.data import iterators
 
 
@@ -132,6 +133,22 @@ class TestIterators(unittest.TestCase):
         self.assertFalse(itr.has_next())
         self.assertRaises(StopIteration, next, buffered_itr)
 
+    @unittest.skipIf(not torch.cuda.is_available(), "test requires a GPU")
+    def test_device_prefetch_iterator(self):
+        device = torch.device("cuda", torch.cuda.current_device())
+        ref = [{"id": torch.tensor([i]), "net_input": {"len": i}} for i in range(6)]
+        prefetch_itr = iterators.DevicePrefetchIterator(ref, device)
+        itr = iterators.CountingIterator(prefetch_itr)
+        itr.take(4)
+        batch = next(itr)
+        self.assertTrue(batch["id"].is_cuda)
+        self.assertEqual(batch["id"].item(), 0)
+        self.assertEqual(batch["net_input"], {"len": 0})
+        # the next batch is fetched ahead, but not counted as consumed
+        self.assertEqual(itr.n, 1)
+        self.assertEqual([b["id"].item() for b in itr], [1, 2, 3])
+        self.assertRaises(StopIteration, next, prefetch_itr)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+from fairseq.path_sampling import PathSampler, parse_probs
+
+
+class TestPathSampler(unittest.TestCase):
+    def expected_loss(self, sampler, path_losses, draws=20000):
+        total = 0.0
+        for _ in range(draws):
+            paths, weights = sampler.sample()
+            total += sum(w * path_losses[p] for p, w in zip(paths, weights))
+        return total / draws
+
+    def test_estimates_are_unbiased(self):
+        torch.manual_seed(0)
+        path_losses = [1.0, 2.0, 6.0]
+        mean = sum(path_losses) / 3
+        for sampler in [
+            PathSampler(3, 1),
+            PathSampler(3, 2),
+            PathSampler(3, 2, mode="scheduled", probs=[0.6, 0.3, 0.1]),
+        ]:
+            self.assertAlmostEqual(self.expected_loss(sampler, path_losses), mean, delta=0.1)
+
+    def test_uniform_draws_distinct_paths(self):
+        sampler = PathSampler(3, 2)
+        for _ in range(10):
+            paths, weights = sampler.sample()
+            self.assertEqual(len(set(paths)), 2)
+            self.assertEqual(weights, [0.5, 0.5])
+        self.assertEqual(sum(sampler.visits), 20)
+
+    def test_scheduled_probs_are_annealed(self):
+        sampler = PathSampler(
+            3, 1, mode="scheduled", probs=[1.0, 0.0, 0.0], anneal_updates=100
+        )
+        self.assertEqual(sampler.probs(0), [1.0, 0.0, 0.0])
+        for p, q in zip(sampler.probs(50), [2 / 3, 1 / 6, 1 / 6]):
+            self.assertAlmostEqual(p, q)
+        for p in sampler.probs(1000):
+            self.assertAlmostEqual(p, 1 / 3)
+        self.assertEqual(sampler.sample(0)[0], [0])
+
+    def test_learned_probs_follow_the_losses(self):
+        sampler = PathSampler(3, 1, mode="learned", min_prob=0.0)
+        sampler.observe(0, 1.0)
+        sampler.observe(1, 3.0)
+        # the unseen path counts as the worst seen path
+        self.assertEqual(sampler.probs(), [1 / 7, 3 / 7, 3 / 7])
+
+    def test_learned_losses_are_moved_to_the_host_in_batches(self):
+        sampler = PathSampler(3, 1, mode="learned", min_prob=0.0, sync_every=2)
+        sampler.observe(0, torch.tensor(1.0))
+        self.assertEqual(sampler.loss_ema, [None, None, None])
+        sampler.observe(1, torch.tensor(3.0))
+        self.assertEqual(sampler.loss_ema, [1.0, 3.0, None])
+        sampler.observe(0, torch.tensor(2.0))
+        sampler.flush()
+        self.assertAlmostEqual(sampler.loss_ema[0], 0.99 * 1.0 + 0.01 * 2.0)
+
+    def test_parse_probs(self):
+        self.assertEqual(parse_probs("1,1,2", 3), [0.25, 0.25, 0.5])
+        self.assertIsNone(parse_probs(None, 3))
+        with self.assertRaises(ValueError):
+            parse_probs("1,1", 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
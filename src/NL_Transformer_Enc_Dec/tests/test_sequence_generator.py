@@ -424,6 +424,42 @@ class TestRepeatNgramBlocking(TestSequenceGeneratorBase):
         return cuda_ext_result, baseline_result
 
 
+class TestRepeatNgramBlockingCPU(TestSequenceGeneratorBase):
+    def test_finds_repetitive_tokens(self):
+        bsz, vocab_size, beam_size, step = 2, 4, 1, 3
+        generated_tok = torch.tensor([[2, 2, 2, 2], [3, 3, 3, 3]], dtype=torch.long)
+        lprobs = torch.zeros((beam_size * bsz, vocab_size))
+        desired_result = lprobs.new_tensor(
+            [[0.0, 0.0, -math.inf, 0.0], [0.0, 0.0, 0.0, -math.inf]]
+        )
+        blocker = NGramRepeatBlock(2, use_extension=False)
+        self.assertTensorEqual(
+            blocker(generated_tok, lprobs, bsz, beam_size, step), desired_result
+        )
+
+    def test_same_as_loop_implem(self):
+        torch.manual_seed(0)
+        bsz, vocab_size = 3, 6
+        for block_param in [1, 2, 3, 4]:
+            blocker = NGramRepeatBlock(block_param, use_extension=False)
+            for beam_size in [1, 2, 4]:
+                for step in range(8):
+                    generated_tok = torch.randint(
+                        0, vocab_size, (bsz * beam_size, step + 1)
+                    )
+                    # the generator passes its whole buffer, padded after the step
+                    generated_tok = torch.cat(
+                        [generated_tok, generated_tok.new_ones(bsz * beam_size, 2)],
+                        dim=1,
+                    )
+                    lprobs = torch.rand(bsz * beam_size, vocab_size)
+                    expected = blocker._no_repeat_ngram_loop(
+                        generated_tok, lprobs.clone(), bsz, beam_size, step
+                    )
+                    result = blocker(generated_tok, lprobs.clone(), bsz, beam_size, step)
+                    self.assertTensorEqual(result, expected)
+
+
 class TestDiverseBeamSearch(TestSequenceGeneratorBase):
     def setUp(self):
         # construct dummy dictionary
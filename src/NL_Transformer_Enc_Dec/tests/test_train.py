@@ -242,5 +242,46 @@ class TestLoadCheckpoint(unittest.TestCase):
             self.assertFalse(reset_meters)
 
 
+class TestPerPathLosses(unittest.TestCase):
+    def test_train_step_backward_of_the_total_loss(self):
+        from fairseq.tasks.fairseq_task import FairseqTask
+
+        losses = {
+            "loss": torch.tensor(3.0),
+            "loss_1": torch.tensor(1.0),
+            "loss_2": torch.tensor(2.0),
+        }
+        criterion = MagicMock(return_value=(losses, 4, {"ntokens": 4}))
+        optimizer = MagicMock()
+        task = FairseqTask(None)
+
+        loss, sample_size, logging_output = task.train_step(
+            {}, MagicMock(), criterion, optimizer, update_num=7
+        )
+        self.assertIs(loss, losses)
+        self.assertEqual(sample_size, 4)
+        self.assertEqual(logging_output, {"ntokens": 4})
+        criterion.set_num_updates.assert_called_once_with(7)
+        optimizer.backward.assert_called_once_with(losses["loss"])
+
+    def test_multi_path_criteria_reduce_their_own_metrics(self):
+        from fairseq.criterions.label_smoothed_cross_entropy import (
+            LabelSmoothedCrossEntropyCriterion,
+            LabelSmoothedCrossEntropyCriterion_DL,
+            LabelSmoothedCrossEntropyCriterion_NL,
+        )
+
+        for criterion in [
+            LabelSmoothedCrossEntropyCriterion_DL,
+            LabelSmoothedCrossEntropyCriterion_NL,
+        ]:
+            self.assertIsNot(
+                criterion.reduce_metrics.__func__,
+                LabelSmoothedCrossEntropyCriterion.reduce_metrics.__func__,
+            )
+        self.assertEqual(LabelSmoothedCrossEntropyCriterion_DL.num_paths, 2)
+        self.assertEqual(LabelSmoothedCrossEntropyCriterion_NL.num_paths, 3)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,14 @@
 import argparse
+import math
 import unittest
 from typing import Any, Dict, Sequence
 
 import torch
+from fairseq.criterions.label_smoothed_cross_entropy import (
+    LabelSmoothedCrossEntropyCriterion_NL,
+)
 from fairseq.models import transformer
+from fairseq.sequence_generator import EnsembleModel, SequenceGenerator
 
 from tests.test_roberta import FakeTask
 
@@ -26,7 +31,7 @@ def mk_sample(tok: Sequence[int] = None, batch_size: int = 2) -> Dict[str, Any]:
     return sample
 
 
-def mk_transformer(**extra_args: Any):
+def mk_transformer(model_cls=transformer.TransformerModel, **extra_args: Any):
     overrides = {
         # Use characteristics dimensions
         "encoder_embed_dim": 12,
@@ -46,7 +51,14 @@ def mk_transformer(**extra_args: Any):
 
     torch.manual_seed(0)
     task = FakeTask(args)
-    return transformer.TransformerModel.build_model(args, task)
+    return model_cls.build_model(args, task)
+
+
+def mk_transformer_NL(**extra_args: Any):
+    # the NL paths use 8 shared layers plus 4 Negotiator-only layers
+    return mk_transformer(
+        encoder_layers=12, decoder_layers=12, model_cls=transformer.TransformerModel_NL, **extra_args
+    )
 
 
 class TransformerTestCase(unittest.TestCase):
@@ -63,3 +75,251 @@ class TransformerTestCase(unittest.TestCase):
         o, _ = model.forward(**sample["net_input"])
         loss = o.sum()
         loss.backward()
+
+
+class TransformerNLScheduleTestCase(unittest.TestCase):
+    def test_default_schedule(self):
+        self.assertEqual(
+            transformer.NL_layer_schedule(12),
+            [[0, 1, 2, 3, 4, 5, 6, 7], [1, 1, 3, 3, 5, 5, 7, 7], [1, 8, 3, 9, 5, 10, 7, 11]],
+        )
+        self.assertEqual(
+            transformer.NL_layer_schedule(9),
+            [[0, 1, 2, 3, 4, 5], [1, 1, 3, 3, 5, 5], [1, 6, 3, 7, 5, 8]],
+        )
+        with self.assertRaises(ValueError):
+            transformer.NL_layer_schedule(8)
+
+    def test_shared_prefix_is_computed_once(self):
+        calls = []
+
+        def apply_layer(path, idx, layer, h):
+            calls.append((path, idx, layer))
+            return (h + [layer],)
+
+        outputs = transformer.run_NL_schedule(
+            transformer.NL_layer_schedule(12), [0, 0, 0], [], apply_layer
+        )
+        # the third path reuses layers[1] of the second path
+        self.assertEqual(len(calls), 23)
+        self.assertEqual(outputs[2][-1][0], [1, 8, 3, 9, 5, 10, 7, 11])
+
+        calls.clear()
+        transformer.run_NL_schedule(
+            transformer.NL_layer_schedule(12), [0, 1, 2], [], apply_layer
+        )
+        self.assertEqual(len(calls), 24)
+
+    def test_other_depths(self):
+        for extra_args in [
+            {"encoder_layers": 9, "decoder_layers": 9},
+            {
+                "encoder_layers": 6,
+                "decoder_layers": 6,
+                "encoder_nl_schedule": "0,1,2,3;1,1,3,3;1,4,3,5",
+                "decoder_nl_schedule": "0,1,2,3;1,1,3,3;1,4,3,5",
+            },
+        ]:
+            model = mk_transformer(model_cls=transformer.TransformerModel_NL, **extra_args)
+            sample = mk_sample()
+            x, y, z, _ = model.forward(**sample["net_input"])
+            (x.sum() + y.sum() + z.sum()).backward()
+
+
+class TransformerNLProjectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = mk_transformer_NL()
+        self.model.eval()
+        self.net_input = {
+            "src_tokens": torch.tensor([[10, 11, 12, 13, 2], [14, 15, 16, 17, 2]]),
+            "src_lengths": torch.tensor([5, 5]),
+            "prev_output_tokens": torch.tensor([[2, 10, 12, 11, 13], [2, 15, 14, 1, 1]]),
+        }
+
+    def test_single_projection_matches_per_path(self):
+        with torch.no_grad():
+            logits = self.model(**self.net_input)
+            features = self.model(**self.net_input, features_only=True)
+            for path in range(3):
+                expected = self.model.decoder.output_layer(features[path])
+                self.assertTrue(torch.allclose(logits[path], expected, atol=1e-5))
+                only = self.model(**self.net_input, path=path)
+                self.assertTrue(torch.allclose(only[path], expected, atol=1e-5))
+                self.assertTrue(all(only[p] is None for p in range(3) if p != path))
+
+    def test_chunked_loss_matches_full_loss(self):
+        task = FakeTask(None)
+        sample = {
+            "net_input": self.net_input,
+            "target": torch.tensor([[10, 12, 11, 13, 2], [15, 14, 2, 1, 1]]),
+            "ntokens": 8,
+        }
+        full = LabelSmoothedCrossEntropyCriterion_NL(task, False, 0.1)
+        chunked = LabelSmoothedCrossEntropyCriterion_NL(task, False, 0.1, projection_chunk_size=3)
+        expected = full(self.model, sample)[0]
+        expected["loss"].backward()
+        expected_grad = self.model.decoder.output_projection.weight.grad.clone()
+        self.model.zero_grad()
+        actual = chunked(self.model, sample)[0]
+        actual["loss"].backward()
+        self.assertEqual(expected.keys(), actual.keys())
+        for key in expected:
+            self.assertAlmostEqual(expected[key].item(), actual[key].item(), places=4)
+        self.assertTrue(
+            torch.allclose(self.model.decoder.output_projection.weight.grad, expected_grad, atol=1e-5)
+        )
+
+    def test_forward_of_some_paths(self):
+        with torch.no_grad():
+            full = self.model(**self.net_input)
+            some = self.model(**self.net_input, paths=[0, 2])
+            encoder_out = self.model.encoder(
+                self.net_input["src_tokens"], self.net_input["src_lengths"], paths=[2]
+            )
+        self.assertIsNone(some[1])
+        for path in [0, 2]:
+            self.assertTrue(torch.allclose(some[path], full[path], atol=1e-5))
+        self.assertEqual(encoder_out["encoder_out"], [])
+        self.assertEqual(encoder_out["encoder_out_2"], [])
+        self.assertEqual(len(encoder_out["encoder_out_3"]), 1)
+
+    def test_sampled_loss(self):
+        task = FakeTask(None)
+        sample = {
+            "net_input": self.net_input,
+            "target": torch.tensor([[10, 12, 11, 13, 2], [15, 14, 2, 1, 1]]),
+            "ntokens": 8,
+        }
+        # dropout is disabled, so training mode only enables the sampling
+        self.model.train()
+        with torch.no_grad():
+            full, _, _ = LabelSmoothedCrossEntropyCriterion_NL(task, False, 0.1)(self.model, sample)
+        for chunk_size in [0, 3]:
+            criterion = LabelSmoothedCrossEntropyCriterion_NL(
+                task, False, 0.1, projection_chunk_size=chunk_size, sample_paths=2
+            )
+            torch.manual_seed(1)
+            losses, _, logging_output = criterion(self.model, sample)
+            paths = [p for p in range(3) if logging_output["visits_{}".format(p + 1)]]
+            self.assertEqual(len(paths), 2)
+            path_losses = [losses["loss_{}".format(p + 1)] for p in range(3)]
+            for path in range(3):
+                expected = full["loss_{}".format(path + 1)].item() if path in paths else 0.0
+                self.assertAlmostEqual(path_losses[path].item(), expected, places=4)
+            self.assertAlmostEqual(
+                losses["loss"].item(), sum(path_losses[p].item() for p in paths) / 2, places=4
+            )
+            loss.backward()
+        self.model.eval()
+
+
+class TransformerNLIncrementalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = mk_transformer_NL()
+        self.model.eval()
+        self.src_tokens = torch.tensor([[10, 11, 12, 13, 2], [14, 15, 16, 17, 2]])
+        self.src_lengths = torch.tensor([5, 5])
+        self.prev_output_tokens = torch.tensor([[2, 10, 12, 11, 13], [2, 15, 14, 17, 16]])
+
+    def test_incremental_matches_full_decoding(self):
+        with torch.no_grad():
+            encoder_out = self.model.encoder(self.src_tokens, src_lengths=self.src_lengths)
+            full = self.model.decoder(self.prev_output_tokens, encoder_out=encoder_out)
+            incremental_state = {}
+            for step in range(1, self.prev_output_tokens.size(1) + 1):
+                out = self.model.decoder(
+                    self.prev_output_tokens[:, :step],
+                    encoder_out=encoder_out,
+                    incremental_state=incremental_state,
+                )
+                for path in range(3):
+                    self.assertEqual(out[path].size(1), 1)
+                    self.assertTrue(
+                        torch.allclose(out[path][:, -1], full[path][:, step - 1], atol=1e-5)
+                    )
+
+    def test_reorder_incremental_state(self):
+        new_order = torch.tensor([1, 0])
+        with torch.no_grad():
+            encoder_out = self.model.encoder(self.src_tokens, src_lengths=self.src_lengths)
+            reordered = self.model.encoder.reorder_encoder_out(encoder_out, new_order)
+            full = self.model.decoder(
+                self.prev_output_tokens.index_select(0, new_order), encoder_out=reordered
+            )
+            incremental_state = {}
+            for step in range(1, 3):
+                self.model.decoder(
+                    self.prev_output_tokens[:, :step],
+                    encoder_out=encoder_out,
+                    incremental_state=incremental_state,
+                )
+            self.model.decoder.reorder_incremental_state_scripting(incremental_state, new_order)
+            out = self.model.decoder(
+                self.prev_output_tokens.index_select(0, new_order)[:, :3],
+                encoder_out=reordered,
+                incremental_state=incremental_state,
+            )
+            for path in range(3):
+                self.assertTrue(torch.allclose(out[path][:, -1], full[path][:, 2], atol=1e-5))
+
+
+class TransformerNLGenerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = mk_transformer_NL()
+        self.model.eval()
+        self.sample = {
+            "net_input": {
+                "src_tokens": torch.tensor([[10, 11, 12, 13, 2], [14, 15, 16, 17, 2]]),
+                "src_lengths": torch.tensor([5, 5]),
+            },
+        }
+
+    def test_generate_NL_scores_the_chosen_paths(self):
+        eos = self.model.decoder.dictionary.eos()
+        with torch.no_grad():
+            encoder_out = self.model.encoder(**self.sample["net_input"])
+            for paths in [[0], [1], [2], [0, 1, 2], [1, 2]]:
+                generator = SequenceGenerator(
+                    [self.model], self.model.decoder.dictionary, beam_size=2, max_len_b=6, NL_paths=paths
+                )
+                hypos = generator.generate_NL([self.model], self.sample)
+                for i, hypo in enumerate(hypos):
+                    tokens = hypo[0]["tokens"]
+                    prev_output_tokens = torch.cat([tokens.new([eos]), tokens[:-1]]).unsqueeze(0)
+                    logits = self.model.decoder(
+                        prev_output_tokens,
+                        encoder_out=self.model.encoder.reorder_encoder_out(encoder_out, torch.tensor([i])),
+                    )
+                    lprobs = torch.stack([torch.log_softmax(logits[p], dim=-1)[0] for p in paths])
+                    lprobs = torch.logsumexp(lprobs, dim=0) - math.log(len(paths))
+                    expected = lprobs.gather(1, tokens.unsqueeze(1)).squeeze(1)
+                    self.assertTrue(torch.allclose(hypo[0]["positional_scores"], expected, atol=1e-4))
+
+    def test_forward_encoder_runs_the_chosen_paths(self):
+        ensemble = EnsembleModel([self.model], NL_paths=[2])
+        with torch.no_grad():
+            encoder_out = ensemble.forward_encoder(self.sample["net_input"])[0]
+            full = self.model.encoder(**self.sample["net_input"])
+            new_order = torch.tensor([1, 0])
+            reordered = self.model.encoder.reorder_encoder_out(encoder_out, new_order)
+        self.assertEqual(encoder_out["encoder_out"], [])
+        self.assertEqual(encoder_out["encoder_out_2"], [])
+        self.assertTrue(
+            torch.allclose(encoder_out["encoder_out_3"][0], full["encoder_out_3"][0], atol=1e-5)
+        )
+        self.assertEqual(reordered["encoder_out"], [])
+        self.assertTrue(
+            torch.equal(
+                reordered["encoder_out_3"][0], encoder_out["encoder_out_3"][0].index_select(1, new_order)
+            )
+        )
+
+    def test_extract_features_of_some_paths(self):
+        prev_output_tokens = torch.tensor([[2, 10, 12, 11], [2, 15, 14, 17]])
+        with torch.no_grad():
+            encoder_out = self.model.encoder(**self.sample["net_input"])
+            full = self.model.decoder.extract_features(prev_output_tokens, encoder_out)
+            some = self.model.decoder.extract_features(prev_output_tokens, encoder_out, paths=[2, 0])
+        self.assertIsNone(some[1])
+        for path in [0, 2]:
+            self.assertTrue(torch.allclose(some[path], full[path], atol=1e-5))
@@ -0,0 +1,82 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import torch
+from fairseq.translation_cache import TranslationCache, fingerprint_config
+
+
+def make_hypos(n):
+    return [{"tokens": torch.arange(n), "score": torch.tensor(-1.0), "alignment": None}]
+
+
+class TestTranslationCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = TranslationCache("model", max_entries=10)
+        src = torch.tensor([4, 5, 2])
+        self.assertIsNone(cache.get(src, "cfg"))
+        cache.put(src, "cfg", make_hypos(3))
+        hypos = cache.get(src, "cfg")
+        self.assertTrue(torch.equal(hypos[0]["tokens"], torch.arange(3)))
+        # other generation settings miss
+        self.assertIsNone(cache.get(src, "other"))
+        # returned hypotheses are copies
+        hypos[0]["tokens"].zero_()
+        self.assertTrue(torch.equal(cache.get(src, "cfg")[0]["tokens"], torch.arange(3)))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+
+    def test_lru_eviction_by_entries(self):
+        cache = TranslationCache("model", max_entries=2)
+        a, b, c = torch.tensor([1]), torch.tensor([2]), torch.tensor([3])
+        cache.put(a, "cfg", make_hypos(1))
+        cache.put(b, "cfg", make_hypos(1))
+        cache.get(a, "cfg")  # b is now the least recently used
+        cache.put(c, "cfg", make_hypos(1))
+        self.assertIsNotNone(cache.get(a, "cfg"))
+        self.assertIsNone(cache.get(b, "cfg"))
+        self.assertIsNotNone(cache.get(c, "cfg"))
+
+    def test_lru_eviction_by_bytes(self):
+        nbytes = 8 * 10 + 4  # int64 tokens and a float32 score
+        cache = TranslationCache("model", max_bytes=2 * nbytes)
+        for i in range(3):
+            cache.put(torch.tensor([i]), "cfg", make_hypos(10))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"]), (2, 2 * nbytes))
+        self.assertIsNone(cache.get(torch.tensor([0]), "cfg"))
+
+    def test_persistent_tier(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cache", "translations.db")
+            cache = TranslationCache("model", path=path)
+            cache.put(torch.tensor([7, 2]), "cfg", make_hypos(4))
+            cache.close()
+
+            cache = TranslationCache("model", path=path)
+            hypos = cache.get(torch.tensor([7, 2]), "cfg")
+            self.assertTrue(torch.equal(hypos[0]["tokens"], torch.arange(4)))
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            cache.close()
+
+            cache = TranslationCache("other model", path=path)
+            self.assertIsNone(cache.get(torch.tensor([7, 2]), "cfg"))
+            cache.close()
+
+    def test_fingerprint_config(self):
+        self.assertEqual(
+            fingerprint_config({"beam": 5, "lenpen": 1.0}),
+            fingerprint_config({"lenpen": 1.0, "beam": 5}),
+        )
+        self.assertNotEqual(
+            fingerprint_config({"beam": 5}), fingerprint_config({"beam": 4})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
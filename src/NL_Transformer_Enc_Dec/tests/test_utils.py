@@ -105,6 +105,18 @@ class TestUtils(unittest.TestCase):
         resolved = utils.resolve_max_positions(None, (2000, 100, 2000), 12000)
         self.assertEqual(resolved, (2000, 100, 2000))
 
+    def test_sum_logging_outputs(self):
+        logging_outputs = [
+            {"loss": torch.tensor(1.5), "ntokens": 3, "n_correct": torch.tensor(2)},
+            {"loss": torch.tensor(2.5), "ntokens": 4, "nll_loss": torch.tensor(1.0)},
+        ]
+        sums = utils.sum_logging_outputs(logging_outputs)
+        self.assertEqual(
+            sums, {"loss": 4.0, "ntokens": 7, "n_correct": 2, "nll_loss": 1.0}
+        )
+        self.assertIsInstance(sums["n_correct"], int)
+        self.assertEqual(utils.sum_logging_outputs([]), {})
+
     def assertAlmostEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
         self.assertLess(utils.item((t1 - t2).abs().max()), 1e-4)